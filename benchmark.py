@@ -0,0 +1,591 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from data_preprocessing import decode_values, preprocess_portfolio, preprocess_profile, preprocess_transcript
+from create_completion import create_completion_df, create_viewed_df
+from parallel import run_sharded
+import storage
+
+
+def timeit(func,*args,repeat=3,**kwargs):
+    '''run a function several times and return the best wall time
+
+    args:
+        func(callable): the function to time
+        repeat(int): the number of runs
+
+    returns:
+        best(float): the shortest wall time in seconds
+        result: the return value of the last run
+    '''
+    best=np.inf
+    for _ in range(repeat):
+        start=time.perf_counter()
+        result=func(*args,**kwargs)
+        best=min(best,time.perf_counter()-start)
+
+    return best,result
+
+def decode_values_apply(value):
+    '''the original decoding of the transcript payloads with one .apply per extracted column'''
+    decoded=pd.DataFrame(index=value.index)
+    decoded['offer id']=value.apply(lambda x:x.get('offer id') if 'offer id' in x else x.get('offer_id'))
+    decoded['amount']=value.apply(lambda x:x.get('amount'))
+    decoded['offer_reward']=value.apply(lambda x:x.get('reward'))
+
+    return decoded
+
+def bench_decode(transcript_file,repeat=3):
+    '''compare the single pass payload decoder with the three .apply calls
+
+    args:
+        transcript_file(str): path to the raw line-delimited transcript json
+        repeat(int): the number of runs of every decoder
+
+    returns:
+        results(dict): wall times in seconds, rows per second and speedups of the decoders
+    '''
+    import pyarrow.json
+
+    transcript=pd.read_json(transcript_file,lines=True)
+
+    t_apply,expected=timeit(decode_values_apply,transcript['value'],repeat=repeat)
+    t_decode,decoded=timeit(decode_values,transcript['value'],repeat=repeat)
+
+    #parsing the json text straight into a struct column skips building the payload dicts altogether
+    t_read,_=timeit(pd.read_json,transcript_file,lines=True,repeat=repeat)
+    t_bulk,bulk=timeit(lambda: decode_values(pyarrow.json.read_json(transcript_file).column('value')),repeat=repeat)
+
+    #the decoders have to agree before their timings mean anything
+    for result in [decoded,bulk]:
+        assert (result['offer id'].astype(object).fillna('').to_numpy()==expected['offer id'].fillna('').to_numpy()).all()
+        assert np.allclose(result['amount'],expected['amount'].astype(float),equal_nan=True)
+
+    n=transcript.shape[0]
+    results={'rows':n,'apply_s':t_apply,'decode_s':t_decode,'read_apply_s':t_read+t_apply,'arrow_read_decode_s':t_bulk,
+             'apply_rows_per_s':n/t_apply,'decode_rows_per_s':n/t_decode,'arrow_rows_per_s':n/t_bulk}
+
+    print('decode {} rows: apply {:.3f}s, single pass {:.3f}s, speedup {:.1f}x'.format(n,t_apply,t_decode,t_apply/t_decode))
+    print('read and decode {} rows: read_json+apply {:.3f}s, pyarrow struct {:.3f}s, speedup {:.1f}x'.format(
+        n,t_read+t_apply,t_bulk,(t_read+t_apply)/t_bulk))
+
+    return results
+
+def replicate(df,k,columns=['person','id'],stride=None):
+    '''scale a dataset by k with copies of every customer under new ids
+
+    args:
+        df(pandas dataframe): profile, transcript or offer_profile
+        k(int): the number of copies
+        columns(list): the customer id columns to make unique in every copy
+        stride(int): the distance of the integer codes of the copies, spread over the int32 range by default,
+            the number of customer codes keeps them dense for the lookups of dimensions.py
+
+    returns:
+        scaled(pandas dataframe): k copies of df
+    '''
+    copies=[]
+    for i in range(k):
+        copy=df.copy()
+        for col in columns:
+            if col in copy.columns and pd.api.types.is_integer_dtype(copy[col]):
+                #integer coded ids, every copy gets its own range of codes, the same for all datasets
+                copy[col]=copy[col].astype(np.int32)+np.int32(i*(stride or np.iinfo(np.int32).max//k))
+            elif col in copy.columns:
+                copy[col]=copy[col].astype(str)+'_{}'.format(i)
+        copies.append(copy)
+
+    return pd.concat(copies,ignore_index=True)
+
+def bench_viewed(transcript,offer_profile,scales=(1,10,100),repeat=1):
+    '''compare the interval and merge engines of create_viewed_df on replicated data
+
+    args:
+        transcript(pandas dataframe): the preprocessed transcript
+        offer_profile(pandas dataframe): the output of create_completion_df
+        scales(tuple): the numbers of copies of the customers to time
+        repeat(int): the number of runs of every engine
+
+    returns:
+        results(list): a dict of rows and wall times of both engines for every scale
+    '''
+    results=[]
+
+    for k in scales:
+        scaled_transcript=replicate(transcript,k)
+        scaled_offer_profile=replicate(offer_profile,k)
+
+        t_merge,expected=timeit(create_viewed_df,scaled_transcript,scaled_offer_profile,engine='merge',repeat=repeat)
+        t_interval,result=timeit(create_viewed_df,scaled_transcript,scaled_offer_profile,engine='interval',repeat=repeat)
+        pd.testing.assert_frame_equal(result,expected)
+
+        results.append({'scale':k,'rows':scaled_transcript.shape[0],'merge_s':t_merge,'interval_s':t_interval})
+        print('viewed x{} ({} events): merge {:.3f}s, interval {:.3f}s, speedup {:.1f}x'.format(
+            k,scaled_transcript.shape[0],t_merge,t_interval,t_merge/t_interval))
+
+    return results
+
+def bench_completion(portfolio,profile,transcript,scales=(1,10),repeat=1):
+    '''compare the interval and merge engines of create_completion_df on replicated data
+
+    args:
+        portfolio, profile, transcript(pandas dataframe): the preprocessed datasets
+        scales(tuple): the numbers of copies of the customers to time
+        repeat(int): the number of runs of every engine
+
+    returns:
+        results(list): a dict of rows and wall times of both engines for every scale
+    '''
+    results=[]
+    stride=int(max(profile['id'].max(),transcript['person'].max()))+1
+
+    for k in scales:
+        scaled_profile=replicate(profile,k,columns=['id'],stride=stride)
+        scaled_transcript=replicate(transcript,k,stride=stride)
+
+        t_merge,expected=timeit(create_completion_df,portfolio,scaled_profile,scaled_transcript,engine='merge',repeat=repeat)
+        t_interval,result=timeit(create_completion_df,portfolio,scaled_profile,scaled_transcript,engine='interval',repeat=repeat)
+        pd.testing.assert_frame_equal(result,expected)
+
+        results.append({'scale':k,'rows':scaled_transcript.shape[0],'merge_s':t_merge,'interval_s':t_interval})
+        print('completion x{} ({} events): merge {:.3f}s, interval {:.3f}s, speedup {:.1f}x'.format(
+            k,scaled_transcript.shape[0],t_merge,t_interval,t_merge/t_interval))
+
+    return results
+
+def check_engines(customers=1000,seed=0,work_dir=None):
+    '''check that the interval and index engines of create_completion_df and create_viewed_df give the rows
+       of the merge engines, the original filters of the merge of every offer with every event, on a small
+       synthetic dataset that is the same every run
+
+    args:
+        customers(int): the number of customers to generate
+        seed(int): the seed of generate_data.generate
+        work_dir(str): the directory to generate the data in, a temporary one by default
+
+    returns:
+        mismatches(list): a message for every engine whose rows differ, empty when they all match
+    '''
+    import tempfile
+    from generate_data import generate
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        generate(work_dir or tmp_dir,customers=customers,seed=seed)
+        portfolio,profile,transcript=load_raw(work_dir or tmp_dir)
+
+    mismatches=[]
+
+    def compare(step,engine,result,expected):
+        try:
+            pd.testing.assert_frame_equal(result,expected)
+        except AssertionError as e:
+            mismatches.append('{} {}: {}'.format(step,engine,e))
+
+    offer_profile=create_completion_df(portfolio,profile,transcript,engine='merge')
+    for engine in ['interval','index']:
+        compare('completion',engine,create_completion_df(portfolio,profile,transcript,engine=engine),offer_profile)
+
+    offer_profile_vie=create_viewed_df(transcript,offer_profile,engine='merge')
+    for engine in ['interval','index']:
+        compare('viewed',engine,create_viewed_df(transcript,offer_profile,engine=engine),offer_profile_vie)
+
+    print('{} offers of {} customers checked, {}'.format(offer_profile.shape[0],customers,
+                                                         'mismatches:\n'+'\n'.join(mismatches) if mismatches else 'all engines match'))
+
+    return mismatches
+
+def bench_sharded(portfolio,profile,transcript,workers=(1,2,4,8),shard_size=None):
+    '''time the sharded completion pipeline with different numbers of workers
+
+    args:
+        portfolio, profile, transcript(pandas dataframe): the preprocessed datasets
+        workers(tuple): the numbers of worker processes to time
+        shard_size(int): the number of customers per shard
+
+    returns:
+        results(list): a dict of the wall time and speedup over one worker for every number of workers
+    '''
+    results=[]
+
+    for n in workers:
+        wall,_=timeit(run_sharded,portfolio,profile,transcript,workers=n,shard_size=shard_size,repeat=1)
+        speedup=results[0]['wall_s']/wall if results else 1.0
+        results.append({'workers':n,'rows':transcript.shape[0],'wall_s':wall,'speedup':speedup})
+        print('sharded with {} workers ({} cores): {:.3f}s, speedup {:.2f}x'.format(n,os.cpu_count(),wall,speedup))
+
+    return results
+
+def bench_search(portfolio,profile,transcript,searches=(('grid',None),('halving',-1))):
+    '''time the hyperparameter searches of optimize_classifier on the same training set
+
+    args:
+        portfolio, profile, transcript(pandas dataframe): the preprocessed datasets
+        searches(list): the (search, n_jobs) pairs to compare
+
+    returns:
+        results(dict): the search time, best cross validated f1 and test f1 of every search
+    '''
+    from sklearn.metrics import f1_score
+    from sklearn.model_selection import train_test_split
+    from predictive_model import create_matrix, optimize_classifier
+
+    X,y,_=create_matrix(create_viewed_df(transcript,create_completion_df(portfolio,profile,transcript)))
+    X_train,X_test,y_train,y_test=train_test_split(X,y,random_state=0,stratify=y)
+
+    results={}
+    for search,n_jobs in searches:
+        start=time.perf_counter()
+        best_estimator,cv_results=optimize_classifier(X_train,y_train,search,n_jobs)
+        seconds=time.perf_counter()-start
+
+        best=np.nanargmax(cv_results['mean_test_score'])
+        results[search]={'seconds':seconds,'cv_f1':cv_results['mean_test_score'][best],
+                         'test_f1':f1_score(y_test,best_estimator.predict(X_test)),'params':cv_results['params'][best]}
+
+    for search,result in results.items():
+        print('{:<8} {:>8.2f}s cv f1 {:.4f} test f1 {:.4f} {}'.format(search,result['seconds'],result['cv_f1'],
+                                                                     result['test_f1'],result['params']))
+
+    return results
+
+def bench_encoding(portfolio,profile,transcript):
+    '''compare the one-hot encodings of the model features, and fitting the classifier on them
+
+    the get_dummies frame create_dataset used to build is compared with the feature_encoder formats
+
+    returns:
+        results(dict): for every encoding the seconds and peak memory of encoding and of fitting a
+            scaler and a decision tree, the megabytes of the features and their number
+    '''
+    from scipy import sparse
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.tree import DecisionTreeClassifier
+    from feature_encoder import fit_encoder, transform
+    from predictive_model import prepare_dataset, FEATURES_CAT
+
+    df,features_num=prepare_dataset(create_viewed_df(transcript,create_completion_df(portfolio,profile,transcript)))
+    encoder=fit_encoder(df,features_num,FEATURES_CAT)
+    y=df['target'].to_numpy()
+
+    def nbytes(X):
+        if isinstance(X,pd.DataFrame):
+            return X.memory_usage(index=False).sum()
+        if sparse.issparse(X):
+            return X.data.nbytes+X.indices.nbytes+X.indptr.nbytes
+        return X.nbytes
+
+    def fit(X):
+        classifier=DecisionTreeClassifier(max_depth=8,min_samples_leaf=4,random_state=0)
+        return Pipeline([('scaler',StandardScaler(with_mean=not sparse.issparse(X))),('classifier',classifier)]).fit(X,y)
+
+    encodings={'get_dummies':lambda: pd.concat([df[features_num],pd.get_dummies(df[FEATURES_CAT])],axis=1)}
+    for fmt in ['frame','dense','csr']:
+        encodings[fmt]=lambda fmt=fmt: transform(encoder,df,fmt)
+
+    results={}
+    for name,encode in encodings.items():
+        wall,peak_mb,X=measure(encode)
+        fit_wall,fit_peak_mb,_=measure(fit,X)
+        results[name]={'seconds':wall,'peak_mb':peak_mb,'mb':nbytes(X)/1024**2,'features':X.shape[1],
+                       'fit_seconds':fit_wall,'fit_peak_mb':fit_peak_mb}
+        print('{:<12} encode {:>7.3f}s peak {:>8.1f}MB result {:>8.1f}MB, fit {:>7.2f}s peak {:>8.1f}MB, {} features'.format(
+            name,wall,peak_mb,results[name]['mb'],fit_wall,fit_peak_mb,X.shape[1]))
+
+    return results
+
+def bench_backends(work_dir,scales=(17000,100000,300000),memory_limit=None):
+    '''time the pandas, the event index and the duckdb completion and viewed steps on synthetic data of several sizes
+
+    all of them read the preprocessed datasets and store offer_profile and offer_profile_vie, the index
+    backend builds and stores the event index as well, and their results are compared row for row
+    with the ones of pandas.
+
+    args:
+        work_dir(str): the directory to generate and preprocess the data in
+        scales(list): the numbers of customers
+        memory_limit(str): the memory duckdb may use before spilling to disk, e.g. '1GB'
+
+    returns:
+        results(dict): the seconds of every backend, the rows and whether they match, per number of customers
+    '''
+    from generate_data import generate
+    from data_preprocessing import stream_preprocess
+    from duckdb_backend import connect, create_completion_table, create_viewed_table
+
+    def run_pandas(directory):
+        portfolio,profile,transcript=[storage.read_table(name,directory) for name in ['portfolio','profile','transcript']]
+        offer_profile=create_completion_df(portfolio,profile,transcript)
+        storage.write_table(offer_profile,'offer_profile',directory)
+        storage.write_table(create_viewed_df(transcript,offer_profile),'offer_profile_vie',directory)
+
+    def run_index(directory):
+        from event_index import build_index, save_index
+        portfolio,profile,transcript=[storage.read_table(name,directory) for name in ['portfolio','profile','transcript']]
+        index=build_index(transcript)
+        save_index(index,directory)
+        offer_profile=create_completion_df(portfolio,profile,None,engine='index',index=index)
+        storage.write_table(offer_profile,'offer_profile',directory)
+        storage.write_table(create_viewed_df(None,offer_profile,engine='index',index=index),'offer_profile_vie',directory)
+
+    def run_duckdb(directory):
+        con=connect(memory_limit,os.path.join(directory,'.duckdb_tmp'))
+        create_completion_table(directory,con)
+        create_viewed_table(directory,con)
+
+    results={}
+    for customers in scales:
+        raw_dir=os.path.join(work_dir,'raw_{}'.format(customers))
+        generate(raw_dir,customers)
+
+        results[customers]={}
+        outputs={}
+        for backend,run in [('pandas',run_pandas),('index',run_index),('duckdb',run_duckdb)]:
+            directory=os.path.join(work_dir,'{}_{}'.format(backend,customers))
+            stream_preprocess(os.path.join(raw_dir,'*.json'),directory)
+
+            start=time.perf_counter()
+            run(directory)
+            results[customers][backend+'_s']=time.perf_counter()-start
+            outputs[backend]=storage.apply_schema(storage.read_table('offer_profile_vie',directory),'offer_profile_vie')
+
+        #the sums may differ in the last bits with the order they are added in
+        pandas_df=outputs['pandas']
+        floats=pandas_df.select_dtypes('float').columns
+        values=lambda df: df.drop(columns=floats).astype(object)
+        match=all(pandas_df.shape==df.shape and values(pandas_df).equals(values(df)) and
+                  np.allclose(pandas_df[floats].to_numpy(),df[floats].to_numpy(),rtol=0,atol=1e-9,equal_nan=True)
+                  for df in [outputs['index'],outputs['duckdb']])
+        results[customers].update({'rows':pandas_df.shape[0],'match':bool(match)})
+
+        print('{:>9} customers {:>9} offers pandas {:>8.2f}s index {:>8.2f}s duckdb {:>8.2f}s match {}'.format(
+            customers,pandas_df.shape[0],results[customers]['pandas_s'],results[customers]['index_s'],
+            results[customers]['duckdb_s'],match))
+
+    return results
+
+#the libraries that take most of the import time, reported when a command imports them
+HEAVY_MODULES=['numpy','pandas','pyarrow','scipy','sklearn','matplotlib','seaborn','duckdb']
+
+def import_time(args):
+    '''run python -X importtime with args in the directory of the scripts
+
+    returns:
+        wall_s(float): the wall time of the process
+        import_s(float): the time spent importing, the sum of the cumulative times of the top level imports
+        heavy(list): the modules of HEAVY_MODULES it imported
+    '''
+    env={key:value for key,value in os.environ.items() if key not in ('TRACE_FILE','TRACE_SAMPLE_MS')}
+    start=time.perf_counter()
+    proc=subprocess.run([sys.executable,'-X','importtime']+args,capture_output=True,text=True,env=env,
+                        cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall_s=time.perf_counter()-start
+
+    import_us,heavy=0,set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _,cumulative,name=line[len('import time:'):].split('|')
+        #the nested imports are indented below the module importing them
+        if not name[1:].startswith(' '):
+            import_us+=int(cumulative)
+        if name.strip().split('.')[0] in HEAVY_MODULES:
+            heavy.add(name.strip().split('.')[0])
+
+    return wall_s,import_us/1e6,sorted(heavy)
+
+def bench_startup(commands=None,repeat=3):
+    '''time the startup of the cli and the imports of every one of its commands with -X importtime
+
+    args:
+        commands(list): the commands of cli.COMMANDS to time, all of them by default
+        repeat(int): the number of runs, the fastest is kept
+
+    returns:
+        results(list): the wall and import seconds and the heavy modules of the cli help and of every command
+    '''
+    from cli import COMMANDS
+
+    runs=[('--help',['cli.py','--help'])]+[(name,['-c','import cli,'+','.join(COMMANDS[name]['modules'])])
+                                           for name in commands or COMMANDS]
+
+    results=[]
+    for name,args in runs:
+        times=[import_time(args) for _ in range(repeat)]
+        wall_s,import_s,heavy=min(times)
+        results.append({'command':name,'wall_s':wall_s,'import_s':import_s,'heavy':heavy})
+        print('{:<14} wall {:>6.3f}s import {:>6.3f}s {}'.format(name,wall_s,import_s,' '.join(heavy)))
+
+    return results
+
+def load_raw(data_dir='Data'):
+    '''read and preprocess the raw portfolio, profile and transcript json files, with the ids encoded'''
+    dictionaries={'person_ids':pd.Index([],dtype=object),'offer_ids':pd.Index([],dtype=object)}
+    return [storage.encode_ids(preprocess(pd.read_json('{}/{}.json'.format(data_dir,name),lines=True)),name,dictionaries)
+            for name,preprocess in [('portfolio',preprocess_portfolio),('profile',preprocess_profile),
+                                    ('transcript',preprocess_transcript)]]
+
+def measure(func,*args,trace_memory=True,**kwargs):
+    '''run a function once and measure its wall time and the peak memory it allocates
+
+    args:
+        func(callable): the function to run
+        trace_memory(bool): trace the allocations in a second run, numpy and pandas buffers included
+
+    returns:
+        wall(float): the wall time in seconds of the untraced run
+        peak_mb(float): the peak of the memory allocated during the traced run, in MB
+        result: the return value of the untraced run
+    '''
+    start=time.perf_counter()
+    result=func(*args,**kwargs)
+    wall=time.perf_counter()-start
+
+    peak_mb=np.nan
+    if trace_memory:
+        tracemalloc.start()
+        func(*args,**kwargs)
+        peak_mb=tracemalloc.get_traced_memory()[1]/1024**2
+        tracemalloc.stop()
+
+    return wall,peak_mb,result
+
+def bench_stages(data_dir,out_file=None,trace_memory=True):
+    '''time every stage of the pipeline on the raw files in data_dir
+
+    args:
+        data_dir(str): a directory with portfolio.json, profile.json and transcript.json, e.g. from generate_data.py
+        out_file(str): the json file to write the results to
+        trace_memory(bool): measure the peak memory of every stage
+
+    returns:
+        results(dict): meta data of the run and for every stage the wall time, peak memory, rows and rows per second
+    '''
+    from binning import apply_bins, fit_bins
+    from predictive_model import create_dataset, create_matrix
+
+    stages={}
+
+    def run(name,func,*args,rows=None):
+        #the preprocessing functions change their input, so every run gets its own copy
+        copies=lambda: [arg.copy() if isinstance(arg,pd.DataFrame) else arg for arg in args]
+        wall,peak_mb,result=measure(lambda: func(*copies()),trace_memory=trace_memory)
+        rows=result.shape[0] if rows is None else rows
+        stages[name]={'wall_s':wall,'peak_mb':peak_mb,'rows':rows,'rows_per_s':rows/wall}
+        print('{:<24} {:>10} rows {:>9.3f}s {:>9.1f}MB {:>12.0f} rows/s'.format(name,rows,wall,peak_mb,rows/wall))
+        return result
+
+    raw={name:os.path.join(data_dir,name+'.json') for name in ['portfolio','profile','transcript']}
+    portfolio_raw=pd.read_json(raw['portfolio'],lines=True)
+    profile_raw=pd.read_json(raw['profile'],lines=True)
+    transcript_raw=run('read_transcript',lambda: pd.read_json(raw['transcript'],lines=True))
+
+    #rows are the input rows of every stage
+    portfolio=run('preprocess_portfolio',preprocess_portfolio,portfolio_raw)
+    profile=run('preprocess_profile',preprocess_profile,profile_raw)
+    transcript=run('preprocess_transcript',preprocess_transcript,transcript_raw)
+    del transcript_raw
+
+    #the customer and offer ids are replaced by integer codes, as data_preprocessing.py stores them
+    dictionaries={'person_ids':pd.Index([],dtype=object),'offer_ids':pd.Index([],dtype=object)}
+    portfolio=storage.encode_ids(portfolio,'portfolio',dictionaries)
+    profile=storage.encode_ids(profile,'profile',dictionaries)
+    transcript=run('encode_ids',storage.encode_ids,transcript,'transcript',dictionaries)
+
+    offer_profile=run('create_completion_df',create_completion_df,portfolio,profile,transcript,rows=transcript.shape[0])
+    offer_profile_vie=run('create_viewed_df',create_viewed_df,transcript,offer_profile,rows=transcript.shape[0])
+    bins=run('fit_bins',fit_bins,offer_profile_vie,rows=offer_profile_vie.shape[0])
+    run('apply_bins',apply_bins,offer_profile_vie,bins)
+    run('create_dataset',create_dataset,offer_profile_vie,bins,rows=offer_profile_vie.shape[0])
+    run('create_matrix',create_matrix,offer_profile_vie,bins,rows=offer_profile_vie.shape[0])
+
+    results={'meta':{'data_dir':data_dir,'customers':profile.shape[0],'events':transcript.shape[0],
+                     'time':time.strftime('%Y-%m-%dT%H:%M:%S'),'python':platform.python_version(),
+                     'pandas':pd.__version__,'numpy':np.__version__,'cpus':os.cpu_count()},
+             'stages':stages}
+
+    if out_file:
+        with open(out_file,'w') as f:
+            json.dump(results,f,indent=2)
+
+    return results
+
+def compare_results(results,baseline,tolerance=1.25):
+    '''find the stages that got slower than a baseline run on the same data
+
+    args:
+        results, baseline(dict): the results of bench_stages, or paths to their json files
+        tolerance(float): the allowed ratio of wall time and peak memory to the baseline
+
+    returns:
+        regressions(list): a message for every stage whose wall time or peak memory grew beyond tolerance
+    '''
+    if isinstance(results,str):
+        with open(results) as f:
+            results=json.load(f)
+    if isinstance(baseline,str):
+        with open(baseline) as f:
+            baseline=json.load(f)
+
+    regressions=[]
+    for name,stage in results['stages'].items():
+        if name not in baseline['stages']:
+            continue
+        for metric in ['wall_s','peak_mb']:
+            ratio=stage[metric]/baseline['stages'][name][metric]
+            if ratio>tolerance:
+                regressions.append('{} {} {:.3f} is {:.2f}x the baseline'.format(name,metric,stage[metric],ratio))
+
+    return regressions
+
+if __name__=='__main__':
+    #python benchmark.py decode|viewed|completion|sharded|search|encoding|backends|startup|stages|check [data directory] [stages: results.json [baseline.json]]
+    bench=sys.argv[1] if len(sys.argv)>1 else 'decode'
+    data_dir=sys.argv[2] if len(sys.argv)>2 else 'Data'
+
+    if bench=='decode':
+        bench_decode('{}/transcript.json'.format(data_dir))
+
+    if bench=='viewed':
+        portfolio,profile,transcript=load_raw(data_dir)
+        bench_viewed(transcript,create_completion_df(portfolio,profile,transcript))
+
+    if bench=='completion':
+        bench_completion(*load_raw(data_dir))
+
+    if bench=='sharded':
+        bench_sharded(*load_raw(data_dir),shard_size=int(sys.argv[3]) if len(sys.argv)>3 else None)
+
+    if bench=='search':
+        bench_search(*load_raw(data_dir))
+
+    if bench=='encoding':
+        bench_encoding(*load_raw(data_dir))
+
+    if bench=='backends':
+        #python benchmark.py backends work_dir [customers ...]
+        bench_backends(data_dir,[int(n) for n in sys.argv[3:]] or (17000,100000,300000))
+
+    if bench=='startup':
+        #python benchmark.py startup [commands ...]
+        bench_startup(sys.argv[2:] or None)
+
+    if bench=='check':
+        #python benchmark.py check [customers [seed]], fails when an engine gives other rows than the merge engines
+        mismatches=check_engines(*[int(n) for n in sys.argv[2:4]])
+        sys.exit(1 if mismatches else 0)
+
+    if bench=='stages':
+        results=bench_stages(data_dir,out_file=sys.argv[3] if len(sys.argv)>3 else None)
+        if len(sys.argv)>4:
+            regressions=compare_results(results,sys.argv[4])
+            print('\n'.join(regressions) or 'no regressions')
+            sys.exit(1 if regressions else 0)
@@ -0,0 +1,110 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import storage
+from instrument import traced
+
+#the binned columns: the column they bin, the prefix of their labels, and either the quantiles the edges
+#are fitted at or fixed edges. Quantiles are used for income and membership duration so that the
+#resulting bins end up to be more uniform
+BINS={
+    'Inc':{'column':'income','label':'inc','quantiles':[0,.25,.5,.75,1.]},
+    'Age':{'column':'age','label':'age','edges':[17,40,60,80,102]},
+    'Dur':{'column':'membership_duration(days)','label':'dur','quantiles':[0,.25,.5,.75,1.]},
+}
+
+
+def bins_path(directory=storage.DATA_DIR):
+    '''the path of the file holding the fitted bin edges'''
+    return os.path.join(directory,'bins.json')
+
+@traced
+def fit_bins(offer_profile_vie):
+    '''compute the bin edges, the quantile edges are the ones pd.qcut would use
+
+    args:
+        offer_profile_vie(pandas dataframe): the offers with the age, income and membership duration of the customers
+
+    returns:
+        bins(dict): the edges of every binned column, e.g. {'Inc':[30000.0,51000.0,...],...}
+    '''
+    bins={}
+    for name,spec in BINS.items():
+        if 'edges' in spec:
+            bins[name]=[float(edge) for edge in spec['edges']]
+        else:
+            values=offer_profile_vie[spec['column']].to_numpy(dtype=np.float64)
+            bins[name]=np.quantile(values[~np.isnan(values)],spec['quantiles']).tolist()
+
+    return bins
+
+def save_bins(bins,directory=storage.DATA_DIR):
+    '''store the fitted bin edges as json'''
+    os.makedirs(directory,exist_ok=True)
+    with open(bins_path(directory),'w') as f:
+        json.dump(bins,f)
+
+def load_bins(directory=storage.DATA_DIR):
+    '''read the stored bin edges'''
+    with open(bins_path(directory)) as f:
+        return json.load(f)
+
+def bin_labels(name,bins):
+    '''the labels of the groups of a binned column, e.g. ['inc_g1','inc_g2',...]'''
+    return ['{}_g{}'.format(BINS[name]['label'],i+1) for i in range(len(bins[name])-1)]
+
+def bin_codes(name,values,bins):
+    '''locate values between the fitted edges of a binned column
+
+    args:
+        name(str): the binned column, see BINS
+        values(ndarray): float values of the column it bins
+        bins(dict): the edges from fit_bins or load_bins
+
+    returns:
+        codes(ndarray): the group of every value, -1 for values outside the edges or missing
+    '''
+    edges=np.asarray(bins[name],dtype=np.float64)
+
+    codes=np.searchsorted(edges,values,side='left')-1
+    if 'quantiles' in BINS[name]:
+        codes[values==edges[0]]=0
+    codes[(codes<0) | (codes>=len(edges)-1) | np.isnan(values)]=-1
+
+    return codes
+
+@traced
+def apply_bins(offer_profile_vie,bins):
+    '''add the Inc, Age and Dur columns by locating every value between the fitted edges
+
+    the bins are closed on the right like pd.cut, the lowest quantile bin includes its lower edge like
+    pd.qcut, and values outside the edges are missing. The labels go up with the values, inc_g1 is the
+    lowest income group.
+
+    args:
+        offer_profile_vie(pandas dataframe): the offers with the age, income and membership duration of the customers
+        bins(dict): the edges from fit_bins or load_bins
+
+    returns:
+        offer_profile_vie(pandas dataframe): a copy with the Inc, Age and Dur categorical columns
+    '''
+    offer_profile_vie=offer_profile_vie.copy()
+
+    for name,spec in BINS.items():
+        codes=bin_codes(name,offer_profile_vie[spec['column']].to_numpy(dtype=np.float64),bins)
+        offer_profile_vie[name]=pd.Categorical.from_codes(codes,categories=bin_labels(name,bins))
+
+    return offer_profile_vie
+
+def fit_or_load_bins(offer_profile_vie,directory=storage.DATA_DIR):
+    '''read the stored bin edges, or fit them on offer_profile_vie and store them when there are none yet'''
+    if os.path.isfile(bins_path(directory)):
+        return load_bins(directory)
+
+    bins=fit_bins(offer_profile_vie)
+    save_bins(bins,directory)
+
+    return bins
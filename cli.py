@@ -0,0 +1,130 @@
+import argparse
+import json
+import sys
+
+#the default directory of the datasets, storage.DATA_DIR, which isn't imported here so that starting the cli
+#doesn't import pandas
+DATA_DIR='preprocessed'
+MODEL_DIR='model'
+
+
+def _preprocess(args):
+    from data_preprocessing import stream_preprocess
+    stream_preprocess(files_path=args.raw,outdir=args.data_dir,chunksize=args.chunksize,fmt=args.format)
+
+def _completion(args):
+    if args.engine=='duckdb':
+        from duckdb_backend import create_completion_table, create_viewed_table
+        create_completion_table(args.data_dir)
+        create_viewed_table(args.data_dir)
+        return
+
+    import storage
+    from create_completion import create_completion_df, create_viewed_df
+
+    portfolio,profile,transcript=[storage.read_table(name,args.data_dir) for name in ['portfolio','profile','transcript']]
+
+    index=None
+    if args.engine=='index':
+        from event_index import build_index, save_index
+        index=build_index(transcript)
+        save_index(index,args.data_dir)
+
+    offer_profile=create_completion_df(portfolio,profile,transcript,engine=args.engine,index=index)
+    storage.write_table(offer_profile,'offer_profile',args.data_dir,fmt=args.format)
+    storage.write_table(create_viewed_df(transcript,offer_profile,engine=args.engine,index=index),'offer_profile_vie',
+                        args.data_dir,fmt=args.format)
+
+def _index(args):
+    import storage
+    from event_index import build_index, save_index
+    save_index(build_index(storage.read_table('transcript',args.data_dir,columns=['person','event','time','offer id','amount'])),
+               args.data_dir)
+
+def _vis(args):
+    from render import FIGURES, render_figures
+    render_figures(args.figures or [name for name in FIGURES if name!='profile'],args.data_dir,args.out_dir,args.format,
+                   args.dpi,args.workers)
+
+def _profile_plot(args):
+    from render import render_figures
+    render_figures(['profile'],args.data_dir,args.out_dir,args.format,args.dpi,1)
+
+def _train(args):
+    import storage
+    from binning import fit_or_load_bins
+    from predictive_model import train_model, MODEL_COLUMNS
+
+    offer_profile_vie=storage.read_table('offer_profile_vie',args.data_dir,columns=MODEL_COLUMNS)
+    train_model(offer_profile_vie,fit_or_load_bins(offer_profile_vie,args.data_dir),search=args.search,
+                n_jobs=-1 if args.search=='halving' else None,model_dir=args.model_dir)
+
+def _score(args):
+    from scoring import load_scorer, serve
+    scorer=load_scorer(args.data_dir,args.model_dir)
+
+    if args.customer is None:
+        return serve(scorer,args.host,args.port)
+
+    customer=json.loads(args.customer)
+    print(json.dumps(scorer.score(customer,customer.pop('k',args.k)),indent=1))
+
+#the subcommands: their help, the arguments they add, how to run them and the modules they import when
+#they run, which benchmark.py startup times with -X importtime
+COMMANDS={
+    'preprocess':{'help':'preprocess the raw json files into typed datasets',
+                  'args':[(['--raw'],{'default':'Data/*.json','help':'glob pattern of the raw files'}),
+                          (['--chunksize'],{'type':int,'default':100000}),
+                          (['--format'],{'default':'feather','choices':['feather','parquet','csv']})],
+                  'run':_preprocess,'modules':['data_preprocessing']},
+    'completion':{'help':'find which offers were completed and viewed',
+                  'args':[(['--engine'],{'default':'interval','choices':['interval','merge','index','duckdb']}),
+                          (['--format'],{'default':'feather','choices':['feather','parquet','csv']})],
+                  'run':_completion,'modules':['create_completion','event_index']},
+    'index':{'help':'build the per-person event index of the transcript',
+             'args':[],'run':_index,'modules':['event_index']},
+    'vis':{'help':'render the offer completion figures',
+           'args':[(['figures'],{'nargs':'*','help':'the figures to render, all but profile by default'}),
+                   (['--out-dir'],{'default':'.'}),(['--format'],{'default':'JPEG'}),
+                   (['--dpi'],{'type':int,'default':None}),(['--workers'],{'type':int,'default':None})],
+           'run':_vis,'modules':['render','create_vis']},
+    'profile-plot':{'help':'render the distribution of the customer profiles',
+                    'args':[(['--out-dir'],{'default':'.'}),(['--format'],{'default':'JPEG'}),
+                            (['--dpi'],{'type':int,'default':None})],
+                    'run':_profile_plot,'modules':['render','create_profile_distribution']},
+    'train':{'help':'tune and store the decision tree',
+             'args':[(['--search'],{'default':'grid','choices':['grid','halving']}),
+                     (['--model-dir'],{'default':MODEL_DIR})],
+             'run':_train,'modules':['binning','predictive_model','sklearn.model_selection','sklearn.tree',
+                                     'matplotlib.pyplot']},
+    'score':{'help':'score a customer, given as json, against the offers, or serve the scores over http',
+             'args':[(['customer'],{'nargs':'?','help':'e.g. \'{"gender":"F","age":55,"income":112000}\''}),
+                     (['-k'],{'type':int,'default':None}),(['--model-dir'],{'default':MODEL_DIR}),
+                     (['--host'],{'default':'127.0.0.1'}),(['--port'],{'type':int,'default':8000})],
+             'run':_score,'modules':['scoring']},
+}
+
+
+def build_parser():
+    '''the parser of the cli, a subparser per command of COMMANDS'''
+    parser=argparse.ArgumentParser(description='analyse the Starbucks promotion dataset')
+    parser.add_argument('--data-dir',default=DATA_DIR,help='the directory of the datasets')
+    subparsers=parser.add_subparsers(dest='command',required=True)
+
+    for name,command in COMMANDS.items():
+        subparser=subparsers.add_parser(name,help=command['help'],description=command['help'])
+        for flags,kwargs in command['args']:
+            subparser.add_argument(*flags,**kwargs)
+
+    return parser
+
+def main(argv=None):
+    args=build_parser().parse_args(argv)
+
+    try:
+        COMMANDS[args.command]['run'](args)
+    except FileNotFoundError as e:
+        sys.exit('missing {}, please run the steps before {} first'.format(e.filename or e,args.command))
+
+if __name__=='__main__':
+    main()
@@ -1,31 +1,42 @@
 import numpy as np
 import pandas as pd
-import glob
-import os
+import sys
 
-from os import listdir
-from os.path import isfile, join
-from data_preprocessing import read_dataset
+from interval_join import window_aggregate
+from event_index import build_index, event_rows, window_slices, window_sum, window_max, window_match
+from dimensions import build_dimension, lookup
+import storage
+from instrument import span, traced
 
-def create_completion_df(portfolio,profile,transcript):
-    '''determining if a user has completed an offer and the amount of money spent and create a new dataframe
+def _offer_amounts(offer_profile,transactions,engine,index=None):
+    '''calculate the sum and max value of amounts of the transactions made during the opening time of each offer
 
     args:
-        portfolio, profile, transcript(dataframe): the preprocessed dataset containing information on offer, user, and transactions
-
-    return:
-        offer_profile(dataframe): a new dataframe containing user offer information and if the user accepted the offer
+        offer_profile(dataframe): the received offers with person, offer id, time_rec and their deadline offer_del
+        transactions(dataframe): person, time and amount of all the transactions
+        engine(str): 'interval' to use the sort based interval join, 'merge' to merge every offer with every transaction,
+            'index' to look up the transactions of every offer in the event index
+        index(dict): the event index from event_index.py, used by the index engine
+
+    returns:
+        offer_tran(dataframe): person, offer id, time_rec, amount_sum and amount_max of every received offer
     '''
+    offer_tran=offer_profile[['person','offer id','time_rec']]
+
+    if engine=='index':
+        lo,hi=window_slices(index,offer_profile['person'],'transaction',offer_profile['time_rec'],offer_profile['offer_del'])
+        offer_tran=offer_tran.assign(amount_sum=window_sum(index,lo,hi),amount_max=window_max(index,lo,hi))
 
-    #separate the event of receiving an offer and making transactions and merge them
-    transcript_received=transcript[transcript['event']=='offer received']
-    transcript_received=transcript_received.merge(portfolio,how='left',left_on='offer id',right_on='id')
-    transcript_received['offer_del']=transcript_received['time']+transcript_received['duration']*24
+        return offer_tran.fillna(0)
 
-    transactions=transcript[transcript['event']=='transaction'][['person','time','amount']]
-    transactions.head()
+    if engine=='interval':
+        agg=window_aggregate(offer_profile,transactions,on=['person'],start='time_rec',end='offer_del',value='amount')
+        offer_tran=offer_tran.assign(amount_sum=agg['sum'].to_numpy(),amount_max=agg['max'].to_numpy())
 
-    transcript_received_tran=transcript_received.merge(transactions,how='left',on='person',suffixes=['_rec','_tran'])
+        return offer_tran.fillna(0)
+
+    transactions=transactions.rename(columns={'time':'time_tran','amount':'amount_tran'})
+    transcript_received_tran=offer_tran.assign(offer_del=offer_profile['offer_del']).merge(transactions,how='left',on='person')
 
     #filter out all the transactions within the receiving offer time and offer deadline
     condition1=(transcript_received_tran['time_tran']>=transcript_received_tran['time_rec'])
@@ -33,66 +44,57 @@ def create_completion_df(portfolio,profile,transcript):
     transcript_received_filtran=transcript_received_tran[condition1 & condition2]
 
     #calulate the sum and max value of amounts of the transactions during the offer opening time
-    offer_tran=transcript_received_filtran.groupby(['person','offer id','time_rec']).agg({'amount_tran':[sum,max]}).reset_index()
-    offer_tran.columns=['person','offer id','time_rec','amount_sum','amount_max']
+    amounts=transcript_received_filtran.groupby(['person','offer id','time_rec'],observed=True).agg({'amount_tran':['sum','max']}).reset_index()
+    amounts.columns=['person','offer id','time_rec','amount_sum','amount_max']
 
     #fill the amount_sum and amount_max with 0 when users didn't make transactions during the offer opening time
-    offer_tran=transcript_received.rename(columns={'time':'time_rec'})[['person','offer id','time_rec']].\
-    merge(offer_tran,how='left',on=['person','offer id','time_rec'])
-
-    offer_tran=offer_tran.fillna(0)
+    offer_tran=offer_tran.merge(amounts,how='left',on=['person','offer id','time_rec'])
 
-    #include extra information about offers
-    offer_tran=offer_tran.merge(portfolio,how='left',left_on='offer id',right_on='id')
+    return offer_tran.fillna(0)
 
-    #separate offer_tran into dataframes with bogo and discout offers
-    offer_tran_bogo=offer_tran[offer_tran['offer_type']=='bogo']
-    offer_tran_dis=offer_tran[offer_tran['offer_type']=='discount']
-    offer_tran_info=offer_tran[offer_tran['offer_type']=='informational']
+def _amounts_till_completion(offer_completed,transcript_com,transactions,engine,index=None):
+    '''calculate the sum and number of the transactions made between receiving and completing an offer
 
-    #determine the completed and not completed offers of different types
-    offer_dis_com=offer_tran_dis[offer_tran_dis['amount_sum']>=offer_tran_dis['difficulty']]
-    offer_dis_ncom=offer_tran_dis[offer_tran_dis['amount_sum']<offer_tran_dis['difficulty']]
-
-    offer_bogo_com=offer_tran_bogo[offer_tran_bogo['amount_max']>offer_tran_bogo['difficulty']]
-    offer_bogo_ncom=offer_tran_bogo[offer_tran_bogo['amount_max']<=offer_tran_bogo['difficulty']]
-
-    #determine the completed and not completed offers
-    offer_com=pd.concat([offer_dis_com,offer_bogo_com])
-    offer_ncom=pd.concat([offer_dis_ncom,offer_bogo_ncom])
-
-    #add label indicating whether the offer is completed
-    offer_com['complete']=np.ones(offer_com.shape[0])
-    offer_ncom['complete']=np.zeros(offer_ncom.shape[0])
+    args:
+        offer_completed(dataframe): the completed offers with person, offer id and time_rec
+        transcript_com(dataframe): the 'offer completed' events
+        transactions(dataframe): person, time and amount of all the transactions
+        engine(str), index(dict): 'interval', 'merge' or 'index', see _offer_amounts
 
-    User_offer=pd.concat([offer_com,offer_ncom])
+    returns:
+        offer_completed(dataframe): person, time_rec, offer id, sum_till_com and num_till_com
+    '''
+    offer_completed=offer_completed[['person','time_rec','offer id']]
 
-    #add the informational offer
-    offer_tran_info.loc[:,'complete']=-1*np.ones(offer_tran_info.shape[0])
+    if engine=='index':
+        #the completion time is the first completion of the same offer at or after receiving it
+        lo,hi=window_slices(index,offer_completed['person'],'offer completed',offer_completed['time_rec'],np.inf)
+        count,first=window_match(index,lo,hi,offer_completed['offer id'])
+        offer_completed=offer_completed.assign(time_com=first)[count>0]
 
-    User_offer=pd.concat([User_offer,offer_tran_info])
+        lo,hi=window_slices(index,offer_completed['person'],'transaction',offer_completed['time_rec'],offer_completed['time_com'])
+        offer_completed=offer_completed.assign(sum_till_com=window_sum(index,lo,hi),num_till_com=hi-lo)[hi>lo]
 
-    User_offer=User_offer.merge(profile,how='left',left_on='person',right_on='id')
+        return offer_completed.drop(columns=['time_com']).reset_index(drop=True)
 
-    User_offer=User_offer.drop(columns=['id_x','id_y'])
+    if engine=='interval':
+        #the completion time is the first completion of the same offer at or after receiving it
+        com=window_aggregate(offer_completed,transcript_com,on=['person','offer id'],start='time_rec',end=np.inf)
+        offer_completed=offer_completed.assign(time_com=com['first'].to_numpy())
+        offer_completed=offer_completed[com['count'].to_numpy()>0]
 
-    #add information of a user
-    offer_profile=transcript_received.merge(profile,how='left',left_on='person',right_on='id')
-    offer_profile=offer_profile.drop(columns=['event','value','amount','id_x','id_y']).rename(columns={'time':'time_rec'})
+        tran=window_aggregate(offer_completed,transactions,on=['person'],start='time_rec',end='time_com',value='amount')
+        offer_completed=offer_completed.assign(sum_till_com=tran['sum'].to_numpy(),num_till_com=tran['count'].to_numpy())
+        offer_completed=offer_completed[tran['count'].to_numpy()>0]
 
-    features_retain=['person','offer id','time_rec','amount_sum','amount_max','complete']
-    offer_profile=offer_profile.merge(User_offer[features_retain],how='left',on=['person','offer id','time_rec'])
-    
-    transcript_com=transcript[transcript['event']=='offer completed']
-    offer_completed=offer_profile[offer_profile['complete']==1]
+        return offer_completed.drop(columns=['time_com']).reset_index(drop=True)
 
     offer_completed=offer_completed.merge(transcript_com[['person','offer id','time']],how='left',on=['person','offer id'])
-    #offer_completed=offer_completed.drop(columns=['offer_reward_x','event','value','amount','offer_reward_y'])
 
     offer_completed['com_rec_diff']=offer_completed['time']-offer_completed['time_rec']
-    offer_completed=offer_completed[offer_completed['com_rec_diff']>=0].drop(columns=['offer_reward','time'])
+    offer_completed=offer_completed[offer_completed['com_rec_diff']>=0].drop(columns=['time'])
 
-    offer_completed=offer_completed.groupby(by=['person','time_rec','offer id'])['com_rec_diff'].apply(min).reset_index()
+    offer_completed=offer_completed.groupby(by=['person','time_rec','offer id'],observed=True)['com_rec_diff'].apply(min).reset_index()
 
     offer_completed['time_com']=offer_completed['time_rec']+offer_completed['com_rec_diff']
 
@@ -105,27 +107,102 @@ def create_completion_df(portfolio,profile,transcript):
 
     offer_completed=offer_completed[condition_com & condition_rec]
 
-    offer_completed=offer_completed.groupby(['person','time_rec','offer id']).agg({'amount':[sum,len]}).reset_index()
+    offer_completed=offer_completed.groupby(['person','time_rec','offer id'],observed=True).agg({'amount':['sum',len]}).reset_index()
     offer_completed.columns=['person','time_rec','offer id','sum_till_com','num_till_com']
 
-    offer_profile=offer_profile.merge(offer_completed,how='left',on=['person','time_rec','offer id'])
-    offer_profile=offer_profile.drop(columns=['offer_reward'])
+    return offer_completed
 
-    offer_profile=offer_profile[offer_profile['offer_type']!='informational']
-    offer_profile['complete']=offer_profile['complete'].astype(np.int32)
+def _index_received(index):
+    '''the received offers of the event index with person, time_rec and offer id, in the order of the transcript'''
+    rows=event_rows(index,'offer received')
+    meta=index['meta']
 
-    offer_profile=offer_profile.dropna(subset=['gender','income'])
+    return pd.DataFrame({'person':(index['key'][rows]//meta['span']//len(meta['events'])).astype(np.int32),
+                         'time_rec':index['time'][rows],'offer id':index['offer'][rows]})
 
-    return offer_profile
-
-def create_viewed_df(transcript,offer_profile):
-    '''determine whether an offer is viewed by a customer before or after completion when the offer is completed,
-        or whether an offer is viewed when the offer is not completed
+@traced
+def create_completion_df(portfolio,profile,transcript,engine='interval',index=None):
+    '''determining if a user has completed an offer and the amount of money spent and create a new dataframe
 
     args:
-        transcript(pandas dataframe): transactions log
-        offer_profile(pandas dataframe): a dataset containing information on customer, offers and whether the offer is completed 
+        portfolio, profile, transcript(dataframe): the preprocessed dataset containing information on offer, user, and transactions
+        engine(str): 'interval' to find the transactions inside every offer window with the sort based interval join
+            in interval_join.py, 'merge' to filter the merge of every offer with every transaction of the same person,
+            'index' to look up the events of every offer window in the per-person event index of event_index.py
+        index(dict): the event index of transcript, built from it when not given; with an index the
+            transcript isn't read and can be None
+
+    return:
+        offer_profile(dataframe): a new dataframe containing user offer information and if the user accepted the offer
     '''
+    if engine not in ('interval','merge','index'):
+        raise ValueError('unknown engine {}'.format(engine))
+    if engine=='index' and index is None:
+        index=build_index(transcript)
+
+    #the offer and customer attributes are looked up by their integer codes instead of merged
+    offers=build_dimension(portfolio,'id')
+    customers=build_dimension(profile,'id')
+
+    #separate the event of receiving an offer and making transactions
+    with span('create_completion_df.received',transcript) as info:
+        if engine=='index':
+            offer_profile=_index_received(index)
+        else:
+            offer_profile=transcript[transcript['event']=='offer received'][['person','time','offer id']]
+            offer_profile=offer_profile.rename(columns={'time':'time_rec'}).reset_index(drop=True)
+
+        offer_attributes=lookup(offers,offer_profile['offer id'])
+        offer_attributes['offer_del']=offer_profile['time_rec']+offer_attributes['duration']*24
+        info['outputs']=offer_profile=pd.concat([offer_profile,offer_attributes],axis=1)
+
+    #the index engine finds the transactions in the index instead
+    transactions=transcript_com=None
+    if engine!='index':
+        with span('create_completion_df.transactions',transcript) as info:
+            transactions=transcript[transcript['event']=='transaction'][['person','time','amount']]
+
+            #amounts may be decoded as float32, sum them in float64 at the recorded cent precision
+            info['outputs']=transactions=transactions.assign(amount=transactions['amount'].astype(np.float64).round(2))
+
+        transcript_com=transcript[transcript['event']=='offer completed']
+
+    #calulate the sum and max value of amounts of the transactions during the offer opening time
+    with span('create_completion_df.offer_amounts',offer_profile,transactions) as info:
+        info['outputs']=offer_tran=_offer_amounts(offer_profile,transactions,engine,index)
+
+    #determine the completed(1) and not completed(0) discount and bogo offers, informational offers are labelled -1
+    offer_type=offer_profile['offer_type']
+    difficulty=offer_profile['difficulty'].to_numpy()
+    conditions=[offer_type=='discount',offer_type=='bogo',offer_type=='informational']
+    choices=[offer_tran['amount_sum'].to_numpy()>=difficulty,offer_tran['amount_max'].to_numpy()>difficulty,-1]
+    offer_tran['complete']=np.select(conditions,choices,default=np.nan)
+
+    #add information of a user
+    with span('create_completion_df.customers',offer_profile) as info:
+        info['outputs']=offer_profile=pd.concat([offer_profile,lookup(customers,offer_profile['person'])],axis=1)
+
+    features_retain=['amount_sum','amount_max','complete']
+    offer_profile[features_retain]=offer_tran[features_retain].to_numpy()
+
+    offer_completed=offer_profile[offer_profile['complete']==1]
+
+    with span('create_completion_df.amounts_till_completion',offer_completed,transcript_com,transactions) as info:
+        info['outputs']=offer_completed=_amounts_till_completion(offer_completed,transcript_com,transactions,engine,index)
+
+    with span('create_completion_df.merge_completed',offer_profile,offer_completed) as info:
+        info['outputs']=offer_profile=offer_profile.merge(offer_completed,how='left',on=['person','time_rec','offer id'])
+
+    with span('create_completion_df.filter',offer_profile) as info:
+        offer_profile=offer_profile[offer_profile['offer_type']!='informational']
+        offer_profile['complete']=offer_profile['complete'].astype(np.int32)
+
+        info['outputs']=offer_profile=offer_profile.dropna(subset=['gender','income'])
+
+    return offer_profile
+
+def _viewed_merge(transcript,offer_profile):
+    '''the viewed and completed attribution by merging every offer with every view and completion, see create_viewed_df'''
     #filter out the transcript when event is only 'offer viewed' or 'offer completed'
     transcript_viewed=transcript[transcript['event']=='offer viewed'][['person','time','offer id']]
     transcript_cpl=transcript[transcript['event']=='offer completed'][['person','time','offer id','offer_reward']]
@@ -133,7 +210,7 @@ def create_viewed_df(transcript,offer_profile):
     #filter out orders that is completed and determine the completion time of an offer
     cpl=offer_profile[offer_profile['complete']==1].merge(transcript_cpl,on=['person','offer id'],how='left')
     cpl=cpl[(cpl['time']>=cpl['time_rec']) & (cpl['time']<=cpl['offer_del'])]
-    cpl=cpl.groupby(['person','offer id','time_rec']).apply(lambda s:pd.Series({'cpl_time':min(s['time'])})).reset_index()
+    cpl=cpl.groupby(['person','offer id','time_rec'],observed=True).apply(lambda s:pd.Series({'cpl_time':min(s['time'])})).reset_index()
 
     #determine which offers are viewed before or after completion by comparing its viewing time with offer receiving time and deadline
     offer_profile_cpl=offer_profile[offer_profile['complete']==1].merge(cpl,on=['person','offer id','time_rec'],how='left')
@@ -170,19 +247,86 @@ def create_viewed_df(transcript,offer_profile):
 
     return offer_profile_vie
 
+def _viewed_index(index,offer_profile):
+    '''the viewed and completed attribution by looking up the events of every offer in the event index, see create_viewed_df'''
+    def first_and_count(offers,event,end):
+        lo,hi=window_slices(index,offers['person'],event,offers['time_rec'],end)
+        return window_match(index,lo,hi,offers['offer id'])
+
+    #the completion time of a completed offer is its first completion between receiving the offer and the deadline
+    offer_profile_cpl_vie=offer_profile[offer_profile['complete']==1].reset_index(drop=True)
+    _,first=first_and_count(offer_profile_cpl_vie,'offer completed',offer_profile_cpl_vie['offer_del'])
+    offer_profile_cpl_vie['cpl_time']=first
+
+    #a completed offer is viewed if it is viewed between receiving and completing it
+    count,_=first_and_count(offer_profile_cpl_vie,'offer viewed',offer_profile_cpl_vie['cpl_time'])
+    offer_profile_cpl_vie['viewed']=(count>0).astype(np.float64)
+
+    #an offer that is not completed is viewed if it is viewed between receiving it and the deadline
+    offer_profile_ncpl_vie=offer_profile[offer_profile['complete']==0].reset_index(drop=True)
+    count,_=first_and_count(offer_profile_ncpl_vie,'offer viewed',offer_profile_ncpl_vie['offer_del'])
+    offer_profile_ncpl_vie['viewed']=(count>0).astype(np.float64)
+    offer_profile_ncpl_vie['cpl_time']=(-1)*np.ones(offer_profile_ncpl_vie.shape[0])
+
+    return pd.concat([offer_profile_cpl_vie,offer_profile_ncpl_vie],axis=0)
+
+@traced
+def create_viewed_df(transcript,offer_profile,engine='interval',index=None):
+    '''determine whether an offer is viewed by a customer before or after completion when the offer is completed,
+        or whether an offer is viewed when the offer is not completed
+
+    args:
+        transcript(pandas dataframe): transactions log
+        offer_profile(pandas dataframe): a dataset containing information on customer, offers and whether the offer is completed 
+        engine(str): 'interval' to find the first completion and the views inside every offer window with the sort
+            based interval join, 'merge' to filter the merge of every offer with every view and completion,
+            'index' to look them up in the per-person event index of event_index.py
+        index(dict): the event index of transcript for the index engine, built from it when not given
+    '''
+    if engine=='merge':
+        return _viewed_merge(transcript,offer_profile)
+    if engine=='index':
+        return _viewed_index(index if index is not None else build_index(transcript),offer_profile)
+    if engine!='interval':
+        raise ValueError('unknown engine {}'.format(engine))
+
+    #filter out the transcript when event is only 'offer viewed' or 'offer completed'
+    transcript_viewed=transcript[transcript['event']=='offer viewed']
+    transcript_cpl=transcript[transcript['event']=='offer completed']
+    on=['person','offer id']
+
+    #the completion time of a completed offer is its first completion between receiving the offer and the deadline
+    offer_profile_cpl_vie=offer_profile[offer_profile['complete']==1].reset_index(drop=True)
+    cpl=window_aggregate(offer_profile_cpl_vie,transcript_cpl,on=on,start='time_rec',end='offer_del')
+    offer_profile_cpl_vie['cpl_time']=cpl['first'].to_numpy()
+
+    #a completed offer is viewed if it is viewed between receiving and completing it
+    viewed=window_aggregate(offer_profile_cpl_vie,transcript_viewed,on=on,start='time_rec',end='cpl_time')
+    offer_profile_cpl_vie['viewed']=(viewed['count'].to_numpy()>0).astype(np.float64)
+
+    #an offer that is not completed is viewed if it is viewed between receiving it and the deadline
+    offer_profile_ncpl_vie=offer_profile[offer_profile['complete']==0].reset_index(drop=True)
+    viewed=window_aggregate(offer_profile_ncpl_vie,transcript_viewed,on=on,start='time_rec',end='offer_del')
+    offer_profile_ncpl_vie['viewed']=(viewed['count'].to_numpy()>0).astype(np.float64)
+    offer_profile_ncpl_vie['cpl_time']=(-1)*np.ones(offer_profile_ncpl_vie.shape[0])
+
+    #concatenate the completed and not completed offers
+    offer_profile_vie=pd.concat([offer_profile_cpl_vie,offer_profile_ncpl_vie],axis=0)
+
+    return offer_profile_vie
+
 if __name__=='__main__':
 
     #read the dataset
-    if glob.glob('preprocessed\*.csv'):
-        df_list=read_dataset(files_path='preprocessed\*.csv',file_type='csv')
-    else:
-        print('please create the csv files first')
-
-    transcript=pd.read_csv(glob.glob('preprocessed/transcript.csv')[0])
+    try:
+        portfolio,profile,transcript=[storage.read_table(name) for name in ['portfolio','profile','transcript']]
+    except FileNotFoundError:
+        sys.exit('please create the preprocessed files with data_preprocessing.py first')
 
-    offer_profile=create_completion_df(*df_list)
+    offer_profile=create_completion_df(portfolio,profile,transcript)
     
     offer_profile_vie=create_viewed_df(transcript,offer_profile)
 
-    offer_profile_vie.to_csv('offer_profile_vie.csv',index=False)
-
+    #pass csv to export a csv file instead
+    fmt=sys.argv[1] if len(sys.argv)>1 else 'feather'
+    storage.write_table(offer_profile_vie,'offer_profile_vie',fmt=fmt)
@@ -2,48 +2,122 @@ import numpy as np
 import pandas as pd
 
 import seaborn as sns
-import matplotlib
 import matplotlib.pyplot as plt
 
-from os.path import isfile, join
+import sys
 
+import storage
+from instrument import traced
+from binning import apply_bins, fit_bins, fit_or_load_bins
 
-def bin_inc_age(offer_profile_vie):
-    '''binning of age and income columns
+#the columns of offer_profile_vie used by the visualizations
+VIS_COLUMNS=['offer name','offer_type','difficulty','duration','reward','gender','age','income',
+             'membership_duration(days)','member_year','complete','viewed']
+
+#the dimensions of the offer completion rate cube, difficulty, duration, reward and offer_type follow from the
+#offer name so they don't add cells
+CUBE_DIMENSIONS=['offer name','offer_type','difficulty','duration','reward','Inc','Age','Dur','gender','member_year','viewed']
+
+#the raw age and income are plotted as histograms and scatter plots from a cube of their own
+PROFILE_CUBE_DIMENSIONS=['age','income','viewed']
+
+
+def wilson_interval(completed,n,z=1.96):
+    '''calculate the Wilson score interval of completion rates, vectorized over arrays of counts
 
     args:
-        offer_profile_vie(pandas dataframe): a dataframe containing info on customer, offer and 
-        whether an offer is completed or viewed by a customer.
+        completed, n(array): the number of completed offers and of all the offers
+        z(float): the quantile of the normal distribution, 1.96 for a 95% interval
+
+    returns:
+        low, high(ndarray): the bounds of the interval, low <= rate <= high within [0,1], NaN where n is 0
     '''
-    #define the quantiles and ranges based which to segment ages and incomes; for income and membership duaration, quantiles
-    #are used so that the resulting bins end up to be more uniform.
-    quantile_list = [0, .25, .5, .75, 1.]
-    bin_ranges = [17, 40, 60, 80, 102]
+    completed=np.asarray(completed,dtype=np.float64)
+    n=np.asarray(n,dtype=np.float64)
 
+    with np.errstate(divide='ignore',invalid='ignore'):
+        rate=completed/n
+        denominator=1+z**2/n
+        center=(rate+z**2/(2*n))/denominator
+        half=z*np.sqrt(rate*(1-rate)/n+z**2/(4*n**2))/denominator
 
-    offer_profile_vie['Inc'] = pd.qcut(offer_profile_vie['income'], q=quantile_list)
+    #at a rate of 0 or 1 the rounding puts a bound just past the rate, which gives negative error bars
+    return np.clip(np.fmin(center-half,rate),0,1),np.clip(np.fmax(center+half,rate),0,1)
 
-    offer_profile_vie['Dur'] = pd.qcut(offer_profile_vie['membership_duration(days)'], q=quantile_list)
+def build_cube(offer_profile,dimensions):
+    '''count the offers and the completed offers of every combination of the dimensions
 
-    offer_profile_vie['Age'] = pd.cut(np.array(offer_profile_vie['age']), bins=bin_ranges)
+    args:
+        offer_profile(pandas dataframe): one row per offer with the dimensions and complete
+        dimensions(list): the columns to group by
 
-    traits_name=['inc','age','dur']
-    traits_quantile=['Inc','Age','Dur']
+    returns:
+        cube(pandas dataframe): the dimensions, n(the number of offers) and completed of every
+            combination that occurs
+    '''
+    counts=pd.DataFrame({'n':np.ones(offer_profile.shape[0],dtype=np.int64),
+                         'completed':(offer_profile['complete'].to_numpy()==1).astype(np.int64)})
+    for col in dimensions:
+        counts[col]=offer_profile[col].to_numpy()
 
-    for name,quantile in zip(traits_name,traits_quantile):
-        labels=[name+'_'+g for g in ['g1','g2','g3','g4']]
-        mapper=dict(zip(list(set(offer_profile_vie[quantile])),labels))
-        print(mapper)
-        offer_profile_vie[quantile]=offer_profile_vie[quantile].map(mapper)
-    
-    return offer_profile_vie
+    return counts.groupby(dimensions,observed=True).sum().reset_index()
 
-def create_viewed_vis(offer_profile_vie):
-    '''create visualizations of all the customers who viewed offers
+def rollup(cube,dimensions,z=1.96):
+    '''sum a cube over all but the given dimensions and add the completion rate and its Wilson interval
+
+    args:
+        cube(pandas dataframe): the cube from build_cube
+        dimensions(list): the dimensions to keep
+        z(float): see wilson_interval
+
+    returns:
+        ocr(pandas dataframe): the dimensions, n, completed, rate, ci_low and ci_high, sorted by the dimensions
+    '''
+    ocr=cube.groupby(dimensions,observed=True)[['n','completed']].sum().reset_index()
+    ocr['rate']=ocr['completed']/ocr['n']
+    ocr['ci_low'],ocr['ci_high']=wilson_interval(ocr['completed'],ocr['n'],z)
+
+    return ocr
+
+@traced
+def build_ocr_cubes(offer_profile_vie,bins=None):
+    '''build the cubes all the completion rate figures are drawn from
 
     args:
         offer_profile_vie(pandas dataframe): a dataframe containing info on customer, offer and 
         whether an offer is completed or viewed by a customer.
+        bins(dict): the edges of the Inc, Age and Dur groups from binning.py, fitted on offer_profile_vie when not given
+
+    returns:
+        cubes(dict): 'ocr_cube' over CUBE_DIMENSIONS and 'ocr_profile_cube' over PROFILE_CUBE_DIMENSIONS
+    '''
+    offer_profile_vie=apply_bins(offer_profile_vie,bins or fit_bins(offer_profile_vie))
+
+    return {'ocr_cube':build_cube(offer_profile_vie,CUBE_DIMENSIONS),
+            'ocr_profile_cube':build_cube(offer_profile_vie,PROFILE_CUBE_DIMENSIONS)}
+
+def _by_complete(ocr,dim):
+    '''split the offers of a rolled up cube in completed(1) and not completed(0), to plot counts by completion'''
+    completed=ocr[[dim]].assign(complete=1,count=ocr['completed'])
+    not_completed=ocr[[dim]].assign(complete=0,count=ocr['n']-ocr['completed'])
+
+    return pd.concat([not_completed,completed],ignore_index=True)
+
+def _barplot_ci(ocr,x,ax,color):
+    '''draw the completion rate of every value of x with its Wilson interval'''
+    sns.barplot(data=ocr,x=x,y='rate',color=color,errorbar=None,ax=ax)
+    ax.errorbar(np.arange(ocr.shape[0]),ocr['rate'],yerr=[ocr['rate']-ocr['ci_low'],ocr['ci_high']-ocr['rate']],
+                fmt='none',ecolor='black')
+    ax.set_ylabel('complete')
+
+@traced
+def create_viewed_vis(cube,profile_cube,out_file='view_cpl_ncpl.JPEG',dpi=None):
+    '''create visualizations of all the customers who viewed offers
+
+    args:
+        cube, profile_cube(pandas dataframe): the ocr_cube and ocr_profile_cube from build_ocr_cubes
+        out_file(str): the file to save the figure to, its extension sets the format
+        dpi(int): the resolution of the saved figure, the figure dpi by default
     '''
 
     fig,axs=plt.subplots(nrows=2,ncols=2)
@@ -52,24 +126,29 @@ def create_viewed_vis(offer_profile_vie):
     color_palettes=sns.color_palette()
     palette=[color_palettes[0],color_palettes[1]]
 
-    data=offer_profile_vie[offer_profile_vie['viewed']==1].reset_index()
+    data=cube[cube['viewed']==1]
+    profile_data=profile_cube[profile_cube['viewed']==1]
 
-    sns.countplot(data=data,x='gender',hue='complete',palette=palette,ax=axs[0,0])
+    sns.barplot(data=_by_complete(rollup(data,['gender']),'gender'),x='gender',y='count',hue='complete',
+                palette=palette,ax=axs[0,0])
     axs[0,0].legend(['no','yes'])
     axs[0,0].set_xlabel('gender')
 
-    sns.histplot(data=data,x='age',hue='complete',palette=palette,ax=axs[0,1])
+    sns.histplot(data=_by_complete(rollup(profile_data,['age']),'age'),x='age',weights='count',hue='complete',
+                 palette=palette,ax=axs[0,1])
     axs[0,1].legend(['yes','no'])
     axs[0,1].set_xlabel('age')
 
     # sns.histplot(data=profile_clean,x='membership_duration(days)',hue='if_tran_rec',bins=50,ax=axs[2])
     # axs[2].set_xlabel('membership_duration(days)')
 
-    sns.histplot(data=data,x='income',hue='complete',palette=palette,ax=axs[1,0])
+    sns.histplot(data=_by_complete(rollup(profile_data,['income']),'income'),x='income',weights='count',hue='complete',
+                 palette=palette,ax=axs[1,0])
     axs[1,0].legend(['yes','no'])
     axs[1,0].set_xlabel('income')
 
-    sns.countplot(data=data,x='member_year',hue='complete',palette=palette,ax=axs[1,1])
+    sns.barplot(data=_by_complete(rollup(data,['member_year']),'member_year'),x='member_year',y='count',hue='complete',
+                palette=palette,ax=axs[1,1])
     axs[1,1].legend(['no','yes'])
     axs[1,1].set_xlabel('member_year')
 
@@ -78,26 +157,28 @@ def create_viewed_vis(offer_profile_vie):
 
     plt.tight_layout()
     #plt.subplots_adjust(bottom=0.5)
-    plt.savefig('view_cpl_ncpl.JPEG')
+    plt.savefig(out_file,dpi=dpi)
 
-def create_ocr_offer(offer_profile):
+@traced
+def create_ocr_offer(cube,out_file='offer_profile.JPEG',dpi=None):
     '''create a visualization of offer completion ratio of different offers names, difficulty, duration and reward
 
     args:
-        offer_profile_vie(pandas dataframe): a dataframe containing info on customer, offer and 
-        whether an offer is completed or viewed by a customer.
+        cube(pandas dataframe): the ocr_cube from build_ocr_cubes
+        out_file(str): the file to save the figure to, its extension sets the format
+        dpi(int): the resolution of the saved figure, the figure dpi by default
     '''
     fig,axs=plt.subplots(nrows=2,ncols=2)
     fig.set_size_inches(12,8)
 
     palette=sns.color_palette()
 
-    data=offer_profile[offer_profile['offer_type']!='informational']
+    data=cube[cube['offer_type']!='informational']
     offer_traits=['offer name','difficulty','duration','reward']
 
     for ax,trait in zip(axs.flatten(),offer_traits):
         
-        sns.barplot(data=data,x=trait,y='complete',color=palette[0],ax=ax)
+        _barplot_ci(rollup(data,[trait]),trait,ax,palette[0])
 
         ax.set_xlabel(trait)
         ax.set_xticklabels(ax.get_xticklabels(), rotation=45)
@@ -105,53 +186,61 @@ def create_ocr_offer(offer_profile):
         ax.set_title('completion rate of offers with different {}'.format(trait))
         
     plt.tight_layout()
-    plt.savefig('offer_profile.JPEG')
+    plt.savefig(out_file,dpi=dpi)
 
-def create_ocr(offer_profile):
+@traced
+def create_ocr(cube,out_file='age_income.JPEG',dpi=None):
     '''create a visualization of offer completion ratio of different offers for customers in different group of income and age
 
     args:
-        offer_profile_vie(pandas dataframe): a dataframe containing info on customer, offer and 
-        whether an offer is completed or viewed by a customer.
+        cube(pandas dataframe): the ocr_cube from build_ocr_cubes
+        out_file(str): the file to save the figure to, its extension sets the format
+        dpi(int): the resolution of the saved figure, the figure dpi by default
     '''
-    #binning the age and income columns
-    offer_profile=bin_inc_age(offer_profile)
-
     plt.figure(figsize=(18,18))
     palette=sns.color_palette()
 
     row_order=['inc_g1','inc_g2','inc_g3','inc_g4']
     col_order=['age_g1','age_g2','age_g3','age_g4']
 
-    data=offer_profile[offer_profile['gender']!='O'].sort_values(['Inc','Age'])
+    data=rollup(cube[cube['gender']!='O'],['Inc','Age','offer name','gender'])
+    order=sorted(data['offer name'].unique())
+    hue_order=sorted(data['gender'].unique())
+
     g=sns.FacetGrid(data,col='Age',row='Inc',row_order=row_order,col_order=col_order)
-    g.map(sns.barplot,'offer name','complete','gender',palette=palette,ci=None)
+    g.map_dataframe(sns.barplot,x='offer name',y='rate',hue='gender',order=order,hue_order=hue_order,
+                    palette=palette[:len(hue_order)],errorbar=None)
     for i in range(g.axes.shape[0]):
         g.axes[i,0].set_ylabel('offer completion ratio')
 
-    g.add_legend(loc='lower left')
+    handles,labels=g.axes[0,0].get_legend_handles_labels()
+    for axes in g.axes.flat:
+        if axes.get_legend() is not None:
+            axes.get_legend().remove()
+    g.add_legend(legend_data=dict(zip(labels,handles)),loc='lower left')
 
     for axes in g.axes.flat:
         _ = axes.set_xticklabels(axes.get_xticklabels(), rotation=90)
         
     plt.tight_layout()
-    plt.savefig('age_income.JPEG')
+    plt.savefig(out_file,dpi=dpi)
 
 
-def create_ocr_groups(offer_profile):
+@traced
+def create_ocr_groups(cube,profile_cube,out_file='user_profile_ocr.JPEG',dpi=300):
     '''comparing the ocr of customers belonging to different age, membership duration and income groups
 
     args:
-        offer_profile_vie(pandas dataframe): a dataframe containing info on customer, offer and 
-        whether an offer is completed or viewed by a customer.
+        cube, profile_cube(pandas dataframe): the ocr_cube and ocr_profile_cube from build_ocr_cubes
+        out_file(str): the file to save the figure to, its extension sets the format
+        dpi(int): the resolution of the saved figure, 300 by default
     '''
-    
-    #binning the age and income columns
-    offer_profile=bin_inc_age(offer_profile)
-
-    font = {'size'   : 15}
-    matplotlib.rc('font', **font)
+    #the larger font only applies to this figure
+    with plt.rc_context({'font.size':15}):
+        _create_ocr_groups(cube,profile_cube,out_file,dpi)
 
+def _create_ocr_groups(cube,profile_cube,out_file,dpi):
+    '''draw the figure of create_ocr_groups'''
     f,axs=plt.subplots(3,2)
     f.set_size_inches(12, 12)
     users_profile=['age','income']
@@ -159,15 +248,14 @@ def create_ocr_groups(offer_profile):
                     'Dur','member_year']
 
     for i,ax in enumerate(axs[0].flatten()):
-        data=offer_profile.groupby(users_profile[i]).mean()['complete'].reset_index()
-        sns.scatterplot(x=data[users_profile[i]],y=data['complete'],ax=ax)
+        data=rollup(profile_cube,[users_profile[i]])
+        sns.scatterplot(x=data[users_profile[i]],y=data['rate'],ax=ax)
         ax.set_title(' as a function of {}'.format(users_profile[i]))
         ax.set_ylim(0,1)
 
     for i,ax in enumerate(axs[1:,:].flatten()):
         
-        data_sorted=offer_profile.sort_values(users_profile_bin[i])
-        sns.barplot(data=data_sorted,x=users_profile_bin[i],y='complete',ax=ax)
+        _barplot_ci(rollup(cube,[users_profile_bin[i]]),users_profile_bin[i],ax,sns.color_palette()[0])
 
         ax.set_title('OCR in different groups of {}'.format(users_profile_bin[i]))
         xticklabels=ax.get_xticklabels()
@@ -175,25 +263,30 @@ def create_ocr_groups(offer_profile):
         ax.set_ylim(0,1)
         
     plt.tight_layout()
-    plt.savefig('user_profile_ocr.JPEG',dpi=300)
-
-if __name__=='__main__':
-    
-    if isfile('offer_profile_vie.csv'):
-        offer_profile_vie=pd.read_csv('offer_profile_vie.csv')
-    else:
-        print('please create the dataset with create_completion.py')
-
-    #create visualizations
-    
-    create_viewed_vis(offer_profile_vie)
-    create_ocr_offer(offer_profile_vie)
-    create_ocr(offer_profile_vie)
-    create_ocr_groups(offer_profile_vie)
-
-
+    plt.savefig(out_file,dpi=dpi)
 
+def create_all_vis(offer_profile_vie,cubes=None,bins=None):
+    '''create all the visualizations of offer_profile_vie
 
+    args:
+        offer_profile_vie(pandas dataframe): a dataframe containing info on customer, offer and 
+        whether an offer is completed or viewed by a customer.
+        cubes(dict): the cubes from build_ocr_cubes, built from offer_profile_vie when not given
+        bins(dict): the edges of the Inc, Age and Dur groups to build the cubes with, see build_ocr_cubes
+    '''
+    cubes=cubes or build_ocr_cubes(offer_profile_vie,bins)
 
+    create_viewed_vis(cubes['ocr_cube'],cubes['ocr_profile_cube'])
+    create_ocr_offer(cubes['ocr_cube'])
+    create_ocr(cubes['ocr_cube'])
+    create_ocr_groups(cubes['ocr_cube'],cubes['ocr_profile_cube'])
 
+if __name__=='__main__':
+    
+    try:
+        offer_profile_vie=storage.read_table('offer_profile_vie',columns=VIS_COLUMNS)
+    except FileNotFoundError:
+        sys.exit('please create the dataset with create_completion.py')
 
+    #create visualizations with the stored income, age and membership duration groups
+    create_all_vis(offer_profile_vie,bins=fit_or_load_bins(offer_profile_vie))
@@ -0,0 +1,75 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+import storage
+from instrument import traced
+from dimensions import build_dimension, lookup
+
+#the activity segments: customers who received offers and didn't make transactions, who received
+#offers and made transactions, and who made transactions without receiving offers
+SEGMENTS=['notran_rec','tran_rec','tran_norec']
+
+
+@traced
+def create_customer_features(transcript):
+    '''aggregate the transcript per customer in one grouped pass
+
+    args:
+        transcript(pandas dataframe): processed transcript dataset
+
+    returns:
+        customer_features(pandas dataframe): one row per customer in the transcript with total_spend,
+            n_transactions, offers_received, offers_viewed, offers_completed, first_activity,
+            last_activity and segment
+    '''
+    event=transcript['event']
+    is_tran=(event=='transaction').to_numpy()
+
+    #amounts may be decoded as float32, sum them in float64 at the recorded cent precision
+    amount=np.where(is_tran,transcript['amount'].to_numpy(dtype=np.float64).round(2),0.0)
+
+    events=pd.DataFrame({'person':transcript['person'].to_numpy(),'time':transcript['time'].to_numpy(),
+                         'amount':amount,'is_tran':is_tran,
+                         'is_rec':(event=='offer received').to_numpy(),
+                         'is_view':(event=='offer viewed').to_numpy(),
+                         'is_com':(event=='offer completed').to_numpy()})
+
+    customer_features=events.groupby('person',sort=True).agg(
+        total_spend=('amount','sum'),n_transactions=('is_tran','sum'),offers_received=('is_rec','sum'),
+        offers_viewed=('is_view','sum'),offers_completed=('is_com','sum'),
+        first_activity=('time','min'),last_activity=('time','max')).reset_index()
+
+    received=customer_features['offers_received'].to_numpy()>0
+    transacted=customer_features['n_transactions'].to_numpy()>0
+    segment=np.select([received & ~transacted,received & transacted,transacted],[0,1,2],default=-1)
+    customer_features['segment']=pd.Categorical.from_codes(segment,categories=SEGMENTS)
+
+    return customer_features
+
+def join_customer_features(df,customer_features,columns=None,key='person'):
+    '''add per-customer features to the rows of df by looking them up by customer code
+
+    args:
+        df(pandas dataframe): a dataset with the customer codes in key, e.g. offer_profile_vie
+        customer_features(pandas dataframe): the features from create_customer_features
+        columns(list): the features to add, all of them by default
+        key(str): the column of df holding the customer codes
+
+    returns:
+        df(pandas dataframe): df with the feature columns, missing for customers without features
+    '''
+    features=lookup(build_dimension(customer_features,'person'),df[key],columns)
+    features.index=df.index
+
+    return pd.concat([df,features],axis=1)
+
+if __name__=='__main__':
+    #build the feature store from the stored transcript
+    try:
+        transcript=storage.read_table('transcript',columns=['person','event','time','amount'])
+    except FileNotFoundError:
+        sys.exit('please first create the processed files with data_preprocessing.py')
+
+    storage.write_table(create_customer_features(transcript),'customer_features')
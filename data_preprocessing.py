@@ -2,13 +2,18 @@ import numpy as np
 import pandas as pd
 import glob
 import os
+import sys
+
+import storage
+from instrument import traced
 
-from os import listdir
-from os.path import isfile, join
 from datetime import datetime
-from collections import Counter
-import json
 
+def dataset_name(file):
+    '''get the name of the dataset stored in a file, e.g. 'transcript' for Data/transcript.json'''
+    return os.path.splitext(os.path.basename(file))[0]
+
+@traced
 def read_dataset(files_path='Data/*.json',file_type='json'):
     '''read all the files into pandas dataframe
 
@@ -16,57 +21,185 @@ def read_dataset(files_path='Data/*.json',file_type='json'):
         files_path: a list path to all the files
 
     returns:
-        df_list: a list of portfolio, profile, transcript dataframe
+        df_dict: a dict of portfolio, profile, transcript dataframe keyed by the dataset name
     '''
 
-    files=glob.glob(files_path)
-    df_list=[]
+    files=sorted(glob.glob(files_path))
+    df_dict={}
 
     for file in files:
-        print(file)
         if file_type=='json':
             df=pd.read_json(file,lines=True)
 
         if file_type=='csv':
             df=pd.read_csv(file)        
 
-        df_list.append(df)
-    return df_list
+        df_dict[dataset_name(file)]=df
+    return df_dict
+
+def json_schemas():
+    '''the pyarrow schemas of the raw json datasets parsed by pyarrow, the transcript payloads are parsed
+       straight into a struct column instead of a dict per row'''
+    import pyarrow as pa
+
+    value=pa.struct([('offer id',pa.string()),('offer_id',pa.string()),('amount',pa.float64()),('reward',pa.float64())])
+
+    return {'transcript':pa.schema([('person',pa.string()),('event',pa.string()),('value',value),('time',pa.int64())])}
+
+def _iter_arrow_json(file,schema,chunksize):
+    '''read a line-delimited json file with pyarrow in chunks of chunksize rows, the structs kept as arrow columns'''
+    import pyarrow as pa
+    import pyarrow.json
+
+    #fields that are missing from a line are null, the schema fixes the types whatever the first block holds
+    options=pyarrow.json.ParseOptions(explicit_schema=schema,unexpected_field_behavior='ignore')
+    reader=pyarrow.json.open_json(file,parse_options=options)
+    to_pandas=lambda table: table.to_pandas(types_mapper=lambda t: pd.ArrowDtype(t) if pa.types.is_struct(t) else None)
+
+    batches,rows=[],0
+    for batch in reader:
+        batches.append(batch)
+        rows+=batch.num_rows
+
+        while rows>=chunksize:
+            table=pa.Table.from_batches(batches,reader.schema)
+            yield to_pandas(table.slice(0,chunksize))
+            rest=table.slice(chunksize)
+            batches,rows=rest.to_batches(),rest.num_rows
+
+    if rows:
+        yield to_pandas(pa.Table.from_batches(batches,reader.schema))
+
+def iter_chunks(file,file_type='json',chunksize=100000,name=None):
+    '''read a line-delimited json or csv file in chunks so that the whole file is never in memory
+
+    the json datasets of json_schemas are parsed by pyarrow, their payloads become struct columns that
+    decode_values decodes without a python object per row; the others, and all of them with a pyarrow
+    without a streaming json reader, are read by pandas.
+
+    args:
+        file(str): path to the file
+        file_type(str): 'json' or 'csv'
+        chunksize(int): the number of lines in every chunk
+        name(str): the dataset the file holds, the file name by default
+
+    yields:
+        chunk(pandas dataframe): the next chunksize rows of the file
+    '''
+    if file_type=='json':
+        import pyarrow.json
+        schema=json_schemas().get(name or dataset_name(file))
+        if schema is not None and hasattr(pyarrow.json,'open_json'):
+            yield from _iter_arrow_json(file,schema,chunksize)
+            return
+
+    if file_type=='json':
+        reader=pd.read_json(file,lines=True,chunksize=chunksize)
+    elif file_type=='csv':
+        reader=pd.read_csv(file,chunksize=chunksize)
+    else:
+        raise ValueError('unknown file type {}'.format(file_type))
+
+    with reader:
+        for chunk in reader:
+            yield chunk
+
+@traced
+def stream_preprocess(files_path='Data/*.json',outdir=storage.DATA_DIR,file_type='json',chunksize=100000,fmt='feather'):
+    '''preprocess the datasets chunk by chunk and store every processed chunk as soon as it is ready, the
+       peak memory depends on chunksize rather than on the size of the files
+
+    args:
+        files_path(str): glob pattern of the raw files
+        outdir(str): directory to write the preprocessed datasets to
+        file_type(str): 'json' or 'csv'
+        chunksize(int): the number of lines in every chunk
+        fmt(str): the storage format, see storage.write_table
+
+    returns:
+        rows(dict): the number of rows written for every dataset
+    '''
+    rows={}
+
+    #the customer and offer ids are replaced by integer codes, built up over all the files and chunks
+    dictionaries={'person_ids':pd.Index([],dtype=object),'offer_ids':pd.Index([],dtype=object)}
 
-def days_between(d1):
-    '''calculate the days from the d1 date to current date
+    for file in sorted(glob.glob(files_path)):
+        name=dataset_name(file)
+        preprocess=PREPROCESSORS[name]
+        rows[name]=0
+
+        #all the preprocessing steps only look at one row at a time, so every chunk can be processed on its own
+        for part,chunk in enumerate(iter_chunks(file,file_type,chunksize)):
+            chunk=storage.encode_ids(preprocess(chunk),name,dictionaries)
+            storage.write_table(chunk,name,outdir,fmt=fmt,part=part)
+            rows[name]+=chunk.shape[0]
+
+    storage.save_dictionaries(dictionaries,outdir,fmt=fmt)
+
+    return rows
+
+#the date membership durations are counted up to
+REFERENCE_DATE='20211201'
+
+def days_between(d1,d2=REFERENCE_DATE):
+    '''calculate the days from the d1 date to the d2 date
 
     args:
         d1(str): a string representing d1 date. Example:20170212
+        d2(str): a string representing d2 date, the reference date by default
 
     returns:
-        int: a number indicating the days from the d1 date to current date
+        int: a number indicating the days from the d1 date to the d2 date
     '''
     d1 = datetime.strptime(d1, "%Y%m%d")
-    current_date = datetime.strptime('20211201', "%Y%m%d")
-    return abs((current_date - d1).days)
+    d2 = datetime.strptime(d2, "%Y%m%d")
+    return abs((d2 - d1).days)
+
+def parse_dates(dates):
+    '''convert integer dates like 20170212 to datetimes in bulk
+
+    args:
+        dates(pandas series): the dates as yyyymmdd integers or strings
+
+    returns:
+        dates(pandas series): the dates as datetime64
+    '''
+    dates=pd.to_numeric(dates).to_numpy(dtype=np.int64)
+    parts=pd.DataFrame({'year':dates//10000,'month':dates//100%100,'day':dates%100})
+    return pd.to_datetime(parts)
 
+def _str_categorical(values):
+    '''a categorical of the integer values with their string as category, e.g. '2017', ordered by value'''
+    return pd.Categorical(values).rename_categories(str)
 
-def preprocess_profile(profile):
+@traced
+def preprocess_profile(profile,reference_date=REFERENCE_DATE):
     '''preprocess the profile dataset
 
     args:
         profile(pandas dataframe): a dataset describe rewards program users
+        reference_date(str): the date membership_duration(days) is counted up to, e.g. 20211201
 
     returns:
         profile(pandas dataframe): processed profile dataset
     '''
     #add some new columns to profile dataset
-    profile['member_date']=pd.to_datetime(profile['became_member_on'],format='%Y%m%d')
-    profile['member_year']=profile['member_date'].dt.year.astype(str)
-    profile['member_month']=profile['member_date'].dt.month.astype(str)
-    profile['member_day']=profile['member_date'].dt.day.astype(str)
-    profile['membership_duration(days)']=profile['became_member_on'].astype('str').apply(days_between)
+    profile['member_date']=parse_dates(profile['became_member_on']).to_numpy()
+    member_date=profile['member_date'].dt
+    profile['member_year']=_str_categorical(member_date.year)
+    profile['member_month']=_str_categorical(member_date.month)
+    profile['member_day']=_str_categorical(member_date.day)
+
+    #the reference date is parsed once, the durations are taken in bulk
+    reference=pd.Timestamp(datetime.strptime(reference_date,'%Y%m%d'))
+    profile['membership_duration(days)']=(reference-profile['member_date']).dt.days.abs().astype(np.int64)
 
     profile=profile.drop(columns=['became_member_on'])
 
     return profile
 
+@traced
 def preprocess_portfolio(portfolio):
     '''preprocess the portfolio dataset
     
@@ -78,21 +211,83 @@ def preprocess_portfolio(portfolio):
     '''
     #create web, email, mobile and social columns
     channels=['web', 'email', 'mobile', 'social']
+    offer_channels=portfolio['channels'].explode()
+    flags=pd.crosstab(offer_channels.index,offer_channels).reindex(index=portfolio.index,columns=channels,fill_value=0)
     for channel in channels:
-        portfolio[channel]=portfolio['channels'].apply(lambda x: 1 if channel in x else 0)
+        portfolio[channel]=(flags[channel].to_numpy()>0).astype(np.int64)
 
     portfolio=portfolio.drop(columns=['channels'])
 
     #create offer name column which can be used to indicate different offers
-    offer_name=[]
-
-    for _,row in portfolio.iterrows():
-        offer_name.append('r{}/di{}/du{}/t{}'.format(row['reward'],row['difficulty'],row['duration'],row['offer_type'][0]))
-        
-    portfolio['offer name']=offer_name
+    portfolio['offer name']=('r'+portfolio['reward'].astype(str)+'/di'+portfolio['difficulty'].astype(str)+
+                             '/du'+portfolio['duration'].astype(str)+'/t'+portfolio['offer_type'].str[0])
 
     return portfolio
 
+def decode_values(value,amount_dtype=np.float32):
+    '''decode the value payloads of the transcript in a single pass
+
+    args:
+        value(pandas series or pyarrow struct array): the payloads holding 'offer id' or 'offer_id',
+            'amount' and 'reward', either as the struct column pyarrow.json parses them into, also
+            in a series of arrow dtype as iter_chunks reads them, or as dicts
+        amount_dtype: the dtype of the amount and reward columns
+
+    returns:
+        decoded(pandas dataframe): the columns offer id(categorical), amount and offer_reward
+    '''
+    if not isinstance(value,pd.Series):
+        return _decode_struct(value,amount_dtype)
+
+    if isinstance(value.dtype,pd.ArrowDtype):
+        decoded=_decode_struct(value.array.__arrow_array__(),amount_dtype)
+        decoded.index=value.index
+        return decoded
+
+    #the payloads read by pandas are dicts, they are walked one by one
+    categories={}
+    offer_codes=[]
+    amount=[]
+    reward=[]
+
+    #walk the dicts once, normalise the 'offer_id' spelling used by completed offers and code the
+    #offer ids on the way, there are only a handful of distinct offers
+    for payload in value.tolist():
+        offer_id=payload.get('offer id',payload.get('offer_id'))
+        offer_codes.append(-1 if offer_id is None else categories.setdefault(offer_id,len(categories)))
+        amount.append(payload.get('amount',np.nan))
+        reward.append(payload.get('reward',np.nan))
+
+    decoded=pd.DataFrame(index=value.index)
+    decoded['offer id']=pd.Categorical.from_codes(np.array(offer_codes,dtype=np.int32),categories=list(categories))
+    decoded['amount']=np.array(amount,dtype=amount_dtype)
+    decoded['offer_reward']=np.array(reward,dtype=amount_dtype)
+
+    return decoded
+
+def _decode_struct(value,amount_dtype):
+    '''decode payloads that pyarrow already parsed into a struct column, without creating python objects'''
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if isinstance(value,pa.ChunkedArray):
+        value=value.combine_chunks()
+
+    def field(name,dtype):
+        if value.type.get_field_index(name)<0:
+            return pa.nulls(len(value),dtype)
+        return value.field(name).cast(dtype)
+
+    offer_id=pc.coalesce(field('offer id',pa.string()),field('offer_id',pa.string()))
+
+    decoded=pd.DataFrame()
+    decoded['offer id']=offer_id.dictionary_encode().to_pandas()
+    for col,name in [('amount','amount'),('offer_reward','reward')]:
+        decoded[col]=field(name,pa.float64()).to_numpy(zero_copy_only=False).astype(amount_dtype)
+
+    return decoded
+
+@traced
 def preprocess_transcript(transcript):
     '''preprocess the transcript dataset
     
@@ -102,29 +297,21 @@ def preprocess_transcript(transcript):
     returns:
         portfolio(pandas dataframe): processed transcript dataset   
     '''   
-    #extract the offer id for differet offers
-    transcript['offer id']=transcript['value'].apply(lambda x:x.get('offer id') if 'offer id' in x else x.get('offer_id'))
-
-    #extract the amount if the event is transactions
-    transcript['amount']=transcript['value'].apply(lambda x:x.get('amount'))
+    #extract the offer id for differet offers, the amount if the event is transactions and
+    #the award if the event is offer completion
+    decoded=decode_values(transcript['value'])
 
-    #extract the award if the event is offer completion
-    transcript['offer_reward']=transcript['value'].apply(lambda x:x.get('reward'))
+    for col in decoded.columns:
+        transcript[col]=decoded[col]
 
     return transcript
 
 
 
-if __name__=='__main__':
-    #read the dataset
-    df_list=read_dataset()
+PREPROCESSORS={'portfolio':preprocess_portfolio,'profile':preprocess_profile,'transcript':preprocess_transcript}
 
-    #preprocessing all the files
-    outdir = './preprocessed'
-    if not os.path.exists(outdir):
-        os.mkdir(outdir)
-
-    portfolio=preprocess_portfolio(df_list[0]).to_csv(os.path.join(outdir, 'portfolio.csv'),index=False)
-    profile=preprocess_profile(df_list[1]).to_csv(os.path.join(outdir, 'profile.csv'),index=False)
-    transcript=preprocess_transcript(df_list[2]).to_csv(os.path.join(outdir, 'transcript.csv'),index=False)
 
+if __name__=='__main__':
+    #read and preprocess all the files chunk by chunk, pass csv to export csv files instead
+    fmt=sys.argv[1] if len(sys.argv)>1 else 'feather'
+    stream_preprocess(files_path='Data/*.json',outdir=storage.DATA_DIR,fmt=fmt)
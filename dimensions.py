@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from pandas.api.extensions import take
+
+
+def build_dimension(df,key='id'):
+    '''hold the attributes of the offers or customers as arrays that can be looked up by integer code
+
+    args:
+        df(pandas dataframe): the preprocessed portfolio or profile, one row per offer or customer
+        key(str): the column holding the integer code of every row, see storage.encode_ids
+
+    returns:
+        dimension(dict): 'position', the row of every code (-1 for codes without a row), and
+            'columns', the array of every other column in row order
+    '''
+    codes=df[key].to_numpy(dtype=np.int64)
+    position=np.full(codes.max()+1 if len(codes) else 0,-1,dtype=np.int64)
+    position[codes]=np.arange(len(codes))
+
+    columns={col:df[col].values for col in df.columns if col!=key}
+
+    return {'position':position,'columns':columns}
+
+def lookup(dimension,codes,columns=None):
+    '''look up the attributes of integer codes by indexing the dimension arrays
+
+    codes without a row in the dimension get missing values, as a left merge would give them.
+
+    args:
+        dimension(dict): the dimension from build_dimension
+        codes(array-like): the codes to look up, e.g. the offer id column of the received offers
+        columns(list): the attributes to look up, all of them by default
+
+    returns:
+        attributes(pandas dataframe): one row per code with the looked up columns
+    '''
+    codes=np.asarray(codes,dtype=np.int64)
+    position=dimension['position']
+
+    known=(codes>=0) & (codes<len(position))
+    rows=np.full(len(codes),-1,dtype=np.int64)
+    rows[known]=position[codes[known]]
+
+    columns=columns or list(dimension['columns'])
+
+    return pd.DataFrame({col:take(dimension['columns'][col],rows,allow_fill=True) for col in columns})
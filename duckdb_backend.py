@@ -0,0 +1,205 @@
+import os
+
+import duckdb
+import numpy as np
+
+import storage
+from instrument import traced
+
+#the offers with their completion and the amounts spent, the same rows in the same order as
+#create_completion_df with the interval engine. The offers keep the order they were received in by
+#the position rn of their event in the stored transcript, see register_numbered
+COMPLETION_SQL='''
+WITH events AS (
+    SELECT rn, person, event, time, "offer id" AS offer_id, amount FROM transcript_rows
+),
+received AS (
+    SELECT e.rn, e.person, e.time AS time_rec, e.offer_id, p.reward, p.difficulty, p.duration, p.offer_type,
+           p.web, p.email, p.mobile, p.social, p."offer name", e.time+p.duration*24 AS offer_del
+    FROM events e LEFT JOIN portfolio p ON p.id=e.offer_id
+    WHERE e.event='offer received'
+),
+transactions AS (
+    SELECT person, time, round(CAST(amount AS DOUBLE),2) AS amount FROM events WHERE event='transaction'
+),
+amounts AS (
+    SELECT r.rn, coalesce(sum(t.amount),0) AS amount_sum, coalesce(max(t.amount),0) AS amount_max
+    FROM received r LEFT JOIN transactions t ON t.person=r.person AND t.time BETWEEN r.time_rec AND r.offer_del
+    GROUP BY r.rn
+),
+offers AS (
+    SELECT r.*, a.amount_sum, a.amount_max,
+           CASE r.offer_type WHEN 'discount' THEN CAST(a.amount_sum>=r.difficulty AS INTEGER)
+                             WHEN 'bogo' THEN CAST(a.amount_max>r.difficulty AS INTEGER)
+                             WHEN 'informational' THEN -1 END AS complete
+    FROM received r JOIN amounts a USING (rn)
+),
+completed AS (
+    SELECT o.rn, o.person, o.time_rec, o.offer_id, min(e.time) AS time_com
+    FROM offers o JOIN events e ON e.event='offer completed' AND e.person=o.person AND e.offer_id=o.offer_id
+                                   AND e.time>=o.time_rec
+    WHERE o.complete=1
+    GROUP BY o.rn, o.person, o.time_rec, o.offer_id
+),
+till_completion AS (
+    SELECT c.person, c.time_rec, c.offer_id, sum(t.amount) AS sum_till_com, count(*) AS num_till_com
+    FROM completed c JOIN transactions t ON t.person=c.person AND t.time BETWEEN c.time_rec AND c.time_com
+    GROUP BY c.rn, c.person, c.time_rec, c.offer_id
+)
+SELECT o.person, o.time_rec, o.offer_id AS "offer id", o.reward, o.difficulty, o.duration, o.offer_type,
+       o.web, o.email, o.mobile, o.social, o."offer name", o.offer_del, c.gender, c.age, c.income, c.member_date,
+       c.member_year, c.member_month, c.member_day, c."membership_duration(days)", o.amount_sum, o.amount_max,
+       o.complete, l.sum_till_com, CAST(l.num_till_com AS DOUBLE) AS num_till_com
+FROM offers o
+LEFT JOIN profile c ON c.id=o.person
+LEFT JOIN till_completion l ON l.person=o.person AND l.time_rec=o.time_rec AND l.offer_id=o.offer_id
+WHERE o.offer_type IS DISTINCT FROM 'informational' AND c.gender IS NOT NULL AND c.income IS NOT NULL
+      AND NOT isnan(c.income)
+ORDER BY o.rn
+'''
+
+#the offers with whether they were viewed, the same rows in the same order as create_viewed_df with the
+#interval engine: the completed offers first, then the ones that were not completed
+VIEWED_SQL='''
+WITH offers AS (
+    SELECT * FROM offer_profile_rows
+),
+events AS (
+    SELECT person, event, time, "offer id" AS offer_id FROM transcript WHERE event IN ('offer completed','offer viewed')
+),
+completions AS (
+    SELECT o.rn, min(e.time) AS cpl_time
+    FROM offers o JOIN events e ON e.event='offer completed' AND e.person=o.person AND e.offer_id=o."offer id"
+                                   AND e.time BETWEEN o.time_rec AND o.offer_del
+    WHERE o.complete=1
+    GROUP BY o.rn
+),
+windows AS (
+    SELECT o.rn, o.person, o."offer id" AS offer_id, o.time_rec,
+           CASE WHEN o.complete=1 THEN c.cpl_time ELSE -1 END AS cpl_time,
+           CASE WHEN o.complete=1 THEN c.cpl_time ELSE o.offer_del END AS view_end
+    FROM offers o LEFT JOIN completions c USING (rn)
+    WHERE o.complete IN (0,1)
+),
+views AS (
+    SELECT DISTINCT w.rn
+    FROM windows w JOIN events e ON e.event='offer viewed' AND e.person=w.person AND e.offer_id=w.offer_id
+                                    AND e.time BETWEEN w.time_rec AND w.view_end
+)
+SELECT o.* EXCLUDE (rn), CAST(w.cpl_time AS DOUBLE) AS cpl_time, CAST(v.rn IS NOT NULL AS DOUBLE) AS viewed
+FROM offers o JOIN windows w USING (rn) LEFT JOIN views v USING (rn)
+ORDER BY o.complete DESC, o.rn
+'''
+
+#the pyarrow dataset format of every storage format
+DATASET_FORMATS={'feather':'feather','parquet':'parquet','csv':'csv'}
+
+
+def connect(memory_limit=None,temp_directory=None,threads=None):
+    '''open an in-memory duckdb connection that spills to disk
+
+    args:
+        memory_limit(str): the memory duckdb may use before spilling, e.g. '2GB', 80% of the ram by default
+        temp_directory(str): the directory to spill to
+        threads(int): the number of threads, all the cores by default
+
+    returns:
+        con: the duckdb connection
+    '''
+    con=duckdb.connect()
+    if memory_limit:
+        con.execute("SET memory_limit='{}'".format(memory_limit))
+    if temp_directory:
+        os.makedirs(temp_directory,exist_ok=True)
+        con.execute("SET temp_directory='{}'".format(temp_directory))
+    if threads:
+        con.execute('SET threads={}'.format(int(threads)))
+
+    return con
+
+def register_tables(con,names,directory=storage.DATA_DIR):
+    '''make stored datasets queryable by name, they are scanned from their files and not loaded'''
+    import pyarrow.dataset
+
+    for name in names:
+        fmt,parts=storage.table_parts(name,directory)
+        con.register(name,pyarrow.dataset.dataset(parts,format=DATASET_FORMATS[fmt]))
+
+def register_numbered(con,name,directory=storage.DATA_DIR,batch_rows=1000000):
+    '''copy a stored dataset into the duckdb table <name>_rows with rn, the position of every row as it is stored
+
+    duckdb doesn't guarantee the order it scans a dataset in with several threads, or the one
+    row_number() OVER () numbers it in, so the queries order by rn. The rows are numbered while they are
+    streamed from the parts in order, and the table spills to the temp directory like the rest of the query.
+    '''
+    import pyarrow as pa
+    import pyarrow.dataset
+
+    fmt,parts=storage.table_parts(name,directory)
+    dataset=pyarrow.dataset.dataset(parts,format=DATASET_FORMATS[fmt])
+
+    def batches():
+        start=0
+        for batch in dataset.to_batches(batch_size=batch_rows):
+            yield batch.append_column('rn',pa.array(np.arange(start,start+batch.num_rows,dtype=np.int64)))
+            start+=batch.num_rows
+
+    reader=pa.RecordBatchReader.from_batches(dataset.schema.append(pa.field('rn',pa.int64())),batches())
+    con.register(name+'_batches',reader)
+    con.execute('CREATE OR REPLACE TEMP TABLE {0}_rows AS SELECT * FROM {0}_batches'.format(name))
+    con.unregister(name+'_batches')
+
+def write_query(con,sql,name,directory=storage.DATA_DIR,batch_rows=1000000):
+    '''run a query and store its result batch by batch as the parts of a dataset
+
+    returns:
+        rows(int): the number of rows stored
+    '''
+    reader=con.execute(sql).fetch_record_batch(batch_rows)
+
+    rows,part=0,0
+    for batch in reader:
+        storage.write_table(batch.to_pandas(),name,directory,part=part)
+        rows+=batch.num_rows
+        part+=1
+
+    if part==0:
+        storage.write_table(reader.schema.empty_table().to_pandas(),name,directory)
+
+    return rows
+
+@traced
+def create_completion_table(directory=storage.DATA_DIR,con=None,out_name='offer_profile'):
+    '''store the completion of the offers, what create_completion_df computes, by running the windows in duckdb
+
+    args:
+        directory(str): the directory holding the portfolio, profile and transcript datasets
+        con: a connection from connect(), a default one by default
+        out_name(str): the dataset to store the result in
+
+    returns:
+        rows(int): the number of offers stored
+    '''
+    con=con or connect(temp_directory=os.path.join(directory,'.duckdb_tmp'))
+    register_tables(con,['portfolio','profile'],directory)
+    register_numbered(con,'transcript',directory)
+
+    return write_query(con,COMPLETION_SQL,out_name,directory)
+
+@traced
+def create_viewed_table(directory=storage.DATA_DIR,con=None,out_name='offer_profile_vie'):
+    '''store whether the offers were viewed, what create_viewed_df computes, by running the windows in duckdb
+
+    args:
+        directory(str): the directory holding the transcript and the offer_profile from create_completion_table
+        con: a connection from connect(), a default one by default
+        out_name(str): the dataset to store the result in
+
+    returns:
+        rows(int): the number of offers stored
+    '''
+    con=con or connect(temp_directory=os.path.join(directory,'.duckdb_tmp'))
+    register_tables(con,['transcript'],directory)
+    register_numbered(con,'offer_profile',directory)
+
+    return write_query(con,VIEWED_SQL,out_name,directory)
@@ -0,0 +1,217 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import storage
+from instrument import traced
+
+#the event types in the order of the categories of the transcript, every person has a slice of events per type
+EVENTS=['offer completed','offer received','offer viewed','transaction']
+
+#the index is stored as memory mappable .npy arrays in this directory next to the datasets
+INDEX_NAME='event_index'
+
+#the arrays of the index, all but offsets and cents_cumsum have a row per event
+ARRAYS=['offsets','key','time','offer','cents','cents_cumsum','position']
+
+
+def index_path(directory=storage.DATA_DIR):
+    '''the directory holding the arrays of the event index'''
+    return os.path.join(directory,INDEX_NAME)
+
+@traced
+def build_index(transcript):
+    '''sort the transcript once by person, event and time and store where the events of every person start
+
+    the events of a person and type are the rows offsets[p*len(EVENTS)+e]:offsets[p*len(EVENTS)+e+1], sorted
+    by time, ties in the order of the transcript. The amounts are kept as integer cents with their running
+    sum, so the spend in a window is the difference of two prefix sums and is exact.
+
+    args:
+        transcript(pandas dataframe): processed transcript dataset with integer coded persons
+
+    returns:
+        index(dict): the arrays of ARRAYS and 'meta', the number of persons and the time range of the keys
+    '''
+    person=transcript['person'].to_numpy(dtype=np.int64)
+    event=pd.Categorical(transcript['event'],categories=EVENTS).codes.astype(np.int64)
+    time=transcript['time'].to_numpy(dtype=np.int64)
+
+    #events of unknown types or without a person aren't indexed
+    position=np.flatnonzero((person>=0) & (event>=0))
+    n_persons=int(person[position].max())+1 if len(position) else 0
+    time_min=int(time[position].min()) if len(position) else 0
+    span=int(time[position].max())-time_min+1 if len(position) else 1
+
+    segment=person[position]*len(EVENTS)+event[position]
+    order=np.lexsort((time[position],segment))
+    position,segment=position[order],segment[order]
+
+    offsets=np.zeros(n_persons*len(EVENTS)+1,dtype=np.int64)
+    np.cumsum(np.bincount(segment,minlength=n_persons*len(EVENTS)),out=offsets[1:])
+
+    amount=transcript['amount'].to_numpy(dtype=np.float64)[position]
+    cents=np.where(segment%len(EVENTS)==EVENTS.index('transaction'),np.rint(np.nan_to_num(amount)*100),0).astype(np.int64)
+    cents_cumsum=np.zeros(len(cents)+1,dtype=np.int64)
+    np.cumsum(cents,out=cents_cumsum[1:])
+
+    return {'offsets':offsets,'key':segment*span+time[position]-time_min,'time':time[position],
+            'offer':transcript['offer id'].to_numpy(dtype=np.int64)[position].astype(np.int16),'cents':cents,
+            'cents_cumsum':cents_cumsum,'position':position,
+            'meta':{'n_persons':n_persons,'time_min':time_min,'span':span,'events':EVENTS}}
+
+def save_index(index,directory=storage.DATA_DIR):
+    '''store the arrays of the index as .npy files'''
+    path=index_path(directory)
+    os.makedirs(path,exist_ok=True)
+
+    for name in ARRAYS:
+        np.save(os.path.join(path,name+'.npy'),index[name])
+    with open(os.path.join(path,'meta.json'),'w') as f:
+        json.dump(index['meta'],f)
+
+def load_index(directory=storage.DATA_DIR,memory_map=True):
+    '''read a stored index, its arrays are memory mapped rather than read by default'''
+    path=index_path(directory)
+
+    with open(os.path.join(path,'meta.json')) as f:
+        index={'meta':json.load(f)}
+    for name in ARRAYS:
+        index[name]=np.load(os.path.join(path,name+'.npy'),mmap_mode='r' if memory_map else None)
+
+    return index
+
+def event_rows(index,event):
+    '''the rows of the index holding the events of a type, in the order of the transcript'''
+    n_events=len(EVENTS)
+    rows=np.flatnonzero(np.asarray(index['key'])//index['meta']['span']%n_events==EVENTS.index(event))
+
+    return rows[np.argsort(index['position'][rows],kind='stable')]
+
+def person_slice(index,person,event,t0=-np.inf,t1=np.inf):
+    '''the rows of the events of a type of one person with t0 <= time <= t1
+
+    e.g. the transactions of person 3 in the first week are index['cents'][person_slice(index,3,'transaction',0,168)]
+    '''
+    lo,hi=window_slices(index,np.array([person]),event,np.array([t0],dtype=np.float64),np.array([t1],dtype=np.float64))
+
+    return slice(int(lo[0]),int(hi[0]))
+
+def window_slices(index,person,event,start,end):
+    '''find for every window the rows of the events of a type of its person with start <= time <= end
+
+    every window is a binary search of its (person, event, time) bounds in the keys of its person and
+    type, offsets[segment]:offsets[segment+1], so only the pages of those keys are read from the index.
+
+    args:
+        index(dict): the index from build_index or load_index
+        person(ndarray): the person of every window
+        event(str): the type of the events, one of EVENTS
+        start, end(ndarray): the bounds of the windows, both inclusive, they may be infinite or missing
+
+    returns:
+        lo, hi(ndarray): the events of window i are the rows lo[i]:hi[i]
+    '''
+    meta=index['meta']
+    span=meta['span']
+
+    person=np.asarray(person,dtype=np.int64)
+    start=np.asarray(start,dtype=np.float64)-meta['time_min']
+    end=np.asarray(end,dtype=np.float64)-meta['time_min']
+
+    #the times are integers, so the bounds are rounded inwards and clipped to the keys of the segment
+    known=(person>=0) & (person<meta['n_persons']) & ~np.isnan(start) & ~np.isnan(end)
+    segment=np.where(known,person,0)*len(EVENTS)+EVENTS.index(event)
+    first=np.clip(np.ceil(np.nan_to_num(start)),0,span).astype(np.int64)
+    last=np.clip(np.floor(np.nan_to_num(end)),-1,span-1).astype(np.int64)
+
+    offsets=index['offsets']
+    lo,hi=offsets[segment],offsets[segment+1]
+    lo,hi=(_bounded_search(index['key'],segment*span+first,lo,hi,'left'),
+           _bounded_search(index['key'],segment*span+last,lo,hi,'right'))
+
+    empty=~known | (hi<lo)
+    hi[empty]=lo[empty]
+
+    return lo,hi
+
+def _bounded_search(key,target,lo,hi,side):
+    '''np.searchsorted of every target in its own sorted range key[lo:hi], all the ranges searched at once'''
+    lo,hi=lo.copy(),hi.copy()
+
+    #a step per halving of the longest range, the ranges of a person and type are short
+    while True:
+        active=lo<hi
+        if not active.any():
+            return lo
+        mid=(lo+hi)//2
+        value=key[np.where(active,mid,0)]
+        right=active & ((value<target) if side=='left' else (value<=target))
+        lo=np.where(right,mid+1,lo)
+        hi=np.where(active & ~right,mid,hi)
+
+def window_sum(index,lo,hi):
+    '''the amount spent in the rows lo:hi of every window, from the prefix sums of the cents'''
+    cents_cumsum=index['cents_cumsum']
+
+    return (cents_cumsum[hi]-cents_cumsum[lo])/100
+
+def _expand(lo,hi):
+    '''the rows of all the windows one after another, and the window of every row'''
+    lengths=hi-lo
+    offsets=np.cumsum(lengths)-lengths
+    window=np.repeat(np.arange(len(lo)),lengths)
+
+    return lo[window]+np.arange(lengths.sum())-offsets[window],window
+
+def window_max(index,lo,hi):
+    '''the largest amount in the rows lo:hi of every window, NaN for empty windows'''
+    lengths=hi-lo
+    rows,_=_expand(lo,hi)
+    nonempty=lengths>0
+
+    result=np.full(len(lo),np.nan)
+    if len(rows):
+        result[nonempty]=np.maximum.reduceat(index['cents'][rows],(np.cumsum(lengths)-lengths)[nonempty])/100
+
+    return result
+
+def window_match(index,lo,hi,offer):
+    '''count the events in the rows lo:hi of every window that are about its offer and find the first one
+
+    args:
+        index(dict): the index from build_index or load_index
+        lo, hi(ndarray): the rows of every window from window_slices
+        offer(ndarray): the offer id of every window
+
+    returns:
+        count(ndarray): the number of events about the offer of every window
+        first(ndarray): the time of the earliest of them, NaN when there are none
+    '''
+    rows,window=_expand(lo,hi)
+
+    match=index['offer'][rows]==np.asarray(offer)[window]
+    rows,window=rows[match],window[match]
+
+    count=np.bincount(window,minlength=len(lo))
+
+    #the rows of a window are sorted by time, so the first match of a window is its earliest event
+    first=np.full(len(lo),np.nan)
+    windows,at=np.unique(window,return_index=True)
+    first[windows]=index['time'][rows[at]]
+
+    return count,first
+
+if __name__=='__main__':
+    #python event_index.py [data dir] builds the index of the stored transcript and stores it next to it
+    directory=sys.argv[1] if len(sys.argv)>1 else storage.DATA_DIR
+
+    try:
+        transcript=storage.read_table('transcript',directory,columns=['person','event','time','offer id','amount'])
+    except FileNotFoundError:
+        sys.exit('please create the preprocessed files with data_preprocessing.py first')
+
+    save_index(build_index(transcript),directory)
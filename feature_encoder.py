@@ -0,0 +1,128 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+FORMATS=['csr','dense','frame']
+
+
+def fit_encoder(df,num,cat):
+    '''store the vocabulary of the categorical features so that they are encoded the same way later
+
+    the categories of categorical columns are kept in the order of their dtype, including the ones
+    that don't occur, like pd.get_dummies does; other columns keep their sorted values.
+
+    args:
+        df(pandas dataframe): the dataset to fit on
+        num(list): the numeric features, used as they are
+        cat(list): the categorical features to one-hot encode
+
+    returns:
+        encoder(dict): the numeric features and the categories of every categorical feature
+    '''
+    vocabulary={}
+    for col in cat:
+        values=df[col]
+        if isinstance(values.dtype,pd.CategoricalDtype):
+            categories=values.cat.categories
+        else:
+            categories=pd.Index(values.dropna().unique()).sort_values()
+        vocabulary[col]=[str(category) for category in categories]
+
+    return {'num':list(num),'cat':vocabulary}
+
+def feature_names(encoder):
+    '''the names of the encoded features in order, the dummies are named like pd.get_dummies names them'''
+    return encoder['num']+['{}_{}'.format(col,category) for col,categories in encoder['cat'].items()
+                           for category in categories]
+
+def category_codes(values,categories):
+    '''the position of every value in categories, -1 for missing values and unknown categories'''
+    categories=pd.Index(categories)
+
+    #categorical columns are looked up once per category instead of once per row
+    if isinstance(values.dtype,pd.CategoricalDtype):
+        lookup=np.append(categories.get_indexer(values.cat.categories.astype(str)),-1)
+        return lookup[values.cat.codes.to_numpy()]
+
+    codes=categories.get_indexer(values.astype(str))
+    codes[values.isna().to_numpy()]=-1
+
+    return codes
+
+def transform(encoder,df,fmt='csr'):
+    '''encode df with the stored vocabulary
+
+    the columns are always the ones of feature_names(encoder). A category that wasn't seen when the
+    encoder was fitted, or a missing value, sets none of the dummies of its feature.
+
+    args:
+        encoder(dict): the encoder from fit_encoder or load_encoder
+        df(pandas dataframe): the dataset to encode
+        fmt(str): 'csr' for a float32 sparse matrix, 'dense' for a float32 array, or 'frame' for a
+            dataframe with the numeric features as they are and uint8 dummies
+
+    returns:
+        X: the encoded features
+    '''
+    if fmt not in FORMATS:
+        raise ValueError('unknown format {}'.format(fmt))
+
+    n,n_num=len(df),len(encoder['num'])
+    names=feature_names(encoder)
+
+    #the column of the dummy set in every row, one per categorical feature, -1 for none
+    offset=n_num
+    columns=np.empty((n,len(encoder['cat'])),dtype=np.int32)
+    for i,(col,categories) in enumerate(encoder['cat'].items()):
+        codes=category_codes(df[col],categories)
+        columns[:,i]=np.where(codes>=0,codes+offset,-1)
+        offset+=len(categories)
+
+    if fmt=='frame':
+        dummies=np.zeros((n,offset-n_num),dtype=np.uint8)
+        _set_dummies(dummies,columns,n_num)
+        frame=pd.DataFrame(dummies,columns=names[n_num:],index=df.index)
+        return pd.concat([df[encoder['num']],frame],axis=1,copy=False)
+
+    num=df[encoder['num']].to_numpy(dtype=np.float32)
+
+    if fmt=='dense':
+        X=np.zeros((n,offset),dtype=np.float32)
+        X[:,:n_num]=num
+        _set_dummies(X,columns)
+        return X
+
+    from scipy import sparse
+
+    #every row holds its nonzero numeric features followed by its dummies, so the csr arrays are
+    #the row-major arrays of both with the zeros and the unset dummies masked out
+    data=np.hstack([num,np.ones(columns.shape,dtype=np.float32)])
+    indices=np.hstack([np.broadcast_to(np.arange(n_num,dtype=np.int32),num.shape),columns])
+    keep=(data!=0) & (indices>=0)
+
+    indptr=np.zeros(n+1,dtype=np.int64)
+    np.cumsum(keep.sum(axis=1),out=indptr[1:])
+
+    return sparse.csr_matrix((data[keep],indices[keep],indptr),shape=(n,offset))
+
+def _set_dummies(X,columns,first=0):
+    '''set the dummies of columns to 1 in X, whose first column is the feature first'''
+    width=X.shape[1]
+    flat=X.reshape(-1)
+
+    #the flat positions of all the set dummies, scattered at once
+    positions=np.arange(len(X),dtype=np.int64)[:,None]*width+(columns-first)
+    flat[positions[columns>=0]]=1
+
+def save_encoder(encoder,path):
+    '''store the encoder as json'''
+    os.makedirs(os.path.dirname(path) or '.',exist_ok=True)
+    with open(path,'w') as f:
+        json.dump(encoder,f)
+
+def load_encoder(path):
+    '''read an encoder stored by save_encoder'''
+    with open(path) as f:
+        return json.load(f)
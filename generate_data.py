@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+#the 10 offers of the Starbucks portfolio
+PORTFOLIO=[
+    {'reward':10,'channels':['email','mobile','social'],'difficulty':10,'duration':7.0,'offer_type':'bogo','id':'ae264e3637204a6fb9bb56bc8210ddfd'},
+    {'reward':10,'channels':['web','email','mobile','social'],'difficulty':10,'duration':5.0,'offer_type':'bogo','id':'4d5c57ea9a6940dd891ad53e9dbe8da0'},
+    {'reward':0,'channels':['web','email','mobile'],'difficulty':0,'duration':4.0,'offer_type':'informational','id':'3f207df678b143eea3cee63160fa8bed'},
+    {'reward':5,'channels':['web','email','mobile'],'difficulty':5,'duration':7.0,'offer_type':'bogo','id':'9b98b8c7a33c4b65b9aebfe6a799e6d9'},
+    {'reward':5,'channels':['web','email'],'difficulty':20,'duration':10.0,'offer_type':'discount','id':'0b1e1539f2cc45b7b9fa7c272da2e1d7'},
+    {'reward':3,'channels':['web','email','mobile','social'],'difficulty':7,'duration':7.0,'offer_type':'discount','id':'2298d6c36e964ae4a3e7e9706d1fb8c2'},
+    {'reward':2,'channels':['web','email','mobile','social'],'difficulty':10,'duration':10.0,'offer_type':'discount','id':'fafdcd668e3743c1bb461111dcafc2a4'},
+    {'reward':0,'channels':['email','mobile','social'],'difficulty':0,'duration':3.0,'offer_type':'informational','id':'5a8bc65990b245e5a138643cd4eb9837'},
+    {'reward':5,'channels':['web','email','mobile','social'],'difficulty':5,'duration':5.0,'offer_type':'bogo','id':'f19421c1d4aa40978ebb69ca19b0e20d'},
+    {'reward':2,'channels':['web','email','mobile'],'difficulty':10,'duration':7.0,'offer_type':'discount','id':'2906b810c7d4411798c6938adc9daaa5'},
+]
+
+#the test sends offers in six waves and lasts 30 days (hours)
+OFFER_TIMES=np.array([0,168,336,408,504,576])
+END_TIME=714
+
+
+def hex_ids(rng,n):
+    '''create n random 32 character hex ids like the customer ids of the dataset'''
+    raw=rng.bytes(16*n).hex()
+    return np.array([raw[32*i:32*i+32] for i in range(n)],dtype=object)
+
+def generate_profile(rng,n):
+    '''generate n customers with the gender, age, income and membership date distributions of profile.json
+
+    args:
+        rng(numpy generator): the random generator
+        n(int): the number of customers
+
+    returns:
+        profile(pandas dataframe): gender, age, id, became_member_on and income of every customer
+    '''
+    gender=rng.choice(np.array(['M','F','O',None],dtype=object),size=n,p=[0.499,0.361,0.012,0.128])
+    missing=pd.isnull(gender)
+
+    #customers without demographic data have age 118 and no income, as in the real dataset
+    age=np.clip(rng.normal(55,17,n),18,101).astype(np.int64)
+    age[missing]=118
+    income=np.round(np.clip(rng.normal(65000,21000,n),30000,120000),-3)
+    income[missing]=np.nan
+
+    #membership dates between 2013-07-29 and 2018-07-26, more members joined recently
+    member_date=pd.DatetimeIndex(np.datetime64('2013-07-29')+rng.triangular(0,1800,1823,n).astype('timedelta64[D]'))
+    became_member_on=(member_date.year*10000+member_date.month*100+member_date.day).astype(str)
+
+    return pd.DataFrame({'gender':gender,'age':age,'id':hex_ids(rng,n),'became_member_on':became_member_on,
+                         'income':pd.array(income,dtype='Int64')})
+
+def generate_transcript(rng,profile,portfolio=PORTFOLIO):
+    '''generate the event log of the customers in profile
+
+    every customer gets an offer in each of the six waves with probability 0.75, views it with a
+    probability that grows with the channels of the offer, and completes bogo and discount offers
+    with a transaction of at least the offer difficulty inside the offer window. On top of that every
+    customer makes a Poisson number of transactions at random times.
+
+    args:
+        rng(numpy generator): the random generator
+        profile(pandas dataframe): the customers, see generate_profile
+        portfolio(list): the offers
+
+    returns:
+        transcript(pandas dataframe): person, event, time, offer(the index of the offer, -1 for
+            transactions), amount and reward of every event, sorted by time
+    '''
+    n=profile.shape[0]
+    duration=np.array([offer['duration'] for offer in portfolio])*24
+    difficulty=np.array([offer['difficulty'] for offer in portfolio],dtype=np.float64)
+    reward=np.array([offer['reward'] for offer in portfolio],dtype=np.float64)
+    informational=np.array([offer['offer_type']=='informational' for offer in portfolio])
+    n_channels=np.array([len(offer['channels']) for offer in portfolio])
+
+    #how much a customer spends, customers without demographic data spend less
+    spend_rate=rng.gamma(2.0,4.0,n)*np.where(profile['age'].to_numpy()==118,0.5,1.0)
+    engagement=rng.beta(2,2,n)
+
+    #offers received
+    person,wave=np.nonzero(rng.random((n,len(OFFER_TIMES)))<0.75)
+    offer=rng.integers(0,len(portfolio),len(person))
+    t_rec=OFFER_TIMES[wave]
+    window=duration[offer]
+
+    #offers viewed, more channels means a higher chance to view the offer
+    p_view=np.clip(0.35+0.1*n_channels[offer]+0.2*(engagement[person]-0.5),0,1)
+    viewed=rng.random(len(person))<p_view
+    t_view=t_rec+np.minimum(rng.exponential(30,len(person)),window).astype(np.int64)
+
+    #offers completed with a transaction of at least the difficulty inside the window
+    p_complete=np.clip(0.3+0.4*engagement[person]+0.15*viewed-0.01*difficulty[offer],0,1)
+    completed=~informational[offer] & (rng.random(len(person))<p_complete)
+    t_com=np.minimum(t_rec+(rng.random(len(person))*window).astype(np.int64),END_TIME)
+    amount_com=np.round(difficulty[offer]+rng.uniform(0.5,8,len(person)),2)
+
+    #transactions that are not related to offers
+    n_tran=rng.poisson(0.8*spend_rate)
+    tran_person=np.repeat(np.arange(n),n_tran)
+    t_tran=rng.integers(0,END_TIME+1,len(tran_person))
+    amount_tran=np.round(rng.lognormal(2.2,0.7,len(tran_person)),2)
+
+    parts=[
+        (person,'offer received',t_rec,offer,np.nan,np.nan),
+        (person[viewed],'offer viewed',t_view[viewed],offer[viewed],np.nan,np.nan),
+        (person[completed],'transaction',t_com[completed],-1,amount_com[completed],np.nan),
+        (person[completed],'offer completed',t_com[completed],offer[completed],np.nan,reward[offer[completed]]),
+        (tran_person,'transaction',t_tran,-1,amount_tran,np.nan),
+    ]
+
+    transcript=pd.concat([pd.DataFrame({'person':p,'event':e,'time':t,'offer':o,'amount':a,'reward':r})
+                          for p,e,t,o,a,r in parts],ignore_index=True)
+    transcript['person']=profile['id'].to_numpy()[transcript['person'].to_numpy()]
+
+    return transcript.sort_values('time',kind='stable',ignore_index=True)
+
+def transcript_lines(transcript,portfolio=PORTFOLIO):
+    '''format the events in the line-delimited json layout of transcript.json'''
+    offer_ids=np.array([offer['id'] for offer in portfolio]+[''],dtype=object)
+    offer_id=pd.Series(offer_ids[transcript['offer'].to_numpy()],index=transcript.index)
+    event=transcript['event']
+
+    value=pd.Series('',index=transcript.index)
+    value[event.isin(['offer received','offer viewed'])]='{"offer id": "'+offer_id+'"}'
+    is_tran=event=='transaction'
+    value[is_tran]='{"amount": '+transcript.loc[is_tran,'amount'].map('{:.2f}'.format)+'}'
+    is_com=event=='offer completed'
+    value[is_com]='{"offer_id": "'+offer_id[is_com]+'", "reward": '+transcript.loc[is_com,'reward'].astype(int).astype(str)+'}'
+
+    return ('{"person": "'+transcript['person']+'", "event": "'+event+'", "value": '+value+
+            ', "time": '+transcript['time'].astype(str)+'}')
+
+def generate(out_dir,customers=17000,seed=0,chunk=100000,portfolio=PORTFOLIO):
+    '''write portfolio.json, profile.json and transcript.json for a synthetic test
+
+    the customers are generated in chunks so that memory doesn't grow with the number of customers;
+    the transcript is sorted by time within every chunk.
+
+    args:
+        out_dir(str): the directory to write the files to
+        customers(int): the number of customers
+        seed(int): the seed of the random generator, the same seed gives the same files
+        chunk(int): the number of customers generated at once
+        portfolio(list): the offers
+
+    returns:
+        rows(dict): the number of lines written to every file
+    '''
+    rng=np.random.default_rng(seed)
+    os.makedirs(out_dir,exist_ok=True)
+
+    with open(os.path.join(out_dir,'portfolio.json'),'w') as f:
+        for offer in portfolio:
+            f.write(json.dumps(offer)+'\n')
+
+    rows={'portfolio':len(portfolio),'profile':0,'transcript':0}
+
+    with open(os.path.join(out_dir,'profile.json'),'w') as profile_file, \
+         open(os.path.join(out_dir,'transcript.json'),'w') as transcript_file:
+        for start in range(0,customers,chunk):
+            profile=generate_profile(rng,min(chunk,customers-start))
+            transcript=generate_transcript(rng,profile,portfolio)
+
+            profile.to_json(profile_file,orient='records',lines=True)
+            transcript_file.write('\n'.join(transcript_lines(transcript,portfolio))+'\n')
+
+            rows['profile']+=profile.shape[0]
+            rows['transcript']+=transcript.shape[0]
+
+    return rows
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='generate a synthetic Starbucks dataset')
+    parser.add_argument('out_dir')
+    parser.add_argument('--customers',type=int,default=17000)
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--chunk',type=int,default=100000,help='customers generated at once')
+    args=parser.parse_args()
+
+    print(generate(args.out_dir,args.customers,args.seed,args.chunk))
@@ -0,0 +1,188 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import storage
+from create_completion import create_completion_df, create_viewed_df
+from data_preprocessing import iter_chunks, preprocess_transcript
+from interval_join import window_aggregate
+
+KEYS=['person','offer id','time_rec']
+
+
+def watermark_path(directory=storage.DATA_DIR):
+    '''the path of the file holding the watermark of the stored offer_profile_vie'''
+    return os.path.join(directory,'watermark.json')
+
+def max_window(portfolio):
+    '''the longest time(hours) an offer stays open, events older than this can't change a window'''
+    return float(portfolio['duration'].max()*24)
+
+def _transactions(events):
+    '''the transactions of events with the amounts at cent precision, as create_completion_df sums them'''
+    transactions=events[events['event']=='transaction'][['person','time','amount']]
+    return transactions.assign(amount=transactions['amount'].astype(np.float64).round(2))
+
+def pending_windows(offer_profile_vie,events):
+    '''find the completed offers that no 'offer completed' event has been matched to yet
+
+    sum_till_com and num_till_com count the transactions up to the first completion at or after
+    receiving the offer, even after offer_del. Until that completion arrives the windows keep a
+    running sum and number of the transactions made since receiving them.
+
+    args:
+        offer_profile_vie(pandas dataframe): the offers with completion and viewing
+        events(pandas dataframe): all the transcript events since the offers were received
+
+    returns:
+        pending(pandas dataframe): the rows of offer_profile_vie of the windows with their run_sum and run_num
+    '''
+    done=offer_profile_vie[offer_profile_vie['complete']==1]
+    com=window_aggregate(done,events[events['event']=='offer completed'],on=['person','offer id'],start='time_rec',end=np.inf)
+    pending=done[com['count'].to_numpy()==0]
+
+    tran=window_aggregate(pending,_transactions(events),on=['person'],start='time_rec',end=np.inf,value='amount')
+
+    return pending.assign(run_sum=tran['sum'].fillna(0).to_numpy(),run_num=tran['count'].to_numpy())
+
+def _resolve_pending(pending,new_events):
+    '''match the first new completion to the pending windows and add the new transactions up to it
+
+    returns:
+        resolved(pandas dataframe): the rows of offer_profile_vie of the windows completed by new_events,
+            with their sum_till_com and num_till_com
+        pending(pandas dataframe): the windows still waiting for a completion with updated running sums
+    '''
+    com=window_aggregate(pending,new_events[new_events['event']=='offer completed'],on=['person','offer id'],
+                         start='time_rec',end=np.inf)
+    time_com=com['first'].fillna(np.inf).to_numpy()
+    tran=window_aggregate(pending,_transactions(new_events),on=['person'],start='time_rec',end=time_com,value='amount')
+
+    pending=pending.assign(run_sum=pending['run_sum'].to_numpy()+tran['sum'].fillna(0).to_numpy(),
+                           run_num=pending['run_num'].to_numpy()+tran['count'].to_numpy())
+
+    completed=com['count'].to_numpy()>0
+    resolved=pending[completed & (pending['run_num'].to_numpy()>0)]
+    resolved=resolved.assign(sum_till_com=resolved['run_sum'],num_till_com=resolved['run_num'].astype(np.float64))
+    resolved=resolved.drop(columns=['run_sum','run_num'])
+
+    return resolved,pending[~completed]
+
+def save_state(offer_profile_vie,pending,events,portfolio,directory=storage.DATA_DIR,append=False):
+    '''store offer_profile_vie, the pending windows, the watermark and the tail of events that open
+       windows may still need
+
+    args:
+        offer_profile_vie(pandas dataframe): the computed offers with completion and viewing
+        pending(pandas dataframe): the windows from pending_windows
+        events(pandas dataframe): the preprocessed transcript events seen so far, at least the tail
+        portfolio(pandas dataframe): the preprocessed portfolio
+        append(bool): offer_profile_vie holds only the added and changed offers, they are appended as a new
+            part that replaces the stored rows with the same keys, see storage.UPSERT_KEYS
+
+    returns:
+        state(dict): the watermark and the start of the stored tail of events
+    '''
+    watermark=float(events['time'].max())
+    tail_start=watermark-max_window(portfolio)
+
+    if append:
+        storage.append_table(offer_profile_vie,'offer_profile_vie',directory)
+    else:
+        storage.write_table(offer_profile_vie,'offer_profile_vie',directory)
+    storage.write_table(pending,'pending_windows',directory)
+    storage.write_table(events[events['time']>=tail_start],'transcript_tail',directory)
+
+    state={'watermark':watermark,'tail_start':tail_start}
+    with open(watermark_path(directory),'w') as f:
+        json.dump(state,f)
+
+    return state
+
+def init_state(portfolio,profile,transcript,directory=storage.DATA_DIR):
+    '''compute offer_profile_vie over the full transcript and store it for incremental updates
+
+    args:
+        portfolio, profile, transcript(pandas dataframe): the preprocessed datasets
+
+    returns:
+        offer_profile_vie(pandas dataframe): the offers with completion and viewing
+    '''
+    offer_profile=create_completion_df(portfolio,profile,transcript)
+    offer_profile_vie=create_viewed_df(transcript,offer_profile)
+
+    save_state(offer_profile_vie,pending_windows(offer_profile_vie,transcript),transcript,portfolio,directory)
+
+    return offer_profile_vie
+
+def update_state(portfolio,profile,new_events,directory=storage.DATA_DIR):
+    '''merge new transcript events into the stored offer_profile_vie
+
+    only the windows of the customers in new_events whose offer_del is at or after the earliest new
+    event are recomputed, from the stored tail of events plus the new ones. Older completed offers
+    still waiting for their completion event are finished from their running sums. The recomputed and
+    finished offers are appended to the stored offer_profile_vie, which isn't read or rewritten.
+
+    args:
+        portfolio, profile(pandas dataframe): the preprocessed portfolio and profile
+        new_events(pandas dataframe): preprocessed transcript events after the watermark, with the ids
+            encoded by storage.encode_ids
+
+    returns:
+        offer_profile_vie(pandas dataframe): the offers that were added or changed
+    '''
+    with open(watermark_path(directory)) as f:
+        state=json.load(f)
+
+    t_new=new_events['time'].min()
+    if t_new<=state['watermark']:
+        raise ValueError('new events start at {}, not after the watermark {}, recompute with init_state'.format(
+            t_new,state['watermark']))
+
+    new_events=storage.apply_schema(new_events,'transcript')
+    events=pd.concat([storage.read_table('transcript_tail',directory),new_events],ignore_index=True)
+
+    #every window of an affected customer that is still open at t_new starts after this cut
+    persons=new_events['person'].unique()
+    cut=t_new-max_window(portfolio)
+    affected=events[events['person'].isin(persons) & (events['time']>=cut)]
+
+    offer_profile=create_completion_df(portfolio,profile,affected)
+    updated=create_viewed_df(affected,offer_profile)
+    updated=updated[updated['offer_del']>=t_new]
+
+    #the stored windows of these customers open at t_new are all received in the cut, so the updated
+    #rows replace every one of them
+    pending=storage.read_table('pending_windows',directory)
+    pending=pending[~(pending['person'].isin(persons) & (pending['offer_del']>=t_new))]
+
+    #finish the closed windows whose completion arrived with new_events
+    resolved,pending=_resolve_pending(pending,new_events)
+
+    offer_profile_vie=pd.concat([storage.apply_schema(resolved,'offer_profile_vie'),
+                                 storage.apply_schema(updated,'offer_profile_vie')],ignore_index=True)
+    pending=pd.concat([pending,pending_windows(updated,events)],ignore_index=True)
+
+    save_state(offer_profile_vie,pending,events,portfolio,directory,append=True)
+
+    #keep the full transcript complete so that it can always be recomputed from scratch
+    storage.append_table(new_events,'transcript',directory)
+
+    return offer_profile_vie
+
+if __name__=='__main__':
+    #python incremental.py new_events.json merges a day of raw transcript events into the stored result
+    portfolio,profile=[storage.read_table(name) for name in ['portfolio','profile']]
+
+    if not os.path.isfile(watermark_path()):
+        init_state(portfolio,profile,storage.read_table('transcript'))
+
+    if len(sys.argv)>1:
+        dictionaries=storage.load_dictionaries()
+        new_events=pd.concat([preprocess_transcript(chunk) for chunk in iter_chunks(sys.argv[1],name='transcript')],ignore_index=True)
+        new_events=storage.encode_ids(new_events,'transcript',dictionaries)
+        storage.save_dictionaries(dictionaries)
+        update_state(portfolio,profile,new_events)
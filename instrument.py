@@ -0,0 +1,210 @@
+import atexit
+import collections
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource=None
+
+#set TRACE_FILE to trace any of the scripts, e.g. TRACE_FILE=trace.json python create_completion.py,
+#and TRACE_SAMPLE_MS to sample their stacks as well
+TRACE_ENV='TRACE_FILE'
+SAMPLE_ENV='TRACE_SAMPLE_MS'
+
+#the trace being recorded, None when tracing is off
+_trace=None
+
+
+def _rss_mb():
+    '''the resident memory of the process in MB, and its peak so far, None where they aren't available'''
+    rss=None
+    try:
+        with open('/proc/self/statm') as f:
+            rss=int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/1024**2
+    except (OSError,ValueError):
+        pass
+
+    peak=None
+    if resource is not None:
+        #ru_maxrss is in kB on linux and in bytes on macos
+        peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/(1024**2 if sys.platform=='darwin' else 1024)
+
+    return rss,peak
+
+def _growth(peak_start,peak_end):
+    '''how much a span raised the peak resident memory of the process, the peak is kept for the lifetime of
+       the process so a span below the peak of an earlier one doesn't raise it'''
+    return None if peak_start is None or peak_end is None else peak_end-peak_start
+
+def _size(values):
+    '''the rows and bytes of the dataframes and arrays among values, looking into tuples, lists and dicts'''
+    rows,nbytes=0,0
+    for value in values:
+        if isinstance(value,(tuple,list)):
+            sub=_size(value)
+        elif isinstance(value,dict):
+            sub=_size(value.values())
+        elif isinstance(value,(pd.DataFrame,pd.Series)):
+            sub=(len(value),int(value.memory_usage(index=False).sum()) if isinstance(value,pd.DataFrame)
+                 else int(value.memory_usage(index=False)))
+        elif isinstance(value,np.ndarray):
+            sub=(len(value) if value.ndim else 1,value.nbytes)
+        else:
+            continue
+        rows+=sub[0]
+        nbytes+=sub[1]
+
+    return rows,nbytes
+
+def enable(trace_file='trace.json',sample_ms=None):
+    '''start recording spans, they are written to trace_file when the process exits or on disable()
+
+    args:
+        trace_file(str): the chrome trace json file to write, open it in chrome://tracing or ui.perfetto.dev
+        sample_ms(float): sample the stack of the main thread every sample_ms milliseconds and write the
+            counts of every stack to trace_file.folded, in the format of flamegraph.pl and speedscope
+    '''
+    global _trace
+    if _trace is not None:
+        disable()
+
+    _trace={'file':trace_file,'pid':os.getpid(),'start':time.perf_counter(),'events':[],'stack':[],
+            'samples':collections.Counter(),'stop':threading.Event()}
+
+    if sample_ms:
+        sampler=threading.Thread(target=_sample,args=(_trace,threading.main_thread().ident,sample_ms/1000),daemon=True)
+        sampler.start()
+        _trace['sampler']=sampler
+
+    atexit.register(disable)
+
+def disable():
+    '''stop recording and write the trace, returns the path of the trace file or None when tracing was off'''
+    global _trace
+    trace,_trace=_trace,None
+
+    #a forked worker inherits the trace of its parent but must not overwrite its file
+    if trace is None or os.getpid()!=trace['pid']:
+        return None
+
+    trace['stop'].set()
+    if 'sampler' in trace:
+        trace['sampler'].join()
+
+    with open(trace['file'],'w') as f:
+        json.dump({'traceEvents':trace['events'],'displayTimeUnit':'ms'},f)
+
+    if trace['samples']:
+        with open(trace['file']+'.folded','w') as f:
+            for stack,count in trace['samples'].most_common():
+                f.write('{} {}\n'.format(stack,count))
+
+    return trace['file']
+
+def _sample(trace,thread_id,interval):
+    '''count the stacks of a thread, prefixed by the open spans, until the trace is stopped'''
+    while not trace['stop'].wait(interval):
+        frame=sys._current_frames().get(thread_id)
+        stack=[]
+        while frame is not None:
+            code=frame.f_code
+            stack.append('{}:{}'.format(os.path.basename(code.co_filename),code.co_name))
+            frame=frame.f_back
+
+        trace['samples'][';'.join(['span:'+name for name in trace['stack']]+stack[::-1])]+=1
+
+@contextlib.contextmanager
+def span(name,*inputs):
+    '''record the time and memory spent in a block, does nothing when tracing is off
+
+    the block can set info['outputs'] to its result to record the rows and bytes it produced, e.g.
+        with span('merge',df) as info:
+            info['outputs']=df.merge(...)
+
+    args:
+        name(str): the name of the span, the names of the enclosing spans are its parents
+        inputs: the dataframes and arrays the block reads, their rows and bytes are recorded
+    '''
+    info={}
+    trace=_trace
+
+    #the spans are only recorded in the process that enabled tracing, not in forked workers
+    if trace is None or os.getpid()!=trace['pid']:
+        yield info
+        return
+
+    rows_in,bytes_in=_size(inputs)
+    rss_start,peak_start=_rss_mb()
+    cpu_start=time.process_time()
+    start=time.perf_counter()
+    trace['stack'].append(name)
+
+    try:
+        yield info
+    finally:
+        wall=time.perf_counter()-start
+        cpu=time.process_time()-cpu_start
+        trace['stack'].pop()
+        rss_end,peak_end=_rss_mb()
+        rows_out,bytes_out=_size([info['outputs']]) if 'outputs' in info else (0,0)
+
+        trace['events'].append({'name':name,'cat':'span','ph':'X','pid':trace['pid'],'tid':threading.get_ident(),
+                                'ts':(start-trace['start'])*1e6,'dur':wall*1e6,
+                                'args':{'wall_s':wall,'cpu_s':cpu,'rss_start_mb':rss_start,'rss_end_mb':rss_end,
+                                        'peak_growth_mb':_growth(peak_start,peak_end),'process_peak_mb':peak_end,
+                                        'rows_in':rows_in,'bytes_in':bytes_in,
+                                        'rows_out':rows_out,'bytes_out':bytes_out}})
+
+def traced(func):
+    '''record every call of func as a span named after it, with its arguments as inputs and its result as outputs'''
+    #named after the file rather than the module, which is __main__ when the file is run as a script
+    name='{}.{}'.format(os.path.splitext(os.path.basename(func.__code__.co_filename))[0],func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args,**kwargs):
+        if _trace is None:
+            return func(*args,**kwargs)
+
+        with span(name,*args,*kwargs.values()) as info:
+            info['outputs']=func(*args,**kwargs)
+        return info['outputs']
+
+    return wrapper
+
+def summarize(trace_file):
+    '''sum the spans of a trace file by name
+
+    returns:
+        summary(pandas dataframe): the calls, wall and cpu seconds, largest peak growth and rows of every span,
+            the slowest first
+    '''
+    with open(trace_file) as f:
+        events=json.load(f)['traceEvents']
+
+    spans=pd.DataFrame([dict(event['args'],name=event['name']) for event in events])
+    if spans.empty:
+        return spans
+
+    summary=spans.groupby('name').agg(calls=('wall_s','size'),wall_s=('wall_s','sum'),cpu_s=('cpu_s','sum'),
+                                      peak_growth_mb=('peak_growth_mb','max'),rows_in=('rows_in','sum'),
+                                      rows_out=('rows_out','sum'))
+
+    return summary.sort_values('wall_s',ascending=False)
+
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV],float(os.environ[SAMPLE_ENV]) if os.environ.get(SAMPLE_ENV) else None)
+
+if __name__=='__main__':
+    #print the spans of a trace, e.g. python instrument.py trace.json
+    with pd.option_context('display.width',200,'display.max_rows',200,'display.max_columns',20):
+        print(summarize(sys.argv[1] if len(sys.argv)>1 else 'trace.json'))
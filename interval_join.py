@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+
+def _as_array(df,col):
+    '''return a column of df as a float array, col can also be a scalar or an array-like'''
+    if isinstance(col,str):
+        return df[col].to_numpy(dtype=np.float64)
+    return np.broadcast_to(np.asarray(col,dtype=np.float64),(df.shape[0],))
+
+
+def key_codes(windows,events,on):
+    '''factorize the join keys of windows and events into one shared integer code
+
+    args:
+        windows, events(pandas dataframe): the two frames to be joined
+        on(list): the names of the key columns, e.g. ['person'] or ['person','offer id']
+
+    returns:
+        win_codes, ev_codes(ndarray): int64 codes of the keys, -1 means a missing key
+    '''
+    n_win=windows.shape[0]
+    codes=np.zeros(n_win+events.shape[0],dtype=np.int64)
+    missing=np.zeros(codes.shape[0],dtype=bool)
+
+    for key in on:
+        if pd.api.types.is_integer_dtype(windows[key]) and pd.api.types.is_integer_dtype(events[key]):
+            #integer coded ids are used as they are, negative codes are missing ids
+            key_code=np.concatenate([windows[key].to_numpy(dtype=np.int64),events[key].to_numpy(dtype=np.int64)])
+            n_keys=int(key_code.max())+1 if len(key_code) else 0
+        else:
+            values=np.concatenate([np.asarray(windows[key],dtype=object),np.asarray(events[key],dtype=object)])
+            key_code,uniques=pd.factorize(values)
+            n_keys=len(uniques)
+        missing|=key_code<0
+        codes=codes*(n_keys+1)+key_code
+
+    #squeeze the combined codes back into a dense range
+    codes=pd.factorize(codes)[0].astype(np.int64)
+    codes[missing]=-1
+
+    return codes[:n_win],codes[n_win:]
+
+
+def window_bounds(win_codes,win_start,win_end,ev_codes,ev_time):
+    '''find for every window the slice of events with the same key and start <= time <= end
+
+    the events are sorted once by (key, time) and both window bounds are located with a binary
+    search on a combined (key, time rank) value, so the offers x transactions cross product is
+    never built.
+
+    args:
+        win_codes, ev_codes(ndarray): integer keys of windows and events from key_codes
+        win_start, win_end(ndarray): bounds of the windows, both inclusive
+        ev_time(ndarray): time of the events
+
+    returns:
+        order(ndarray): the positions of events sorted by key and time
+        lo, hi(ndarray): events order[lo[i]:hi[i]] fall inside window i
+    '''
+    valid=(ev_codes>=0) & ~np.isnan(ev_time)
+    order=np.flatnonzero(valid)
+    order=order[np.lexsort((ev_time[order],ev_codes[order]))]
+
+    #rank all the time values so that (key, time) can be packed into a single int64
+    times,ranks=np.unique(np.concatenate([ev_time[order],win_start,win_end]),return_inverse=True)
+    width=len(times)+1
+    n_ev=len(order)
+    ev_rank=ranks[:n_ev]
+    start_rank=ranks[n_ev:n_ev+len(win_start)]
+    end_rank=ranks[n_ev+len(win_start):]
+
+    ev_key=ev_codes[order]*width+ev_rank
+    lo=np.searchsorted(ev_key,win_codes*width+start_rank,side='left')
+    hi=np.searchsorted(ev_key,win_codes*width+end_rank,side='right')
+
+    #windows without a key or bounds, or with end < start, don't contain any events
+    empty=(win_codes<0) | np.isnan(win_start) | np.isnan(win_end) | (hi<lo)
+    hi[empty]=lo[empty]
+
+    return order,lo,hi
+
+
+def window_aggregate(windows,events,on,start,end,time='time',value=None):
+    '''aggregate the events falling inside each window of the same key
+
+    args:
+        windows(pandas dataframe): one row per window, e.g. the received offers
+        events(pandas dataframe): the events to assign to windows, e.g. the transactions
+        on(list): the key columns shared by windows and events
+        start, end(str or scalar): the window bounds (inclusive), a column of windows or a constant
+        time(str): the time column of events
+        value(str): optional column of events to calculate sum and max of
+
+    returns:
+        agg(pandas dataframe): indexed like windows with the columns count and first (the time of the
+        earliest event in the window), and sum, max when value is given; first, sum and max are NaN
+        for empty windows
+    '''
+    win_codes,ev_codes=key_codes(windows,events,on)
+    ev_time=events[time].to_numpy(dtype=np.float64)
+
+    order,lo,hi=window_bounds(win_codes,_as_array(windows,start),_as_array(windows,end),ev_codes,ev_time)
+
+    count=hi-lo
+    nonempty=count>0
+
+    first=np.full(len(count),np.nan)
+    first[nonempty]=ev_time[order[lo[nonempty]]]
+
+    agg=pd.DataFrame({'count':count,'first':first},index=windows.index)
+
+    if value is not None:
+        #expand only the (window, event) pairs that actually match, grouped by window
+        lengths=count[nonempty]
+        offsets=np.cumsum(lengths)-lengths
+        pos=np.repeat(lo[nonempty]-offsets,lengths)+np.arange(lengths.sum())
+        values=events[value].to_numpy(dtype=np.float64)[order[pos]]
+
+        for name,ufunc in [('sum',np.add),('max',np.maximum)]:
+            result=np.full(len(count),np.nan)
+            if len(values):
+                result[nonempty]=ufunc.reduceat(values,offsets)
+            agg[name]=result
+
+    return agg
@@ -0,0 +1,120 @@
+import os
+import shutil
+import sys
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import storage
+from create_completion import create_completion_df, create_viewed_df
+
+
+def shard_of(ids,n_shards):
+    '''hash customer ids to shards, the hash doesn't depend on the process or the order of the ids
+
+    args:
+        ids(array-like): customer ids or their integer codes
+        n_shards(int): the number of shards
+
+    returns:
+        shards(ndarray): the shard of every id
+    '''
+    return (pd.util.hash_array(np.asarray(ids))%n_shards).astype(np.int64)
+
+def write_shards(portfolio,profile,transcript,n_shards,directory):
+    '''partition profile and transcript by customer and store every shard as memory mapped feather files
+
+    args:
+        portfolio, profile, transcript(pandas dataframe): the preprocessed datasets
+        n_shards(int): the number of shards
+        directory(str): the directory to write the shards to
+
+    returns:
+        shard_dirs(list): the directory of every shard
+    '''
+    profile_shard=shard_of(profile['id'],n_shards)
+    transcript_shard=shard_of(transcript['person'],n_shards)
+
+    shard_dirs=[]
+    for shard in range(n_shards):
+        shard_dir=os.path.join(directory,'shard-{:05d}'.format(shard))
+        storage.write_table(portfolio,'portfolio',shard_dir)
+        storage.write_table(profile[profile_shard==shard],'profile',shard_dir)
+        storage.write_table(transcript[transcript_shard==shard],'transcript',shard_dir)
+        shard_dirs.append(shard_dir)
+
+    return shard_dirs
+
+def run_shard(shard_dir,engine='interval'):
+    '''run the completion and viewed stages on one shard and store the result next to it
+
+    args:
+        shard_dir(str): the directory of the shard
+        engine(str): the engine of create_completion_df and create_viewed_df
+
+    returns:
+        shard_dir(str): the directory of the shard holding offer_profile_vie
+    '''
+    portfolio,profile,transcript=[storage.read_table(name,shard_dir) for name in ['portfolio','profile','transcript']]
+
+    offer_profile=create_completion_df(portfolio,profile,transcript,engine=engine)
+    offer_profile_vie=create_viewed_df(transcript,offer_profile,engine=engine)
+
+    storage.write_table(offer_profile_vie,'offer_profile_vie',shard_dir)
+
+    return shard_dir
+
+def run_sharded(portfolio,profile,transcript,workers=4,shard_size=None,engine='interval',directory=None):
+    '''run the completion and viewed stages on shards of customers in a process pool
+
+    the stages only ever join events of the same customer, so every shard can be processed on its own.
+    The shards are handed to the workers as memory mapped feather files rather than pickled frames, and
+    the concatenated results are sorted by person, time_rec and offer id, so the output doesn't depend
+    on the number of workers or shards.
+
+    args:
+        portfolio, profile, transcript(pandas dataframe): the preprocessed datasets
+        workers(int): the number of worker processes, 1 runs the shards in this process
+        shard_size(int): the number of customers per shard, by default 4 shards per worker
+        engine(str): the engine of create_completion_df and create_viewed_df
+        directory(str): the directory for the shards, a temporary directory by default
+
+    returns:
+        offer_profile_vie(pandas dataframe): the offers with completion and viewing of all customers
+    '''
+    n_persons=transcript['person'].nunique()
+    n_shards=max(1,-(-n_persons//shard_size)) if shard_size else 4*workers
+
+    tmp_dir=directory or tempfile.mkdtemp(prefix='shards-')
+
+    try:
+        shard_dirs=write_shards(portfolio,profile,transcript,n_shards,tmp_dir)
+
+        if workers==1:
+            done=[run_shard(shard_dir,engine) for shard_dir in shard_dirs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                done=list(pool.map(run_shard,shard_dirs,[engine]*n_shards))
+
+        offer_profile_vie=pd.concat([storage.read_table('offer_profile_vie',shard_dir,memory_map=False)
+                                     for shard_dir in done],ignore_index=True)
+        offer_profile_vie=storage.apply_schema(offer_profile_vie,'offer_profile_vie')
+        offer_profile_vie=offer_profile_vie.sort_values(['person','time_rec','offer id'],kind='stable',ignore_index=True)
+    finally:
+        if directory is None:
+            shutil.rmtree(tmp_dir,ignore_errors=True)
+
+    return offer_profile_vie
+
+if __name__=='__main__':
+    #python parallel.py [workers] [shard size]
+    workers=int(sys.argv[1]) if len(sys.argv)>1 else os.cpu_count()
+    shard_size=int(sys.argv[2]) if len(sys.argv)>2 else None
+
+    portfolio,profile,transcript=[storage.read_table(name) for name in ['portfolio','profile','transcript']]
+    offer_profile_vie=run_sharded(portfolio,profile,transcript,workers=workers,shard_size=shard_size)
+
+    storage.write_table(offer_profile_vie,'offer_profile_vie')
@@ -0,0 +1,322 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import instrument
+import storage
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+
+CACHE_DIR='.pipeline_cache'
+
+DEFAULT_PARAMS={'raw':'Data/*.json','data_dir':storage.DATA_DIR,'chunksize':100000,'engine':'interval','search':'grid','k':3}
+
+
+def _run_preprocess(params):
+    from data_preprocessing import stream_preprocess
+    stream_preprocess(files_path=params['raw'],outdir=params['data_dir'],chunksize=params['chunksize'])
+
+def _run_completion(params):
+    if params['engine']=='duckdb':
+        from duckdb_backend import create_completion_table
+        return create_completion_table(params['data_dir'])
+
+    from create_completion import create_completion_df
+    portfolio,profile,transcript=[storage.read_table(name,params['data_dir']) for name in ['portfolio','profile','transcript']]
+
+    #the index engine stores the event index next to the data, the viewed stage reads it instead of the transcript
+    index=None
+    if params['engine']=='index':
+        from event_index import build_index, save_index
+        index=build_index(transcript)
+        save_index(index,params['data_dir'])
+
+    offer_profile=create_completion_df(portfolio,profile,transcript,engine=params['engine'],index=index)
+    storage.write_table(offer_profile,'offer_profile',params['data_dir'])
+
+def _run_viewed(params):
+    if params['engine']=='duckdb':
+        from duckdb_backend import create_viewed_table
+        return create_viewed_table(params['data_dir'])
+
+    from create_completion import create_viewed_df
+    if params['engine']=='index':
+        from event_index import load_index
+        offer_profile_vie=create_viewed_df(None,storage.read_table('offer_profile',params['data_dir']),engine='index',
+                                           index=load_index(params['data_dir']))
+        return storage.write_table(offer_profile_vie,'offer_profile_vie',params['data_dir'])
+
+    transcript,offer_profile=[storage.read_table(name,params['data_dir']) for name in ['transcript','offer_profile']]
+    offer_profile_vie=create_viewed_df(transcript,offer_profile,engine=params['engine'])
+    storage.write_table(offer_profile_vie,'offer_profile_vie',params['data_dir'])
+
+def _run_features(params):
+    from customer_features import create_customer_features
+    transcript=storage.read_table('transcript',params['data_dir'],columns=['person','event','time','amount'])
+    storage.write_table(create_customer_features(transcript),'customer_features',params['data_dir'])
+
+def _run_bins(params):
+    from binning import fit_bins, save_bins, BINS
+    columns=[spec['column'] for spec in BINS.values()]
+    save_bins(fit_bins(storage.read_table('offer_profile_vie',params['data_dir'],columns=columns)),params['data_dir'])
+
+def _run_cube(params):
+    from binning import load_bins
+    from create_vis import build_ocr_cubes, VIS_COLUMNS
+    cubes=build_ocr_cubes(storage.read_table('offer_profile_vie',params['data_dir'],columns=VIS_COLUMNS),
+                          load_bins(params['data_dir']))
+    for name,cube in cubes.items():
+        storage.write_table(cube,name,params['data_dir'])
+
+def _run_vis(params):
+    from render import render_figures
+    #the figures are drawn from the stored cubes in parallel
+    render_figures(['view_cpl_ncpl','offer_profile','age_income','user_profile_ocr'],params['data_dir'])
+
+def _run_model(params):
+    from binning import load_bins
+    from predictive_model import train_model, MODEL_COLUMNS
+    train_model(storage.read_table('offer_profile_vie',params['data_dir'],columns=MODEL_COLUMNS),load_bins(params['data_dir']),
+                search=params['search'],n_jobs=-1 if params['search']=='halving' else None)
+
+def _run_targets(params):
+    from binning import load_bins
+    from predictive_model import load_search, model_encoder
+    from targeting import target_offers
+    estimator,_=load_search()
+    portfolio,profile=[storage.read_table(name,params['data_dir']) for name in ['portfolio','profile']]
+    target_offers(estimator,portfolio,profile,load_bins(params['data_dir']),k=params['k'],
+                  directory=params['data_dir'],encoder=model_encoder(estimator))
+
+#the stages of the pipeline: the stages they depend on, the raw input files, the code and parameters
+#that determine their output, the files they write and how to run them
+STAGES={
+    'preprocess':{'deps':[],'inputs':lambda params: sorted(glob.glob(params['raw'])),
+                  'code':['data_preprocessing.py','storage.py'],'params':['raw','chunksize'],
+                  'outputs':lambda params: [os.path.join(params['data_dir'],name) for name in
+                                            ['portfolio','profile','transcript','person_ids','offer_ids']],
+                  'run':_run_preprocess},
+    'completion':{'deps':['preprocess'],'inputs':lambda params: [],
+                  'code':['create_completion.py','interval_join.py','event_index.py','dimensions.py','duckdb_backend.py',
+                          'storage.py'],
+                  'params':['engine'],
+                  'outputs':lambda params: [os.path.join(params['data_dir'],name) for name in
+                                            ['offer_profile']+(['event_index'] if params['engine']=='index' else [])],
+                  'run':_run_completion},
+    'viewed':{'deps':['preprocess','completion'],'inputs':lambda params: [],
+              'code':['create_completion.py','interval_join.py','event_index.py','duckdb_backend.py','storage.py'],
+              'params':['engine'],
+              'outputs':lambda params: [os.path.join(params['data_dir'],'offer_profile_vie')],
+              'run':_run_viewed},
+    'features':{'deps':['preprocess'],'inputs':lambda params: [],
+                'code':['customer_features.py','storage.py'],'params':[],
+                'outputs':lambda params: [os.path.join(params['data_dir'],'customer_features')],
+                'run':_run_features},
+    'bins':{'deps':['viewed'],'inputs':lambda params: [],
+            'code':['binning.py','storage.py'],'params':[],
+            'outputs':lambda params: [os.path.join(params['data_dir'],'bins.json')],
+            'run':_run_bins},
+    'cube':{'deps':['viewed','bins'],'inputs':lambda params: [],
+            'code':['create_vis.py','binning.py','storage.py'],'params':[],
+            'outputs':lambda params: [os.path.join(params['data_dir'],name) for name in ['ocr_cube','ocr_profile_cube']],
+            'run':_run_cube},
+    'vis':{'deps':['viewed','cube'],'inputs':lambda params: [],
+           'code':['render.py','create_vis.py','storage.py'],'params':[],
+           'outputs':lambda params: ['view_cpl_ncpl.JPEG','offer_profile.JPEG','age_income.JPEG','user_profile_ocr.JPEG'],
+           'run':_run_vis},
+    'model':{'deps':['viewed','bins'],'inputs':lambda params: [],
+             'code':['predictive_model.py','feature_encoder.py','binning.py','storage.py'],'params':['search'],
+             'outputs':lambda params: ['feat_im.JPEG','model'],
+             'run':_run_model},
+    'targets':{'deps':['preprocess','bins','model'],'inputs':lambda params: [],
+               'code':['targeting.py','predictive_model.py','feature_encoder.py','binning.py','storage.py'],
+               'params':['k'],'outputs':lambda params: [os.path.join(params['data_dir'],'targets')],
+               'run':_run_targets},
+}
+
+
+def hash_file(path,h=None):
+    '''add the content of a file, or of all the files in a directory, to a sha256 hash'''
+    h=h or hashlib.sha256()
+    paths=sorted(glob.glob(os.path.join(path,'**','*'),recursive=True)) if os.path.isdir(path) else [path]
+
+    for file in paths:
+        if os.path.isfile(file):
+            h.update(os.path.relpath(file,path).encode())
+            with open(file,'rb') as f:
+                for block in iter(lambda: f.read(1<<20),b''):
+                    h.update(block)
+
+    return h
+
+def fingerprint(stage,params,dep_fingerprints):
+    '''fingerprint a stage by its inputs, the fingerprints of its dependencies, its code and its parameters
+
+    args:
+        stage(str): the name of the stage
+        params(dict): the pipeline parameters
+        dep_fingerprints(dict): the fingerprints of the stages it depends on
+
+    returns:
+        fingerprint(str): a sha256 hex digest, the stage output is valid as long as it doesn't change
+    '''
+    spec=STAGES[stage]
+    h=hashlib.sha256()
+    h.update(json.dumps({'stage':stage,'params':{key:params[key] for key in spec['params']},
+                         'deps':[dep_fingerprints[dep] for dep in spec['deps']]},sort_keys=True).encode())
+
+    for path in spec['inputs'](params):
+        h.update(path.encode())
+        hash_file(path,h)
+    for path in spec['code']:
+        hash_file(os.path.join(HERE,path),h)
+
+    return h.hexdigest()
+
+def _copy(src,dst):
+    '''copy a file or a directory, replacing dst'''
+    if os.path.isdir(dst):
+        shutil.rmtree(dst)
+    if os.path.dirname(dst):
+        os.makedirs(os.path.dirname(dst),exist_ok=True)
+    if os.path.isdir(src):
+        shutil.copytree(src,dst)
+    else:
+        shutil.copy2(src,dst)
+
+def _entry_size(path):
+    '''the number of bytes of a cache entry'''
+    return sum(os.path.getsize(file) for file in glob.glob(os.path.join(path,'**','*'),recursive=True)
+               if os.path.isfile(file))
+
+def evict(cache_dir=CACHE_DIR,max_bytes=2*1024**3):
+    '''remove the least recently used cache entries until the cache is at most max_bytes
+
+    returns:
+        removed(list): the removed entries
+    '''
+    entries=[path for path in glob.glob(os.path.join(cache_dir,'*','*')) if os.path.isdir(path)]
+    entries=sorted(entries,key=os.path.getmtime)
+    sizes={path:_entry_size(path) for path in entries}
+    total=sum(sizes.values())
+
+    removed=[]
+    for path in entries:
+        if total<=max_bytes:
+            break
+        shutil.rmtree(path)
+        total-=sizes[path]
+        removed.append(path)
+
+    return removed
+
+def plan(targets):
+    '''order the target stages and all the stages they depend on so that dependencies run first'''
+    order=[]
+
+    def visit(stage):
+        if stage not in STAGES:
+            raise ValueError('unknown stage {}'.format(stage))
+        for dep in STAGES[stage]['deps']:
+            visit(dep)
+        if stage not in order:
+            order.append(stage)
+
+    for stage in targets:
+        visit(stage)
+
+    return order
+
+def run(targets=('vis','model'),params=None,cache_dir=CACHE_DIR,max_bytes=2*1024**3,force=()):
+    '''run the target stages, skipping every stage whose cached output is still valid
+
+    a stage output is restored from the cache when a run with the same fingerprint has been stored,
+    and isn't touched at all when the files in place already come from that run.
+
+    args:
+        targets(list): the stages to bring up to date
+        params(dict): the pipeline parameters, see DEFAULT_PARAMS
+        cache_dir(str): the directory of the cache
+        max_bytes(int): the size the cache is evicted down to after every stored stage
+        force(list): stages to run even when their cached output is valid
+
+    returns:
+        report(list): for every stage its fingerprint, whether it was run, restored or skipped, and the time
+    '''
+    params=dict(DEFAULT_PARAMS,**(params or {}))
+    state_path=os.path.join(cache_dir,'state.json')
+    os.makedirs(cache_dir,exist_ok=True)
+
+    state={}
+    if os.path.isfile(state_path):
+        with open(state_path) as f:
+            state=json.load(f)
+
+    fingerprints={}
+    report=[]
+
+    for stage in plan(targets):
+        start=time.perf_counter()
+        key=fingerprint(stage,params,fingerprints)
+        fingerprints[stage]=key
+
+        outputs=STAGES[stage]['outputs'](params)
+        entry=os.path.join(cache_dir,stage,key)
+        in_place=state.get(stage)==key and all(os.path.exists(path) for path in outputs)
+
+        if stage not in force and in_place:
+            action='skipped'
+        elif stage not in force and os.path.isdir(entry):
+            for i,path in enumerate(outputs):
+                _copy(os.path.join(entry,str(i)),path)
+            action='restored'
+        else:
+            with instrument.span('stage.'+stage):
+                STAGES[stage]['run'](params)
+            tmp_entry=entry+'.tmp'
+            for i,path in enumerate(outputs):
+                _copy(path,os.path.join(tmp_entry,str(i)))
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            os.rename(tmp_entry,entry)
+            action='run'
+
+        #mark the entry as recently used for the eviction
+        if os.path.isdir(entry):
+            os.utime(entry)
+
+        state[stage]=key
+        with open(state_path,'w') as f:
+            json.dump(state,f)
+
+        report.append({'stage':stage,'fingerprint':key,'action':action,'seconds':time.perf_counter()-start})
+        print('{:<10} {:<8} {:.2f}s'.format(stage,action,report[-1]['seconds']))
+
+        evict(cache_dir,max_bytes)
+
+    return report
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='run the preprocess -> completion -> viewed/features -> cube -> vis/model -> targets pipeline')
+    parser.add_argument('stages',nargs='*',help='the stages to bring up to date, vis and model by default')
+    parser.add_argument('--force',nargs='*',default=[],choices=list(STAGES),help='stages to run even if cached')
+    parser.add_argument('--engine',default=DEFAULT_PARAMS['engine'],choices=['interval','merge','index','duckdb'],
+                        help='how the offer windows are computed, index looks them up in a stored per-person event '
+                             'index, duckdb runs them out of core on all the cores')
+    parser.add_argument('--chunksize',type=int,default=DEFAULT_PARAMS['chunksize'])
+    parser.add_argument('--search',default=DEFAULT_PARAMS['search'],choices=['grid','halving'])
+    parser.add_argument('-k',type=int,default=DEFAULT_PARAMS['k'],help='the number of offers targeted per customer')
+    parser.add_argument('--max-cache-mb',type=int,default=2048)
+    parser.add_argument('--trace',default=None,help='write the time and memory of every step to this chrome trace json file')
+    parser.add_argument('--sample-ms',type=float,default=None,help='also sample the stacks every SAMPLE_MS milliseconds')
+    args=parser.parse_args()
+
+    if args.trace:
+        instrument.enable(args.trace,args.sample_ms)
+
+    params={'engine':args.engine,'chunksize':args.chunksize,'search':args.search,'k':args.k}
+    run(args.stages or ['vis','model'],params=params,max_bytes=args.max_cache_mb*1024**2,force=args.force)
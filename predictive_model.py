@@ -1,67 +1,183 @@
 import numpy as np
 import pandas as pd
 
-from os import listdir
-from os.path import isfile, join
-from datetime import datetime
-from collections import Counter
+import os
+import sys
+import tempfile
 
-import seaborn as sns
-import matplotlib.pyplot as plt
+import joblib
 
-from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import GridSearchCV, cross_val_score, train_test_split,cross_validate
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.metrics import f1_score,accuracy_score,roc_auc_score,make_scorer
-from sklearn.linear_model import LogisticRegression
-from sklearn.pipeline import Pipeline
+import storage
+from instrument import traced
+from binning import apply_bins, fit_bins, fit_or_load_bins
+from feature_encoder import fit_encoder, transform, feature_names, save_encoder, load_encoder
 
+#the columns of offer_profile_vie used to create the features and the target
+MODEL_COLUMNS=['age','income','membership_duration(days)','reward','difficulty','duration','web','email',
+               'mobile','social','gender','offer_type','member_year','complete','viewed']
 
-def create_dataset(offer_profile_vie):
+#the numeric features and the categorical features that are one-hot encoded
+FEATURES_NUM=['age','income','membership_duration(days)','reward','difficulty','duration','web','email','mobile','social']
+FEATURES_CAT=['gender','Inc','Age','Dur','offer_type','member_year']
+
+#the directory the tuned classifier and the search results are stored in
+MODEL_DIR='model'
+
+
+def prepare_dataset(offer_profile_vie,bins=None):
+    '''add the Inc, Age and Dur groups and the target to offer_profile_vie
+
+    args:
+        offer_profile_vie(pandas dataframe): the offers with the profile of the customers
+        bins(dict): the edges of the Inc, Age and Dur groups from binning.py, fitted on offer_profile_vie when not given
+
+    returns:
+        offer_profile_vie(pandas dataframe): a copy with the added columns
+        features_num(list): the numeric features
+    '''
+    #offer_profile_vie=offer_profile_vie[~((offer_profile_vie['complete']==0) & (offer_profile_vie['viewed']==0))]
+
+    #group the income, age and membership duration with the same edges as the visualizations
+    offer_profile_vie=apply_bins(offer_profile_vie,bins or fit_bins(offer_profile_vie))
+    
+    offer_profile_vie['target']=offer_profile_vie['complete']*offer_profile_vie['viewed']
+    
+    return offer_profile_vie,FEATURES_NUM
+
+@traced
+def create_dataset(offer_profile_vie,bins=None,encoder=None):
     '''create the dataframe for predicting whether user accept offer_type, the dataframe containing
        profile of a user, the type of offer to predict and whether the user accept the offer
     
     args:
         offer_type(str): the type of offer that we creating dataset for
+        bins(dict): the edges of the Inc, Age and Dur groups from binning.py, fitted on offer_profile_vie when not given
+        encoder(dict): the categories to one-hot encode from feature_encoder.py, fitted on offer_profile_vie when not given
         
     returns:
        customer_offer_df: target and features in the training dataset
     '''
-    #offer_profile_vie=offer_profile_vie[~((offer_profile_vie['complete']==0) & (offer_profile_vie['viewed']==0))]
-    
-    offer_profile_vie['target']=offer_profile_vie['complete']*offer_profile_vie['viewed']
-    
-    features_num=['age','income','membership_duration(days)','reward',\
-                  'difficulty','duration','web', 'email', 'mobile', 'social']
-    
-    features_cat=['gender','Inc','Age','Dur','offer_type','member_year']
+    offer_profile_vie,features_num=prepare_dataset(offer_profile_vie,bins)
+
+    encoder=encoder or fit_encoder(offer_profile_vie,features_num,FEATURES_CAT)
     
-    customer_offer_df=pd.concat([offer_profile_vie[features_num],
-                 pd.get_dummies(offer_profile_vie[features_cat])],axis=1)
+    customer_offer_df=transform(encoder,offer_profile_vie,'frame')
     customer_offer_df['target']=offer_profile_vie['target'].astype('int32')
     
     return customer_offer_df
 
-def optimize_classifier(X,y):
+@traced
+def create_matrix(offer_profile_vie,bins=None,encoder=None,fmt='dense'):
+    '''create the features as a float32 array, or a sparse matrix, and the target
+
+    the decision tree is fitted on float32 features, so the array is used without a copy, unlike
+    the dataframe of create_dataset.
+
+    args:
+        offer_profile_vie, bins, encoder: see create_dataset
+        fmt(str): 'csr' or 'dense', see feature_encoder.transform
+
+    returns:
+        X: the features
+        y(ndarray): the target
+        encoder(dict): the encoder of the features
+    '''
+    offer_profile_vie,features_num=prepare_dataset(offer_profile_vie,bins)
+
+    encoder=encoder or fit_encoder(offer_profile_vie,features_num,FEATURES_CAT)
+
+    return transform(encoder,offer_profile_vie,fmt),offer_profile_vie['target'].to_numpy(dtype=np.int32),encoder
+
+@traced
+def optimize_classifier(X,y,search='grid',n_jobs=None,cache_dir=None):
     '''tuning the hyperparameters of the Random forest classifier
     
     args:
-        X,y(array): features and target array
+        X,y(array): features and target array, X can be a sparse matrix from create_matrix
+        search(str): 'grid' to cross validate every candidate on all the data, 'halving' to run successive
+            halving, which cross validates all the candidates on a small sample and only the best ones on more
+        n_jobs(int): the number of candidates and folds fitted in parallel, -1 for all the cores
+        cache_dir(str): a directory to cache the fitted scaler of every fold in, so that it isn't refitted
+            for every candidate
         
     returns:
         classifiers with tuned hyperparameters
     '''
-    
-    pipeline=Pipeline([('scaler',StandardScaler()),('classifier',DecisionTreeClassifier())])    
+    #sklearn is only imported to train, loading and scoring a stored classifier doesn't need the searches
+    from scipy import sparse
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.model_selection import GridSearchCV
+    from sklearn.experimental import enable_halving_search_cv
+    from sklearn.model_selection import HalvingGridSearchCV
+    from sklearn.tree import DecisionTreeClassifier
+    from sklearn.pipeline import Pipeline
+
+    #sparse features are scaled without centering them so that they stay sparse
+    scaler=StandardScaler(with_mean=not sparse.issparse(X))
+    pipeline=Pipeline([('scaler',scaler),('classifier',DecisionTreeClassifier())],memory=cache_dir)
     param_grid = dict(classifier__max_depth=[1,2,4,8],classifier__min_samples_split=[2,6,8,15],
                       classifier__min_samples_leaf=[2,4,8])
-    grid_search = GridSearchCV(pipeline, param_grid=param_grid,scoring='f1',verbose=3)
 
+    if search=='grid':
+        grid_search = GridSearchCV(pipeline, param_grid=param_grid,scoring='f1',verbose=3,n_jobs=n_jobs)
+    elif search=='halving':
+        grid_search = HalvingGridSearchCV(pipeline, param_grid=param_grid,scoring='f1',factor=3,random_state=0,
+                                          verbose=1,n_jobs=n_jobs)
+    else:
+        raise ValueError('unknown search {}'.format(search))
     
     grid_search.fit(X,y)
     
     return grid_search.best_estimator_, grid_search.cv_results_
 
+def save_search(best_estimator,cv_results,model_dir=MODEL_DIR,encoder=None):
+    '''store the tuned classifier and the cross validation results of the search
+
+    args:
+        best_estimator: the pipeline with the tuned classifier
+        cv_results(dict): the cv_results_ of the search
+        model_dir(str): the directory to store them in
+        encoder(dict): the encoder of the features the classifier was trained on, stored as encoder.json
+
+    returns:
+        paths(list): the stored files
+    '''
+    os.makedirs(model_dir,exist_ok=True)
+    paths=[os.path.join(model_dir,'best_estimator.joblib'),os.path.join(model_dir,'cv_results.csv')]
+
+    joblib.dump(best_estimator,paths[0])
+    pd.DataFrame(cv_results).to_csv(paths[1],index=False)
+
+    if encoder is not None:
+        paths.append(os.path.join(model_dir,'encoder.json'))
+        save_encoder(encoder,paths[2])
+
+    return paths
+
+def load_search(model_dir=MODEL_DIR):
+    '''read the tuned classifier and the cross validation results stored by save_search'''
+    return joblib.load(os.path.join(model_dir,'best_estimator.joblib')),pd.read_csv(os.path.join(model_dir,'cv_results.csv'))
+
+def model_encoder(estimator,model_dir=MODEL_DIR):
+    '''the encoder of the features the stored classifier was trained on, rebuilt from the feature names
+       of the classifier when it was stored without one'''
+    path=os.path.join(model_dir,'encoder.json')
+    if os.path.isfile(path):
+        return load_encoder(path)
+
+    return features_encoder(estimator.feature_names_in_)
+
+def features_encoder(features):
+    '''an encoder whose feature_names are features, named like pd.get_dummies names the dummies'''
+    features=list(features)
+    return {'num':[col for col in features if col in FEATURES_NUM],
+            'cat':{col:[name[len(col)+1:] for name in features if name.startswith(col+'_')] for col in FEATURES_CAT}}
+
+def model_features(estimator,model_dir=MODEL_DIR):
+    '''the names of the features the stored classifier was trained on, in order'''
+    return feature_names(model_encoder(estimator,model_dir))
+
+@traced
 def plot_feature_importance(features,importances):
 
     '''plot the feature importances
@@ -70,6 +186,8 @@ def plot_feature_importance(features,importances):
         features(list): a list of all feature names
         importances(ndarray): an array of all the feature importances 
     '''    
+    import matplotlib.pyplot as plt
+
     indices = np.argsort(importances)
     
     plt.figure(figsize=(12,8))
@@ -79,35 +197,60 @@ def plot_feature_importance(features,importances):
     plt.xlabel('Relative Importance')
     plt.savefig('feat_im.JPEG',bbox_inches='tight')
 
-if __name__=='__main__':
+@traced
+def train_model(offer_profile_vie,bins=None,search='grid',n_jobs=None,model_dir=MODEL_DIR):
+    '''train the decision tree on offer_profile_vie and evaluate it on a held-out test set
 
-    if isfile('offer_profile_vie.csv'):
-        offer_profile_vie=pd.read_csv('offer_profile_vie.csv')
-    else:
-        print('please create the dataset with create_completion.py')
+    args:
+        offer_profile_vie(pandas dataframe): a dataframe containing info on customer, offer and 
+        whether an offer is completed or viewed by a customer.
+        bins(dict): the edges of the Inc, Age and Dur groups, see create_dataset
+        search(str), n_jobs(int): the hyperparameter search, see optimize_classifier
+        model_dir(str): the directory to store the tuned classifier and the search results in, None to not store them
 
-    #read the dataset containing features and target
-    customer_offer_df=create_dataset(offer_profile_vie)
+    returns:
+        best_estimator: the pipeline with the tuned decision tree
+        scores(dict): f1_score, accuracy and roc_auc on the test set
+    '''
+    from sklearn.model_selection import train_test_split
+    from sklearn.metrics import f1_score,accuracy_score,roc_auc_score
 
-    #splite the dataset into training and test set    
-    X=customer_offer_df.iloc[:,:-1]
-    y=customer_offer_df.iloc[:,-1]
-    indices=list(customer_offer_df.index)
+    #read the features and the target, the encoder keeps their columns fixed
+    X,y,encoder=create_matrix(offer_profile_vie,bins)
 
-    X_train, X_test, y_train, y_test, ind_train, ind_test = train_test_split(X,y,indices,random_state=0,stratify=y)
+    #splite the dataset into training and test set    
+    X_train, X_test, y_train, y_test = train_test_split(X,y,random_state=0,stratify=y)
 
     #optimize the decision tree classifier, and the decision tree is selected by com
-    best_estimator,cv_results_acc=optimize_classifier(X_train,y_train)
+    with tempfile.TemporaryDirectory(prefix='pipeline-cache-') as cache_dir:
+        best_estimator,cv_results_acc=optimize_classifier(X_train,y_train,search,n_jobs,cache_dir)
+
+    if model_dir:
+        save_search(best_estimator,cv_results_acc,model_dir,encoder)
 
     #get the feature importances and names
-    features = customer_offer_df.drop(columns=['target']).columns
+    features = feature_names(encoder)
     importances = best_estimator['classifier'].feature_importances_
 
-    plot_feature_importance(importances)
+    plot_feature_importance(features,importances)
 
     #calculate the f1_score, accuracy, roc_auc on the test dataset.
     y_pre = best_estimator.predict(X_test)
 
-    print('f1_score',f1_score(y_test,y_pre))
-    print('accuracy',accuracy_score(y_test,y_pre))
-    print('roc_auc',roc_auc_score(y_test,y_pre))
+    scores={'f1_score':f1_score(y_test,y_pre),'accuracy':accuracy_score(y_test,y_pre),'roc_auc':roc_auc_score(y_test,y_pre)}
+    for name,score in scores.items():
+        print(name,score)
+
+    return best_estimator,scores
+
+if __name__=='__main__':
+
+    try:
+        offer_profile_vie=storage.read_table('offer_profile_vie',columns=MODEL_COLUMNS)
+    except FileNotFoundError:
+        sys.exit('please create the dataset with create_completion.py')
+
+    #python predictive_model.py [grid|halving] searches exhaustively by default, halving runs on all the cores
+    search=sys.argv[1] if len(sys.argv)>1 else 'grid'
+    train_model(offer_profile_vie,fit_or_load_bins(offer_profile_vie),search=search,
+                n_jobs=-1 if search=='halving' else None)
@@ -0,0 +1,124 @@
+import argparse
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import storage
+
+#the figures that can be rendered: the module and function drawing them, and the stored tables
+#(with the columns to read, None for all) passed to the function in order
+FIGURES={
+    'view_cpl_ncpl':('create_vis','create_viewed_vis',[('ocr_cube',None),('ocr_profile_cube',None)]),
+    'offer_profile':('create_vis','create_ocr_offer',[('ocr_cube',None)]),
+    'age_income':('create_vis','create_ocr',[('ocr_cube',None)]),
+    'user_profile_ocr':('create_vis','create_ocr_groups',[('ocr_cube',None),('ocr_profile_cube',None)]),
+    'profile':('create_profile_distribution','create_plot',[('profile',None),('customer_features',None)]),
+}
+
+
+def prepare_inputs(names,directory=storage.DATA_DIR):
+    '''store the cubes and the customer features the figures need when they are missing or older than the
+       tables they are built from, the cubes with the bins of binning.py'''
+    from binning import bins_path
+    tables={table for name in names for table,_ in FIGURES[name][2]}
+
+    cubes=['ocr_cube','ocr_profile_cube']
+    if set(cubes) & tables and any(storage.stale(cube,['offer_profile_vie'],directory,[bins_path(directory)]) for cube in cubes):
+        from binning import fit_or_load_bins
+        from create_vis import build_ocr_cubes, VIS_COLUMNS
+        #the cubes are grouped with the stored bins, the same edges as the model and the bins stage
+        offer_profile_vie=storage.read_table('offer_profile_vie',directory,columns=VIS_COLUMNS)
+        cubes=build_ocr_cubes(offer_profile_vie,fit_or_load_bins(offer_profile_vie,directory))
+        for table,cube in cubes.items():
+            storage.write_table(cube,table,directory)
+
+    if 'customer_features' in tables and storage.stale('customer_features',['transcript'],directory):
+        from customer_features import create_customer_features
+        transcript=storage.read_table('transcript',directory,columns=['person','event','time','amount'])
+        storage.write_table(create_customer_features(transcript),'customer_features',directory)
+
+def render_figure(name,directory=storage.DATA_DIR,out_dir='.',fmt='JPEG',dpi=None):
+    '''render one figure headless with the default style, whatever the process rendered before
+
+    args:
+        name(str): the name of the figure, see FIGURES
+        directory(str): the directory holding the stored tables, they are memory mapped read-only
+        out_dir(str): the directory to save the figure to
+        fmt(str): the file format, e.g. JPEG, png or pdf
+        dpi(int): the resolution, the default of the figure when None
+
+    returns:
+        timing(dict): the figure, its file and the seconds spent reading the tables and rendering
+    '''
+    import importlib
+    import matplotlib
+    matplotlib.use('Agg',force=True)
+    import matplotlib.pyplot as plt
+
+    module,function,tables=FIGURES[name]
+    draw=getattr(importlib.import_module(module),function)
+
+    start=time.perf_counter()
+    args=[storage.read_table(table,directory,columns=columns) for table,columns in tables]
+    read_s=time.perf_counter()-start
+
+    out_file=os.path.join(out_dir,'{}.{}'.format(name,fmt))
+    kwargs={'out_file':out_file} if dpi is None else {'out_file':out_file,'dpi':dpi}
+
+    start=time.perf_counter()
+    with plt.style.context('default'):
+        draw(*args,**kwargs)
+    plt.close('all')
+    render_s=time.perf_counter()-start
+
+    return {'figure':name,'file':out_file,'read_s':read_s,'render_s':render_s}
+
+def render_figures(names=None,directory=storage.DATA_DIR,out_dir='.',fmt='JPEG',dpi=None,workers=None):
+    '''render figures in parallel on a process pool, every figure in a process of its own style
+
+    args:
+        names(list): the figures to render, all of FIGURES by default
+        directory(str): the directory holding the stored tables
+        out_dir(str): the directory to save the figures to
+        fmt(str): the file format, e.g. JPEG, png or pdf
+        dpi(int): the resolution of all the figures, the default of every figure when None
+        workers(int): the number of worker processes, 1 renders in this process
+
+    returns:
+        timings(list): the timing of every figure, see render_figure
+    '''
+    names=list(names or FIGURES)
+    for name in names:
+        if name not in FIGURES:
+            raise ValueError('unknown figure {}'.format(name))
+
+    prepare_inputs(names,directory)
+    os.makedirs(out_dir,exist_ok=True)
+
+    workers=workers or min(len(names),os.cpu_count())
+    n=len(names)
+
+    if workers==1:
+        timings=[render_figure(name,directory,out_dir,fmt,dpi) for name in names]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            timings=list(pool.map(render_figure,names,[directory]*n,[out_dir]*n,[fmt]*n,[dpi]*n))
+
+    for timing in timings:
+        print('{:<18} read {:>7.3f}s render {:>7.3f}s {}'.format(timing['figure'],timing['read_s'],timing['render_s'],timing['file']))
+
+    return timings
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='render the figures headless and in parallel')
+    parser.add_argument('figures',nargs='*',help='the figures to render, all of them by default: '+', '.join(FIGURES))
+    parser.add_argument('--workers',type=int,default=None)
+    parser.add_argument('--format',default='JPEG')
+    parser.add_argument('--dpi',type=int,default=None)
+    parser.add_argument('--out-dir',default='.')
+    args=parser.parse_args()
+
+    start=time.perf_counter()
+    render_figures(args.figures,out_dir=args.out_dir,fmt=args.format,dpi=args.dpi,workers=args.workers)
+    print('total {:.3f}s'.format(time.perf_counter()-start))
@@ -0,0 +1,282 @@
+import argparse
+import collections
+import json
+import queue
+import sys
+import threading
+import time
+
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import storage
+from binning import BINS, bin_codes, bin_labels, load_bins
+from feature_encoder import feature_names
+from predictive_model import FEATURES_NUM, FEATURES_CAT, load_search, model_encoder
+from targeting import OFFER_COLUMNS, block_encoder, encode_block
+
+
+def build_encoder(encoder,portfolio,bins,offer_ids=None):
+    '''freeze the encoding of the model features into fixed positions
+
+    args:
+        encoder(dict): the encoder of the features the model was trained on, see predictive_model.model_encoder
+        portfolio(pandas dataframe): processed portfolio dataset, its informational offers are left out
+        bins(dict): the edges of the Inc, Age and Dur groups from binning.py
+        offer_ids(pandas index): the offer id dictionary to report the offers with, the codes by default
+
+    returns:
+        encoder(dict): the position of every customer feature and the encoded offer rows
+    '''
+    features=pd.Index(feature_names(encoder))
+
+    offers=portfolio[portfolio['offer_type']!='informational']
+    offer_x,offer_pos=encode_block(offers[OFFER_COLUMNS],encoder)
+
+    #the offer rows have zeros at the customer features, so a pair is an offer row plus a customer row
+    offer_rows=np.zeros((len(offers),len(features)))
+    offer_rows[:,offer_pos]=offer_x
+
+    #the customer features are the ones of the model encoder that don't describe the offer, the
+    #Inc, Age and Dur groups are located with the fitted bins
+    customer,_=block_encoder(encoder,[col for col in FEATURES_NUM+FEATURES_CAT if col not in OFFER_COLUMNS])
+    dummy=lambda col,category: features.get_loc('{}_{}'.format(col,category))
+
+    codes=offers['id'].to_numpy()
+
+    return {
+        'features':features,
+        'num':[(col,features.get_loc(col)) for col in customer['num']],
+        'cat':{col:{category:dummy(col,category) for category in categories}
+               for col,categories in customer['cat'].items() if col not in BINS},
+        'bins':{name:(BINS[name]['column'],[dummy(name,label) if label in customer['cat'].get(name,[]) else -1
+                                            for label in bin_labels(name,bins)]) for name in BINS},
+        'edges':bins,
+        'offers':list(offer_ids[codes]) if offer_ids is not None else codes.tolist(),
+        'offer_rows':offer_rows,
+    }
+
+def check_customer(encoder,customer):
+    '''raise a ValueError when one of the numeric attributes of the model is missing, they have no value to
+       stand in for them, while a missing or unknown category only sets none of its dummies'''
+    missing=[col for col,_ in encoder['num'] if customer.get(col) is None]
+    if missing:
+        raise ValueError('missing customer attributes: {}'.format(', '.join(missing)))
+
+def encode_customers(encoder,customers,out):
+    '''encode the attributes of customers straight into the rows of out
+
+    args:
+        encoder(dict): the encoder from build_encoder
+        customers(list): a dict of attributes per customer, e.g. {'gender':'F','age':55,'income':112000,
+            'membership_duration(days)':1600,'member_year':2017}, the numeric attributes are required,
+            see check_customer, unknown and missing categories set none of their dummies
+        out(ndarray): a preallocated array with a row per customer and a column per feature
+    '''
+    out[:]=0
+
+    for i,customer in enumerate(customers):
+        check_customer(encoder,customer)
+        for col,pos in encoder['num']:
+            out[i,pos]=customer[col]
+
+        for col,positions in encoder['cat'].items():
+            pos=positions.get(str(customer.get(col)))
+            if pos is not None:
+                out[i,pos]=1
+
+    #the groups of all the customers are located at once
+    for name,(col,positions) in encoder['bins'].items():
+        values=np.array([customer.get(col,np.nan) for customer in customers],dtype=np.float64)
+        for i,code in enumerate(bin_codes(name,values,encoder['edges'])):
+            if code>=0 and positions[code]>=0:
+                out[i,positions[code]]=1
+
+def compile_model(estimator):
+    '''a function returning the scores of a feature array without the input checks of the pipeline
+
+    a scaler followed by a decision tree, the pipeline of optimize_classifier, is evaluated with the
+    arrays of the fitted scaler and tree; other estimators go through predict_proba.
+    '''
+    steps=list(getattr(estimator,'named_steps',{}).values())
+
+    if len(steps)==2 and hasattr(steps[0],'scale_') and hasattr(steps[1],'tree_'):
+        #a scaler fitted on sparse features doesn't center them
+        mean=steps[0].mean_ if steps[0].with_mean else 0
+        scale=steps[0].scale_ if steps[0].with_std else 1
+        tree=steps[1].tree_
+        value=tree.value[:,0,:]
+        proba=value[:,1]/value.sum(axis=1)
+
+        def score_rows(X):
+            #scaled in place like StandardScaler.transform, the tree compares float32 features
+            X=X.copy()
+            X-=mean
+            X/=scale
+            return proba[tree.apply(X.astype(np.float32,copy=False))]
+
+        return score_rows
+
+    if not hasattr(estimator,'feature_names_in_'):
+        return lambda X: estimator.predict_proba(X)[:,1]
+
+    features=estimator.feature_names_in_
+    return lambda X: estimator.predict_proba(pd.DataFrame(X,columns=features,copy=False))[:,1]
+
+class Scorer:
+    '''score customers against all the offers, batching the requests of concurrent callers
+
+    the requests are queued and a worker thread scores up to max_batch of them at once, waiting at
+    most max_wait_ms for a batch to fill up. With no wait a batch holds the requests that queued up
+    while the previous one was scored. The latency of the last requests is kept for stats().
+    '''
+
+    def __init__(self,estimator,encoder,max_batch=64,max_wait_ms=0.,history=10000):
+        self.encoder=encoder
+        self.score_rows=compile_model(estimator)
+        self.max_batch=max_batch
+        self.max_wait=max_wait_ms/1000
+
+        n_offers,n_features=encoder['offer_rows'].shape
+        self.customer_rows=np.zeros((max_batch,n_features),dtype=np.float32)
+        self.pairs=np.zeros((max_batch,n_offers,n_features),dtype=np.float32)
+
+        #the buffers are shared by the worker and the callers of score_batch
+        self.lock=threading.RLock()
+        self.latencies=collections.deque(maxlen=history)
+        self.requests=queue.Queue()
+        self.worker=threading.Thread(target=self._work,daemon=True)
+        self.worker.start()
+
+    def score_batch(self,customers):
+        '''score the customers right away in the calling thread
+
+        returns:
+            scores(ndarray): the probability that the customer views and completes the offer, a row per customer
+        '''
+        n=len(customers)
+        if n>self.max_batch:
+            return np.vstack([self.score_batch(customers[i:i+self.max_batch]) for i in range(0,n,self.max_batch)])
+
+        with self.lock:
+            encode_customers(self.encoder,customers,self.customer_rows[:n])
+            np.add(self.encoder['offer_rows'][None],self.customer_rows[:n,None],out=self.pairs[:n])
+
+            return self.score_rows(self.pairs[:n].reshape(-1,self.pairs.shape[2])).reshape(n,-1)
+
+    def score(self,customer,k=None):
+        '''score a customer through the micro-batching queue
+
+        args:
+            customer(dict): the attributes of the customer, see encode_customers
+            k(int): only return the k best offers
+
+        returns:
+            offers(list): the offers and their scores, the best first
+        '''
+        #checked before queueing, an invalid customer would fail the whole batch it is scored in
+        check_customer(self.encoder,customer)
+
+        future=Future()
+        self.requests.put((time.perf_counter(),customer,future))
+        scores=future.result()
+
+        order=np.argsort(-scores,kind='stable')[:k]
+        return [{'offer id':self.encoder['offers'][i],'score':float(scores[i])} for i in order]
+
+    def _work(self):
+        while True:
+            batch=[self.requests.get()]
+            deadline=time.perf_counter()+self.max_wait
+
+            while len(batch)<self.max_batch:
+                try:
+                    batch.append(self.requests.get(timeout=max(deadline-time.perf_counter(),0)))
+                except queue.Empty:
+                    break
+
+            try:
+                scores=self.score_batch([customer for _,customer,_ in batch])
+            except Exception as e:
+                for _,_,future in batch:
+                    future.set_exception(e)
+                continue
+
+            end=time.perf_counter()
+            for (start,_,future),row in zip(batch,scores):
+                self.latencies.append(end-start)
+                future.set_result(row)
+
+    def stats(self):
+        '''the number of requests kept and their p50 and p99 latency in milliseconds'''
+        latencies=np.array(self.latencies)*1000
+        if not len(latencies):
+            return {'requests':0,'p50_ms':None,'p99_ms':None}
+
+        return {'requests':len(latencies),'p50_ms':float(np.percentile(latencies,50)),
+                'p99_ms':float(np.percentile(latencies,99))}
+
+def load_scorer(directory=storage.DATA_DIR,model_dir='model',**kwargs):
+    '''load the tuned model, the portfolio, the bins and the offer ids once and build a Scorer'''
+    estimator,_=load_search(model_dir)
+    encoder=build_encoder(model_encoder(estimator,model_dir),storage.read_table('portfolio',directory),load_bins(directory),
+                          storage.load_dictionaries(directory)['offer_ids'])
+
+    return Scorer(estimator,encoder,**kwargs)
+
+def serve(scorer,host='127.0.0.1',port=8000):
+    '''serve the scorer over http on a local port
+
+    POST /score with the attributes of a customer as json, and optionally k, returns the offers and
+    their scores; GET /stats returns the latency percentiles.
+    '''
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self,code,body):
+            data=json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type','application/json')
+            self.send_header('Content-Length',str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path=='/stats':
+                self._reply(200,scorer.stats())
+            else:
+                self._reply(404,{'error':'unknown path {}'.format(self.path)})
+
+        def do_POST(self):
+            if self.path!='/score':
+                return self._reply(404,{'error':'unknown path {}'.format(self.path)})
+
+            try:
+                customer=json.loads(self.rfile.read(int(self.headers.get('Content-Length',0))))
+                k=customer.pop('k',None)
+                self._reply(200,scorer.score(customer,k))
+            except (ValueError,TypeError,AttributeError) as e:
+                self._reply(400,{'error':str(e)})
+
+        def log_message(self,format,*args):
+            pass
+
+    server=ThreadingHTTPServer((host,port),Handler)
+    print('scoring on http://{}:{}/score'.format(host,port))
+    server.serve_forever()
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='serve the tuned model on a local port')
+    parser.add_argument('--host',default='127.0.0.1')
+    parser.add_argument('--port',type=int,default=8000)
+    parser.add_argument('--max-batch',type=int,default=64)
+    parser.add_argument('--max-wait-ms',type=float,default=0.)
+    args=parser.parse_args()
+
+    try:
+        scorer=load_scorer(max_batch=args.max_batch,max_wait_ms=args.max_wait_ms)
+    except FileNotFoundError:
+        sys.exit('please first train the model with predictive_model.py')
+
+    serve(scorer,args.host,args.port)
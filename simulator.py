@@ -0,0 +1,294 @@
+import argparse
+import itertools
+import os
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import storage
+from instrument import traced
+from binning import apply_bins, load_bins
+from predictive_model import features_encoder, load_search, model_encoder
+from targeting import create_blocks, score_chunk
+
+#the totals of every policy, see simulate
+METRICS=['sent','completions','cost','spend','net']
+
+#the state the bootstrap workers share, set once per worker by _init_worker
+_shared=None
+
+
+def score_pairs(estimator,portfolio,profile,bins=None,segment='Inc',chunk_pairs=500000,encoder=None):
+    '''score every customer x offer pair and group the customers into segments
+
+    args:
+        estimator: the tuned pipeline from predictive_model.py
+        portfolio, profile(pandas dataframe): the processed portfolio and profile datasets
+        bins(dict): the edges of the Inc, Age and Dur groups from binning.py
+        segment(str): the customer column the policies select customers by, e.g. 'Inc', 'Age', 'gender'
+        chunk_pairs(int): the number of pairs scored at once
+        encoder(dict): the encoder of the features the estimator was trained on, see predictive_model.model_encoder,
+            rebuilt from the feature names of the estimator by default
+
+    returns:
+        pairs(dict): the scores with a row per customer and a column per offer, the segment code of every
+            customer, the segment labels, and the codes, names, rewards and difficulties of the offers
+    '''
+    encoder=features_encoder(estimator.feature_names_in_) if encoder is None else encoder
+    blocks=create_blocks(portfolio,profile,encoder,bins)
+
+    n_customers,n_offers=len(blocks['customer_x']),len(blocks['offer_x'])
+    chunk=max(1,chunk_pairs//max(n_offers,1))
+
+    scores=np.empty((n_customers,n_offers),dtype=np.float32)
+    for start in range(0,n_customers,chunk):
+        stop=min(start+chunk,n_customers)
+        scores[start:stop]=score_chunk(estimator,blocks,start,stop)
+
+    #the customers in the order of create_blocks
+    customers=apply_bins(profile.dropna(subset=['gender','income']),bins)
+    values=customers[segment]
+    values=values.array if isinstance(values.dtype,pd.CategoricalDtype) else pd.Categorical(values)
+
+    codes=np.asarray(values.codes,dtype=np.int64)
+    labels=[str(category) for category in values.categories]
+    if (codes<0).any():
+        codes[codes<0]=len(labels)
+        labels.append('missing')
+
+    offers=portfolio.set_index('id').loc[blocks['offer']]
+
+    return {'person':blocks['person'],'scores':scores,'segment':codes,'segments':labels,'offers':blocks['offer'],
+            'offer_names':offers['offer name'].astype(str).tolist(),
+            'reward':offers['reward'].to_numpy(dtype=np.float64),
+            'difficulty':offers['difficulty'].to_numpy(dtype=np.float64)}
+
+def estimate_uplift(offer_profile_vie,offers):
+    '''the spend an offer adds when it is viewed and completed, from the offers that were sent before
+
+    the uplift of an offer is the mean spend in its window when it was viewed and completed minus the
+    mean spend when it wasn't viewed, the customers that didn't see it act as the control group. Offers
+    without both groups get their difficulty, the least a completion spends.
+
+    args:
+        offer_profile_vie(pandas dataframe): the offers with their amount_sum, complete and viewed
+        offers(ndarray): the offer codes to estimate the uplift of, e.g. pairs['offers']
+
+    returns:
+        uplift(ndarray): the uplift of every offer
+    '''
+    treated=(offer_profile_vie['complete']==1) & (offer_profile_vie['viewed']==1)
+    control=offer_profile_vie['viewed']==0
+
+    groups=offer_profile_vie.groupby('offer id',observed=True)
+    uplift=offer_profile_vie[treated].groupby('offer id',observed=True)['amount_sum'].mean()- \
+        offer_profile_vie[control].groupby('offer id',observed=True)['amount_sum'].mean()
+
+    difficulty=groups['difficulty'].first()
+    uplift=uplift.reindex(difficulty.index).fillna(difficulty)
+
+    return uplift.reindex(offers).to_numpy(dtype=np.float64)
+
+def policy_grid(n_offers,n_segments,thresholds=np.linspace(0,1,21),offer_sets=None,segment_sets=None):
+    '''every combination of a score threshold, a set of offers and a set of segments
+
+    a policy sends the offers of its set to the customers of its segments whose score is at least its threshold.
+
+    args:
+        n_offers, n_segments(int): the number of offers and segments of the pairs
+        thresholds(array-like): the score thresholds, sorted
+        offer_sets(ndarray): a boolean row per set of offers, every non-empty subset by default
+        segment_sets(ndarray): a boolean row per set of segments, every segment on its own and all of them by default
+
+    returns:
+        policies(dict): the thresholds, and for every policy the position of its threshold, its offers and its segments
+    '''
+    if offer_sets is None:
+        offer_sets=np.array(list(itertools.product([False,True],repeat=n_offers))[1:],dtype=bool)
+    if segment_sets is None:
+        segment_sets=np.vstack([np.eye(n_segments,dtype=bool),np.ones((1,n_segments),dtype=bool)])
+
+    thresholds=np.asarray(thresholds,dtype=np.float64)
+    t,o,s=np.meshgrid(np.arange(len(thresholds)),np.arange(len(offer_sets)),np.arange(len(segment_sets)),indexing='ij')
+
+    return {'thresholds':thresholds,'threshold':t.ravel(),'offers':offer_sets[o.ravel()],'segments':segment_sets[s.ravel()]}
+
+def _cell_index(pairs,thresholds):
+    '''the offer x segment cell and the threshold bucket of every pair, as one flat index
+
+    the bucket of a pair is the number of thresholds at or below its score, so it passes the thresholds
+    before its bucket.
+    '''
+    n_segments,n_buckets=len(pairs['segments']),len(thresholds)+1
+
+    bucket=np.searchsorted(thresholds,pairs['scores'],side='right')
+    cell=np.arange(pairs['scores'].shape[1])[None,:]*n_segments+pairs['segment'][:,None]
+
+    return (cell*n_buckets+bucket).ravel()
+
+def _cell_sets(policies,n_offers,n_segments):
+    '''the distinct sets of offer x segment cells the policies send to, and the set of every policy'''
+    mask=(policies['offers'][:,:,None] & policies['segments'][:,None,:]).reshape(len(policies['threshold']),-1)
+    #the rows are told apart by their packed bytes, which is much faster than np.unique(axis=0)
+    which,_=pd.factorize(pd.Series([row.tobytes() for row in np.packbits(mask,axis=1)]))
+    _,first=np.unique(which,return_index=True)
+
+    return mask[first].astype(np.float64),which
+
+def _evaluate(index,scores,weights,shape,cells,threshold,reward,uplift,send_cost):
+    '''the totals of every policy from the flat cell index of the pairs and their weights'''
+    n_offers,n_segments,n_buckets=shape
+    sets,which=cells
+
+    #the pairs and the expected completions of every cell and bucket, summed over the buckets above a
+    #threshold to get the ones passing it
+    sent=np.bincount(index,weights,minlength=n_offers*n_segments*n_buckets).reshape(-1,n_buckets)
+    completions=np.bincount(index,scores if weights is None else scores*weights,
+                            minlength=n_offers*n_segments*n_buckets).reshape(-1,n_buckets)
+    sent=np.cumsum(sent[:,::-1],axis=1)[:,::-1][:,1:]
+    completions=np.cumsum(completions[:,::-1],axis=1)[:,::-1][:,1:]
+
+    #the totals of every set of cells at every threshold, then the ones of every policy
+    cell_offer=np.repeat(np.arange(n_offers),n_segments)[:,None]
+    totals={'sent':sets@sent,'completions':sets@completions,'cost':sets@(completions*reward[cell_offer]),
+            'spend':sets@(completions*uplift[cell_offer])}
+    totals={metric:values[which,threshold] for metric,values in totals.items()}
+    totals['net']=totals['spend']-totals['cost']-send_cost*totals['sent']
+
+    return totals
+
+def _init_worker(shared):
+    global _shared
+    _shared=shared
+
+def _bootstrap(seeds,metrics):
+    '''the totals of the policies on the customers resampled with every seed, one row per seed'''
+    shared=_shared
+    n_offers=shared['shape'][0]
+
+    replicates={metric:[] for metric in metrics}
+    for seed in seeds:
+        #a poisson(1) count per customer resamples the customers with replacement without sorting them
+        counts=np.random.default_rng(seed).poisson(1.,shared['n_customers']).astype(np.float64)
+        totals=_evaluate(shared['index'],shared['scores'],np.repeat(counts,n_offers),shared['shape'],
+                         shared['cells'],shared['threshold'],shared['reward'],shared['uplift'],shared['send_cost'])
+        for metric in metrics:
+            replicates[metric].append(totals[metric].astype(np.float32))
+
+    return {metric:np.vstack(rows) for metric,rows in replicates.items()}
+
+@traced
+def simulate(pairs,policies,uplift=None,send_cost=0.,bootstrap=0,metrics=('completions','net'),level=.9,
+             workers=1,seed=0):
+    '''evaluate all the targeting policies on the scored pairs at once
+
+    a policy sends its offers to the customers of its segments that score at least its threshold. The
+    score is the probability that an offer is viewed and completed, so the expected completions of a
+    policy are the sum of the scores of the pairs it sends, its cost is the rewards paid for them, its
+    spend is the uplift of the completed offers and its net is the spend minus the cost and the cost of
+    sending the offers.
+
+    args:
+        pairs(dict): the scored pairs from score_pairs
+        policies(dict): the policies from policy_grid
+        uplift(ndarray): the spend every completed offer adds, see estimate_uplift, the difficulty by default
+        send_cost(float): the cost of sending an offer
+        bootstrap(int): the number of times the customers are resampled to get the confidence
+            intervals of metrics, none by default
+        metrics(list): the metrics to get the confidence intervals of
+        level(float): the confidence level of the intervals
+        workers(int): the number of processes the resamples are spread over
+        seed(int): the seed of the resamples, the intervals don't depend on the number of workers
+
+    returns:
+        results(pandas dataframe): the threshold, offers, segments and METRICS of every policy, the lower
+            and upper bound of the metrics when bootstrapping, the best net first
+    '''
+    thresholds=policies['thresholds']
+    n_customers,n_offers=pairs['scores'].shape
+    shape=(n_offers,len(pairs['segments']),len(thresholds)+1)
+
+    reward=pairs['reward']
+    uplift=pairs['difficulty'] if uplift is None else np.asarray(uplift,dtype=np.float64)
+
+    index=_cell_index(pairs,thresholds)
+    scores=pairs['scores'].ravel().astype(np.float64)
+
+    cells=_cell_sets(policies,n_offers,len(pairs['segments']))
+
+    totals=_evaluate(index,scores,None,shape,cells,policies['threshold'],reward,uplift,send_cost)
+
+    results=pd.DataFrame({
+        'threshold':thresholds[policies['threshold']],
+        'offers':['+'.join(itertools.compress(pairs['offer_names'],row)) for row in policies['offers']],
+        'segments':['+'.join(itertools.compress(pairs['segments'],row)) for row in policies['segments']],
+    })
+    for metric in METRICS:
+        results[metric]=totals[metric]
+    results['sent']=np.rint(results['sent']).astype(np.int64)
+    results['roi']=results['net']/results['cost'].where(results['cost']>0)
+
+    if bootstrap:
+        shared={'index':index,'scores':scores,'n_customers':n_customers,'shape':shape,'cells':cells,
+                'threshold':policies['threshold'],
+                'reward':reward,'uplift':uplift,'send_cost':send_cost}
+        seeds=np.random.SeedSequence(seed).spawn(bootstrap)
+        chunks=[seeds[i::workers] for i in range(min(workers,bootstrap))]
+
+        if workers==1:
+            _init_worker(shared)
+            done=[_bootstrap(seeds,metrics)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers,initializer=_init_worker,initargs=(shared,)) as pool:
+                done=list(pool.map(_bootstrap,chunks,[metrics]*len(chunks)))
+
+        for metric in metrics:
+            replicates=np.vstack([chunk[metric] for chunk in done])
+            low,high=np.quantile(replicates,[(1-level)/2,(1+level)/2],axis=0)
+            results[metric+'_low']=low
+            results[metric+'_high']=high
+
+    return results.sort_values('net',ascending=False,kind='stable',ignore_index=True)
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='evaluate targeting policies with the tuned model')
+    parser.add_argument('--segment',default='Inc',help='the customer column to segment by, e.g. Inc, Age, Dur, gender')
+    parser.add_argument('--thresholds',type=int,default=21,help='the number of score thresholds between 0 and 1')
+    parser.add_argument('--send-cost',type=float,default=0.)
+    parser.add_argument('--bootstrap',type=int,default=0,help='the number of resamples for the confidence intervals')
+    parser.add_argument('--workers',type=int,default=os.cpu_count())
+    parser.add_argument('--out',default='policies.csv')
+    args=parser.parse_args()
+
+    try:
+        estimator,_=load_search()
+    except FileNotFoundError:
+        sys.exit('please first train the model with predictive_model.py')
+
+    portfolio,profile=[storage.read_table(name) for name in ['portfolio','profile']]
+
+    encoder=model_encoder(estimator)
+
+    start=time.perf_counter()
+    pairs=score_pairs(estimator,portfolio,profile,load_bins(),args.segment,encoder=encoder)
+    scored=time.perf_counter()
+
+    #the uplift is estimated from the offers that were sent before when they have been stored
+    try:
+        uplift=estimate_uplift(storage.read_table('offer_profile_vie',columns=['offer id','difficulty','amount_sum',
+                                                                               'complete','viewed']),pairs['offers'])
+    except FileNotFoundError:
+        uplift=None
+
+    policies=policy_grid(len(pairs['offers']),len(pairs['segments']),np.linspace(0,1,args.thresholds))
+    results=simulate(pairs,policies,uplift,args.send_cost,args.bootstrap,workers=args.workers)
+    results.to_csv(args.out,index=False)
+
+    print('scored {} pairs in {:.2f}s, evaluated {} policies in {:.2f}s'.format(
+        pairs['scores'].size,scored-start,len(results),time.perf_counter()-scored))
+    with pd.option_context('display.width',200,'display.max_columns',20):
+        print(results.head(10))
@@ -0,0 +1,348 @@
+import glob
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR='preprocessed'
+
+#the explicit column types of every dataset handed over between the scripts, columns that are
+#not listed here are not stored
+SCHEMAS={
+    'portfolio':{'reward':'int64','difficulty':'int64','duration':'int64','offer_type':'category','id':'int16',
+                 'web':'int8','email':'int8','mobile':'int8','social':'int8','offer name':'object'},
+    'profile':{'gender':'category','age':'int64','id':'int32','income':'float64','member_date':'datetime64[ns]',
+               'member_year':'category','member_month':'category','member_day':'category',
+               'membership_duration(days)':'int64'},
+    'transcript':{'person':'int32','event':'category','time':'int64','offer id':'int16',
+                  'amount':'float32','offer_reward':'float32'},
+    'offer_profile_vie':{'person':'int32','time_rec':'int64','offer id':'int16','reward':'int64',
+                         'difficulty':'int64','duration':'int64','offer_type':'category','web':'int8',
+                         'email':'int8','mobile':'int8','social':'int8','offer name':'category',
+                         'offer_del':'int64','gender':'category','age':'int64','income':'float64',
+                         'member_date':'datetime64[ns]','member_year':'category','member_month':'category',
+                         'member_day':'category','membership_duration(days)':'int64','amount_sum':'float64',
+                         'amount_max':'float64','complete':'int32','sum_till_com':'float64',
+                         'num_till_com':'float64','cpl_time':'float64','viewed':'float64'},
+}
+
+#the state kept for incremental updates, see incremental.py
+SCHEMAS['transcript_tail']=SCHEMAS['transcript']
+SCHEMAS['pending_windows']=dict(SCHEMAS['offer_profile_vie'],run_sum='float64',run_num='int64')
+
+#the per-customer aggregates of the transcript, see customer_features.py
+SCHEMAS['customer_features']={'person':'int32','total_spend':'float64','n_transactions':'int64',
+                              'offers_received':'int64','offers_viewed':'int64','offers_completed':'int64',
+                              'first_activity':'int64','last_activity':'int64','segment':'category'}
+
+#the k best offers of every customer according to the model, see targeting.py
+SCHEMAS['targets']={'person':'int32','rank':'int8','offer id':'int16','score':'float32'}
+
+#the id dictionaries: the customer and offer ids are stored as their position in these
+SCHEMAS['person_ids']={'id':'object'}
+SCHEMAS['offer_ids']={'id':'object'}
+
+#the columns of every dataset holding codes of an id dictionary
+ID_COLUMNS={
+    'portfolio':{'id':'offer_ids'},
+    'profile':{'id':'person_ids'},
+    'transcript':{'person':'person_ids','offer id':'offer_ids'},
+    'offer_profile_vie':{'person':'person_ids','offer id':'offer_ids'},
+}
+ID_COLUMNS['offer_profile']=ID_COLUMNS['transcript_tail']=ID_COLUMNS['pending_windows']=ID_COLUMNS['offer_profile_vie']
+ID_COLUMNS['customer_features']={'person':'person_ids'}
+ID_COLUMNS['targets']=ID_COLUMNS['transcript']
+
+#the datasets that are updated by appending parts, a row of a later part replaces the rows of the
+#earlier parts with the same keys, see incremental.py
+UPSERT_KEYS={'offer_profile_vie':['person','offer id','time_rec']}
+
+FORMATS=['feather','parquet','csv']
+
+#a dataset that has more parts than this after an append is rewritten as a single part
+COMPACT_PARTS=16
+
+
+def apply_schema(df,name):
+    '''keep the columns of the dataset schema and cast them to their types
+
+    args:
+        df(pandas dataframe): the dataset
+        name(str): the name of the dataset, datasets without a schema are returned unchanged
+
+    returns:
+        df(pandas dataframe): the typed dataset
+    '''
+    if name not in SCHEMAS:
+        return df
+
+    schema={col:dtype for col,dtype in SCHEMAS[name].items() if col in df.columns}
+    df=df[list(schema)]
+
+    #csv files store the categories as text, so they are re-typed on read as well
+    return df.astype({col:dtype for col,dtype in schema.items() if df[col].dtype!=dtype})
+
+def table_parts(name,directory=DATA_DIR):
+    '''find the parts of a stored dataset
+
+    args:
+        name(str): the name of the dataset
+        directory(str): the directory holding the datasets
+
+    returns:
+        fmt(str): the format the dataset is stored in
+        parts(list): the paths of all the parts, in the order they were written
+    '''
+    for fmt in FORMATS[:2]:
+        parts=sorted(glob.glob(os.path.join(directory,name,'part-*.'+fmt)))
+        if parts:
+            return fmt,parts
+
+    csv_file=os.path.join(directory,name+'.csv')
+    if os.path.isfile(csv_file):
+        return 'csv',[csv_file]
+
+    raise FileNotFoundError('no stored dataset {} in {}'.format(name,directory))
+
+def stale(name,inputs,directory=DATA_DIR,files=()):
+    '''tell whether a derived dataset has to be rebuilt: it is not stored, or one of the datasets or files it
+       is built from was written after it, e.g. by an append
+
+    args:
+        name(str): the name of the derived dataset
+        inputs(list): the names of the datasets it is built from
+        directory(str): the directory holding the datasets
+        files(list): other files it is built from, e.g. the bins, those that don't exist are skipped
+
+    returns:
+        stale(bool): True when the dataset is missing or older than any of its inputs
+    '''
+    def modified(table):
+        return max(os.path.getmtime(part) for part in table_parts(table,directory)[1])
+
+    try:
+        built=modified(name)
+    except FileNotFoundError:
+        return True
+
+    times=[modified(table) for table in inputs]+[os.path.getmtime(file) for file in files if os.path.isfile(file)]
+
+    return any(time>built for time in times)
+
+def write_table(df,name,directory=DATA_DIR,fmt='feather',part=0):
+    '''write a dataset in a columnar format with its schema applied
+
+    a dataset is a directory of parts so that it can be written chunk by chunk; part 0 replaces
+    whatever was stored before in any format, the following parts are appended.
+
+    args:
+        df(pandas dataframe): the dataset
+        name(str): the name of the dataset
+        directory(str): the directory holding the datasets
+        fmt(str): 'feather' (uncompressed so that it can be memory mapped), 'parquet' or 'csv' to export
+        part(int): the number of the part to write
+
+    returns:
+        path(str): the path of the written file
+    '''
+    if fmt not in FORMATS:
+        raise ValueError('unknown format {}'.format(fmt))
+
+    df=apply_schema(df,name).reset_index(drop=True)
+    table_dir=os.path.join(directory,name)
+    csv_file=os.path.join(directory,name+'.csv')
+
+    #table_parts prefers the columnar parts, so the files of the other formats are removed or they
+    #would be read instead of the new ones
+    if part==0:
+        for old_file in glob.glob(os.path.join(table_dir,'part-*'))+glob.glob(csv_file):
+            os.remove(old_file)
+
+    if fmt=='csv':
+        os.makedirs(directory,exist_ok=True)
+        df.to_csv(csv_file,mode='w' if part==0 else 'a',header=part==0,index=False)
+        return csv_file
+
+    os.makedirs(table_dir,exist_ok=True)
+
+    path=os.path.join(table_dir,'part-{:05d}.{}'.format(part,fmt))
+
+    if fmt=='feather':
+        df.to_feather(path,compression='uncompressed')
+    else:
+        df.to_parquet(path,index=False)
+
+    return path
+
+def append_table(df,name,directory=DATA_DIR):
+    '''append df to a stored dataset as a new part in the format the dataset is stored in, once there are
+       more than COMPACT_PARTS parts the dataset is compacted into one
+
+    args:
+        df(pandas dataframe): the rows to append
+        name(str): the name of the dataset
+        directory(str): the directory holding the datasets
+
+    returns:
+        path(str): the path of the written file
+    '''
+    try:
+        fmt,parts=table_parts(name,directory)
+    except FileNotFoundError:
+        return write_table(df,name,directory)
+
+    part=len(parts) if fmt!='csv' else 1
+    path=write_table(df,name,directory,fmt=fmt,part=part)
+
+    if part>=COMPACT_PARTS:
+        path=compact_table(name,directory)
+
+    return path
+
+def compact_table(name,directory=DATA_DIR):
+    '''rewrite a stored dataset as part 0, the rows replaced by later parts are dropped on the way
+
+    args:
+        name(str): the name of the dataset
+        directory(str): the directory holding the datasets
+
+    returns:
+        path(str): the path of the written file
+    '''
+    fmt,parts=table_parts(name,directory)
+
+    #the parts are removed by write_table, so they are read into memory rather than memory mapped
+    return write_table(read_table(name,directory,memory_map=False),name,directory,fmt=fmt)
+
+def read_table(name,directory=DATA_DIR,columns=None,memory_map=True):
+    '''read a stored dataset, of the rows with the same UPSERT_KEYS only the last written one is kept
+
+    args:
+        name(str): the name of the dataset
+        directory(str): the directory holding the datasets
+        columns(list): only read these columns
+        memory_map(bool): memory map feather files instead of reading them, the numeric columns
+            without missing values are then used without a copy
+
+    returns:
+        df(pandas dataframe): the dataset
+    '''
+    import pyarrow as pa
+    import pyarrow.feather
+    import pyarrow.parquet
+
+    fmt,parts=table_parts(name,directory)
+
+    #a csv file is appended to in place, so it may always hold replaced rows
+    keys=UPSERT_KEYS.get(name) if len(parts)>1 or fmt=='csv' else None
+    if keys and columns is not None:
+        columns,selected=list(columns)+[key for key in keys if key not in columns],columns
+
+    if fmt=='csv':
+        df=apply_schema(pd.read_csv(parts[0],usecols=columns),name)
+    else:
+        if fmt=='feather':
+            tables=[pyarrow.feather.read_table(part,columns=columns,memory_map=memory_map) for part in parts]
+        else:
+            tables=[pyarrow.parquet.read_table(part,columns=columns,memory_map=memory_map) for part in parts]
+
+        #parts written from different chunks may carry different category dictionaries
+        table=pa.concat_tables(tables,promote_options='permissive') if len(tables)>1 else tables[0]
+        df=table.to_pandas(split_blocks=True)
+
+    if keys:
+        df=df[~df.duplicated(keys,keep='last')].reset_index(drop=True)
+        df=df if columns is None else df[selected]
+
+    return df
+
+def load_dictionaries(directory=DATA_DIR):
+    '''read the id dictionaries, dictionaries that haven't been stored yet are empty
+
+    returns:
+        dictionaries(dict): a pandas index of the ids keyed by the dictionary name, the code of an id
+            is its position in the index
+    '''
+    dictionaries={}
+    for name in ['person_ids','offer_ids']:
+        try:
+            dictionaries[name]=pd.Index(read_table(name,directory)['id'].to_numpy(),dtype=object)
+        except FileNotFoundError:
+            dictionaries[name]=pd.Index([],dtype=object)
+
+    return dictionaries
+
+def save_dictionaries(dictionaries,directory=DATA_DIR,fmt='feather'):
+    '''store the id dictionaries next to the datasets'''
+    for name,ids in dictionaries.items():
+        write_table(pd.DataFrame({'id':ids.to_numpy()}),name,directory,fmt=fmt)
+
+def encode_ids(df,name,dictionaries):
+    '''replace the id columns of a dataset by their integer codes
+
+    ids that aren't in the dictionaries yet are appended to them, so the codes stay valid for the
+    chunks encoded before. Missing ids get the code -1.
+
+    args:
+        df(pandas dataframe): the dataset with string ids
+        name(str): the name of the dataset, see ID_COLUMNS
+        dictionaries(dict): the id dictionaries from load_dictionaries, updated in place
+
+    returns:
+        df(pandas dataframe): the dataset with the ids replaced by int32 customer and int16 offer codes
+    '''
+    df=df.copy()
+
+    for col,dictionary in ID_COLUMNS.get(name,{}).items():
+        if col not in df.columns:
+            continue
+
+        values=np.asarray(df[col],dtype=object)
+        codes=dictionaries[dictionary].get_indexer(values)
+
+        #add the new ids in the order they first appear
+        new=pd.unique(values[(codes<0) & pd.notnull(values)])
+        if len(new):
+            dictionaries[dictionary]=dictionaries[dictionary].append(pd.Index(new,dtype=object))
+            codes=dictionaries[dictionary].get_indexer(values)
+
+        df[col]=codes.astype(SCHEMAS[name][col])
+
+    return df
+
+def decode_ids(df,name,dictionaries):
+    '''replace the id codes of a dataset by the ids, as categoricals sharing the dictionary
+
+    args:
+        df(pandas dataframe): the dataset with id codes
+        name(str): the name of the dataset, see ID_COLUMNS
+        dictionaries(dict): the id dictionaries from load_dictionaries
+
+    returns:
+        df(pandas dataframe): the dataset with the ids
+    '''
+    df=df.copy()
+
+    for col,dictionary in ID_COLUMNS.get(name,{}).items():
+        if col in df.columns:
+            df[col]=pd.Categorical.from_codes(df[col].to_numpy(dtype=np.int64),categories=dictionaries[dictionary])
+
+    return df
+
+def export_csv(name,out_file=None,directory=DATA_DIR):
+    '''export a stored dataset to a csv file with the ids decoded
+
+    args:
+        name(str): the name of the dataset
+        out_file(str): the csv file to write, <directory>/<name>.csv by default
+        directory(str): the directory holding the datasets
+    '''
+    out_file=out_file or os.path.join(directory,name+'.csv')
+    decode_ids(read_table(name,directory),name,load_dictionaries(directory)).to_csv(out_file,index=False)
+
+    return out_file
+
+if __name__=='__main__':
+    #export a dataset to csv, e.g. python storage.py offer_profile_vie offer_profile_vie.csv
+    print(export_csv(*sys.argv[1:3]))
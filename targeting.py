@@ -0,0 +1,150 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import storage
+from instrument import traced
+from binning import apply_bins, load_bins
+from feature_encoder import feature_names, transform
+from predictive_model import features_encoder, load_search, model_encoder
+
+#the columns of portfolio the offer features are created from, the rest of the features describe the customer
+OFFER_COLUMNS=['reward','difficulty','duration','web','email','mobile','social','offer_type']
+
+
+def block_encoder(encoder,columns):
+    '''the part of the model encoder that encodes columns, and the positions of its features in the model features'''
+    block={'num':[col for col in encoder['num'] if col in columns],
+           'cat':{col:categories for col,categories in encoder['cat'].items() if col in columns}}
+
+    return block,pd.Index(feature_names(encoder)).get_indexer(feature_names(block))
+
+def encode_block(df,encoder):
+    '''encode the model features among the columns of df with the model encoder and return their positions
+       in the model features, categories the model wasn't trained on set no dummy'''
+    block,positions=block_encoder(encoder,df.columns)
+
+    return transform(block,df,'dense'),positions
+
+def create_blocks(portfolio,profile,encoder,bins=None):
+    '''create the customer and the offer halves of the model features
+
+    every customer x offer row of the features is a customer row next to an offer row, so the
+    halves are encoded once and only repeated per chunk. The customers without gender or income and
+    the informational offers are left out like in create_completion_df.
+
+    args:
+        portfolio(pandas dataframe): processed portfolio dataset
+        profile(pandas dataframe): processed profile dataset
+        encoder(dict): the encoder of the features the model was trained on, see predictive_model.model_encoder
+        bins(dict): the edges of the Inc, Age and Dur groups from binning.py
+
+    returns:
+        blocks(dict): the customer and offer codes, feature arrays and the positions of their columns
+    '''
+    customers=profile.dropna(subset=['gender','income'])
+    customers=apply_bins(customers,bins)
+
+    offers=portfolio[portfolio['offer_type']!='informational']
+
+    #the offer columns of profile, if any, are left to the offer half
+    customer_x,customer_pos=encode_block(customers.drop(columns=OFFER_COLUMNS,errors='ignore'),encoder)
+    offer_x,offer_pos=encode_block(offers[OFFER_COLUMNS],encoder)
+
+    return {'person':customers['id'].to_numpy(),'customer_x':customer_x,'customer_pos':customer_pos,
+            'offer':offers['id'].to_numpy(),'offer_x':offer_x,'offer_pos':offer_pos,
+            'features':pd.Index(feature_names(encoder))}
+
+def score_chunk(estimator,blocks,start,stop):
+    '''score every pair of the customers start:stop and the offers
+
+    returns:
+        scores(ndarray): the probability that the customer views and completes the offer, one row per customer
+    '''
+    customer_x=blocks['customer_x'][start:stop]
+    n_customers,n_offers=len(customer_x),len(blocks['offer_x'])
+
+    #unseen dummies stay zero, the features are float32 like the ones the model is trained on
+    X=np.zeros((n_customers*n_offers,len(blocks['features'])),dtype=np.float32)
+    X[:,blocks['customer_pos']]=np.repeat(customer_x,n_offers,axis=0)
+    X[:,blocks['offer_pos']]=np.tile(blocks['offer_x'],(n_customers,1))
+
+    #estimators fitted on a dataframe check the feature names, the ones fitted on create_matrix don't have any
+    if hasattr(estimator,'feature_names_in_'):
+        X=pd.DataFrame(X,columns=blocks['features'],copy=False)
+    scores=estimator.predict_proba(X)[:,1]
+
+    return scores.reshape(n_customers,n_offers)
+
+def top_k(scores,k):
+    '''the positions of the k highest scores of every row, highest first'''
+    k=min(k,scores.shape[1])
+    top=np.argpartition(-scores,k-1,axis=1)[:,:k]
+    order=np.argsort(-np.take_along_axis(scores,top,axis=1),axis=1,kind='stable')
+
+    return np.take_along_axis(top,order,axis=1)
+
+@traced
+def target_offers(estimator,portfolio,profile,bins=None,k=3,chunk_pairs=500000,
+                  directory=storage.DATA_DIR,encoder=None):
+    '''score all the customer x offer pairs and store the k best offers of every customer in the targets dataset
+
+    the pairs are scored chunk by chunk of customers so that at most chunk_pairs rows of features are
+    in memory, and every chunk is written as a part of its own.
+
+    args:
+        estimator: the tuned pipeline from predictive_model.py
+        portfolio, profile(pandas dataframe): the processed portfolio and profile datasets
+        bins(dict): the edges of the Inc, Age and Dur groups from binning.py
+        k(int): the number of offers to keep per customer
+        chunk_pairs(int): the number of pairs scored at once
+        directory(str): the directory to store the targets in
+        encoder(dict): the encoder of the features the estimator was trained on, see predictive_model.model_encoder,
+            rebuilt from the feature names of the estimator by default
+
+    returns:
+        n_pairs(int): the number of pairs scored
+    '''
+    encoder=features_encoder(estimator.feature_names_in_) if encoder is None else encoder
+    blocks=create_blocks(portfolio,profile,encoder,bins)
+
+    n_customers,n_offers=len(blocks['customer_x']),len(blocks['offer_x'])
+    chunk=max(1,chunk_pairs//max(n_offers,1))
+
+    for part,start in enumerate(range(0,max(n_customers,1),chunk)):
+        stop=min(start+chunk,n_customers)
+        scores=score_chunk(estimator,blocks,start,stop)
+        top=top_k(scores,k)
+
+        targets=pd.DataFrame({'person':np.repeat(blocks['person'][start:stop],top.shape[1]),
+                              'rank':np.tile(np.arange(1,top.shape[1]+1),stop-start),
+                              'offer id':blocks['offer'][top.ravel()],
+                              'score':np.take_along_axis(scores,top,axis=1).ravel()})
+        storage.write_table(targets,'targets',directory,part=part)
+
+    return n_customers*n_offers
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='store the k best offers of every customer according to the tuned model')
+    parser.add_argument('-k',type=int,default=3)
+    parser.add_argument('--chunk-pairs',type=int,default=500000)
+    args=parser.parse_args()
+
+    try:
+        estimator,_=load_search()
+    except FileNotFoundError:
+        sys.exit('please first train the model with predictive_model.py')
+
+    portfolio,profile=[storage.read_table(name) for name in ['portfolio','profile']]
+
+    encoder=model_encoder(estimator)
+
+    start=time.perf_counter()
+    n_pairs=target_offers(estimator,portfolio,profile,load_bins(),k=args.k,chunk_pairs=args.chunk_pairs,
+                          encoder=encoder)
+    seconds=time.perf_counter()-start
+
+    print('scored {} pairs in {:.2f}s, {:.0f} pairs per minute'.format(n_pairs,seconds,n_pairs/seconds*60))